@@ -1,12 +1,35 @@
+import asyncio
+import contextvars
+import copy
+import functools
+import hashlib
+import io
 import logging
 import json
+import math
 import os
-from datetime import datetime
+import random
+import signal
+import socket
+import sqlite3
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
+import httpx
 from telegram import Update
-from telegram.ext import Application, MessageHandler, CommandHandler, ContextTypes, filters
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.ext import (
+    Application, ApplicationHandlerStop, BaseRateLimiter, BaseUpdateProcessor, ChatMemberHandler, MessageHandler, CommandHandler,
+    ContextTypes, TypeHandler, filters
+)
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
 # Try to load .env file if python-dotenv is available
 try:
@@ -15,6 +38,12 @@ try:
 except ImportError:
     pass
 
+# Pillow is only needed for the perceptual near-duplicate check
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 # Enable logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -30,18 +59,130 @@ DATA_FILE = os.path.join(DATA_DIR, 'user_deficits.json')
 TIMEZONE_FILE = os.path.join(DATA_DIR, 'group_timezone.json')
 USER_TIMEZONES_FILE = os.path.join(DATA_DIR, 'user_timezones.json')
 HASH_FILE = os.path.join(DATA_DIR, 'video_hashes.json')
+ROLLOVER_FILE = os.path.join(DATA_DIR, 'rollover_runs.json')
+OUTBOX_FILE = os.path.join(DATA_DIR, 'outbox.json')
+REMINDERS_FILE = os.path.join(DATA_DIR, 'reminders.json')
+JOB_RUNS_FILE = os.path.join(DATA_DIR, 'job_runs.json')
+ACTIVITY_FILE = os.path.join(DATA_DIR, 'user_activities.json')
+SQLITE_FILE = os.path.join(DATA_DIR, 'bot_data.sqlite3')
 
-# Minimum required video duration in seconds (2 hours)
-MIN_DURATION = 2 * 60 * 60  # 7200 seconds
+# Multi-group: each group chat gets its own data partition under chats/<chat_id>/
+# (off = one group per deployment, everything in DATA_DIR as before)
+MULTI_GROUP = os.getenv('MULTI_GROUP', '0') == '1'
+PARTITIONS_DIR = os.path.join(DATA_DIR, 'chats')
+
+# Storage backend: 'json' (flat files, default) or 'sqlite' (WAL mode, row-level writes)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+
+# Journal: user changes are appended to a journal and compacted into the snapshot
+# (user_deficits.json) after this many records
+JOURNAL_COMPACT_RECORDS = int(os.getenv('JOURNAL_COMPACT_RECORDS', '500'))
+
+# Activity log: JSONL segments per day, rotated by size and deleted after the retention window
+ACTIVITY_LOG_DIR = os.path.join(DATA_DIR, 'activity_logs')
+ACTIVITY_RETENTION_DAYS = int(os.getenv('ACTIVITY_RETENTION_DAYS', '30'))
+ACTIVITY_SEGMENT_MAX_BYTES = int(os.getenv('ACTIVITY_SEGMENT_MAX_BYTES', str(5 * 1024 * 1024)))
+
+# Duplicate-video index: entries older than this move to a cold archive (0 = never)
+DEDUP_RETENTION_DAYS = int(os.getenv('DEDUP_RETENTION_DAYS', '90'))
+# Optional Bloom filter in front of the index (1 = on) and the number of videos it is sized for
+DEDUP_BLOOM_FILTER = os.getenv('DEDUP_BLOOM_FILTER', '0') == '1'
+DEDUP_BLOOM_CAPACITY = int(os.getenv('DEDUP_BLOOM_CAPACITY', '100000'))
+
+# Near-duplicate check: a perceptual hash of each video's thumbnail is compared with earlier
+# videos of about the same length, to catch re-encoded or trimmed re-uploads (needs Pillow).
+# 'reject' (default) treats a match as a duplicate; 'flag' credits it but flags it for admins
+# (/flagged), for groups whose daily recordings of the same desk look alike
+PERCEPTUAL_DEDUP = os.getenv('PERCEPTUAL_DEDUP', '0') == '1'
+PERCEPTUAL_DEDUP_DISTANCE = int(os.getenv('PERCEPTUAL_DEDUP_DISTANCE', '6'))  # differing bits out of 64
+PERCEPTUAL_DEDUP_DURATION_SECONDS = int(os.getenv('PERCEPTUAL_DEDUP_DURATION_SECONDS', '10'))
+PERCEPTUAL_DEDUP_ACTION = os.getenv('PERCEPTUAL_DEDUP_ACTION', 'reject').lower()
+
+# Lookalike check: a video with an earlier one's resolution and type and nearly the same length
+# and file size (e.g. the same file trimmed by a second) is still credited, but flagged for
+# admins with the reasons (/flagged)
+METADATA_DEDUP = os.getenv('METADATA_DEDUP', '0') == '1'
+METADATA_DEDUP_DURATION_SECONDS = int(os.getenv('METADATA_DEDUP_DURATION_SECONDS', '2'))
+METADATA_DEDUP_SIZE_PERCENT = float(os.getenv('METADATA_DEDUP_SIZE_PERCENT', '1'))
+
+# Duration check: background workers read each video's MP4 header to compare its real length
+# with the one the client reported. 'flag' reports a mismatch, 'reverse' also takes the extra
+# credit back, 'off' (default) skips the check
+VERIFY_DURATION = os.getenv('VERIFY_DURATION', 'off').lower()
+VERIFY_DURATION_WORKERS = int(os.getenv('VERIFY_DURATION_WORKERS', '2'))
+VERIFY_DURATION_TOLERANCE_SECONDS = int(os.getenv('VERIFY_DURATION_TOLERANCE_SECONDS', '30'))
+VERIFY_DURATION_MAX_QUEUED = 100  # more pending checks than this are dropped, never waited on
+
+# Midnight rollover: how many kick/warning messages may be in flight at once
+MIDNIGHT_SEND_CONCURRENCY = int(os.getenv('MIDNIGHT_SEND_CONCURRENCY', '5'))
+
+# Outbound message limits (Telegram: ~30 msg/s overall, 20 msg/min per group, 1 msg/s per private chat)
+OUTBOUND_GLOBAL_PER_SECOND = float(os.getenv('OUTBOUND_GLOBAL_PER_SECOND', '30'))
+OUTBOUND_GROUP_PER_MINUTE = float(os.getenv('OUTBOUND_GROUP_PER_MINUTE', '20'))
+OUTBOUND_PRIVATE_PER_SECOND = float(os.getenv('OUTBOUND_PRIVATE_PER_SECOND', '1'))
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+
+# Failed sends are retried with exponential backoff, then kept as dead letters
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '6'))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv('OUTBOX_RETRY_BASE_SECONDS', '30'))
+
+# Digest mode: combine group announcements of private submissions (0 = post each one)
+ANNOUNCE_DIGEST_SECONDS = float(os.getenv('ANNOUNCE_DIGEST_SECONDS', '0'))
+ANNOUNCE_DIGEST_MAX = int(os.getenv('ANNOUNCE_DIGEST_MAX', '10'))
+
+# Longest text Telegram accepts in one message
+MAX_MESSAGE_LENGTH = 4096
+
+# Outbound priority lanes (pass as rate_limit_args); lower goes first
+PRIORITY_URGENT = 0  # kicks and warnings
+PRIORITY_NORMAL = 1  # replies, announcements, summaries, reminders
+PRIORITY_LOW = 2     # jokes and motivations
+
+# Write-behind: changes are flushed to disk at most once per interval (0 = save immediately)
+SAVE_INTERVAL_SECONDS = float(os.getenv('SAVE_INTERVAL_SECONDS', '5'))
+
+# Webhook mode: set WEBHOOK_URL (public https base URL) to receive updates over a webhook instead of polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # defaults to one derived from the bot token
+WEBHOOK_PORT = int(os.getenv('PORT', '8080'))
+
+# Videos sent as one album are collected for this long, then credited together
+MEDIA_GROUP_WINDOW_SECONDS = float(os.getenv('MEDIA_GROUP_WINDOW_SECONDS', '1.5'))
+
+# Updates handled at once (updates from the same user still run one after another)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '16'))
 
-# Global variable to store chat_id for reminders
-REMINDER_CHAT_ID = None
+# Only the update types our handlers use (commands and videos arrive as messages,
+# member updates keep the admin cache fresh)
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CHAT_MEMBER, Update.MY_CHAT_MEMBER]
 
-# Global variable to store group timezone
-GROUP_TIMEZONE = 'Asia/Seoul'  # Default timezone
+# Sharded workers: WORKER_COUNT processes share one SQLite database, each handling the
+# users with user_id % WORKER_COUNT == WORKER_ID. Worker 0 receives updates from Telegram
+# and passes the other shards theirs through the database; a lease picks the worker
+# that runs the group-wide jobs.
+WORKER_COUNT = max(1, int(os.getenv('WORKER_COUNT', '1')))
+WORKER_ID = int(os.getenv('WORKER_ID', '0'))
+LEADER_LEASE_SECONDS = float(os.getenv('LEADER_LEASE_SECONDS', '30'))
+SHARD_REFRESH_SECONDS = float(os.getenv('SHARD_REFRESH_SECONDS', '30'))
+SHARD_POLL_SECONDS = 0.5  # how often a worker checks the database for its updates
+SHARD_GATHER_SECONDS = 60  # how long the leader waits for every shard's midnight rollover
 
-# Global variable to store user timezones
-USER_TIMEZONES = {}
+# Scheduled jobs: a critical job (midnight rollover, reminders) missed by up to this long -
+# because the bot was down or busy - still runs; cosmetic ones (jokes, motivations)
+# are dropped after a minute. Missed runs of the same job are combined into one.
+MISFIRE_GRACE_SECONDS = int(os.getenv('MISFIRE_GRACE_SECONDS', '3600'))
+CRITICAL_JOB = {'misfire_grace_time': MISFIRE_GRACE_SECONDS, 'coalesce': True}
+COSMETIC_JOB = {'misfire_grace_time': 60, 'coalesce': True}
+
+# How long a group admin check is trusted before asking Telegram again
+ADMIN_CACHE_TTL_SECONDS = float(os.getenv('ADMIN_CACHE_TTL_SECONDS', '300'))
+
+# Minimum required video duration in seconds (2 hours)
+MIN_DURATION = 2 * 60 * 60  # 7200 seconds
+
+# Group timezone until an admin sets one
+DEFAULT_TIMEZONE = 'Asia/Seoul'
 
 # Available timezones
 AVAILABLE_TIMEZONES = {
@@ -56,101 +197,89 @@ AVAILABLE_TIMEZONES = {
     'usa_hawaii': 'Pacific/Honolulu',
 }
 
-def load_user_timezones():
-    """Load individual user timezone settings"""
-    global USER_TIMEZONES
-    if os.path.exists(USER_TIMEZONES_FILE):
-        try:
-            with open(USER_TIMEZONES_FILE, 'r') as f:
-                USER_TIMEZONES = json.load(f)
-        except Exception as e:
-            logger.error(f"Error loading user timezones: {e}")
-    return USER_TIMEZONES
+# The chat partition the current update or job works on (see PartitionRegistry)
+_active_partition = contextvars.ContextVar('active_partition', default=None)
 
-def save_user_timezones():
-    """Save individual user timezone settings"""
-    try:
-        with open(USER_TIMEZONES_FILE, 'w') as f:
-            json.dump(USER_TIMEZONES, f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving user timezones: {e}")
+def current_partition():
+    """Get the partition of the group being handled (the default one outside any update)"""
+    return _active_partition.get() or partitions.default
 
-def get_user_timezone(user_id):
-    """Get a specific user's timezone, or group default"""
-    user_key = str(user_id)
-    return USER_TIMEZONES.get(user_key, GROUP_TIMEZONE)
-
-def set_user_timezone(user_id, timezone):
-    """Set a specific user's timezone"""
-    user_key = str(user_id)
-    USER_TIMEZONES[user_key] = timezone
-    save_user_timezones()
-
-def load_group_timezone():
-    """Load the group's timezone setting"""
-    global GROUP_TIMEZONE
-    if os.path.exists(TIMEZONE_FILE):
-        try:
-            with open(TIMEZONE_FILE, 'r') as f:
-                data = json.load(f)
-                GROUP_TIMEZONE = data.get('timezone', 'Asia/Seoul')
-        except Exception as e:
-            logger.error(f"Error loading timezone: {e}")
-    return GROUP_TIMEZONE
+def current_bot():
+    """Get the VideoBot holding the current group's data"""
+    return current_partition().bot
 
 def save_group_timezone(timezone):
-    """Save the group's timezone setting"""
-    try:
-        with open(TIMEZONE_FILE, 'w') as f:
-            json.dump({'timezone': timezone}, f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving timezone: {e}")
+    """Save the group's timezone setting (written on the storage thread)"""
+    partition = current_partition()
+    partition.timezone = timezone
+    partition.timezone_set = True
+    partition.bot.run_io(partition.storage.save_setting, 'group_timezone', {'timezone': timezone})
 
 # User-specific timezones
-USER_TIMEZONES_FILE = 'user_timezones.json'
-USER_TIMEZONES = {}
-
-def load_user_timezones():
-    """Load user-specific timezone settings"""
-    global USER_TIMEZONES
-    if os.path.exists(USER_TIMEZONES_FILE):
-        try:
-            with open(USER_TIMEZONES_FILE, 'r') as f:
-                USER_TIMEZONES = json.load(f)
-        except Exception as e:
-            logger.error(f"Error loading user timezones: {e}")
-    return USER_TIMEZONES
-
 def save_user_timezones():
-    """Save user-specific timezone settings"""
-    try:
-        with open(USER_TIMEZONES_FILE, 'w') as f:
-            json.dump(USER_TIMEZONES, f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving user timezones: {e}")
+    """Save user-specific timezone settings (written on the storage thread)"""
+    partition = current_partition()
+    user_timezones = dict(partition.user_timezones)
+
+    def merge_user_timezones():
+        # Keep timezones other workers saved since ours were loaded
+        saved = partition.storage.load_setting('user_timezones') or {}
+        partition.storage.save_setting('user_timezones', dict(saved, **user_timezones))
+    partition.bot.run_io(merge_user_timezones)
 
 def get_user_timezone(user_id):
     """Get a specific user's timezone, or default to group timezone"""
-    return USER_TIMEZONES.get(str(user_id), GROUP_TIMEZONE)
+    partition = current_partition()
+    return partition.user_timezones.get(str(user_id), partition.timezone)
 
 def set_user_timezone(user_id, timezone):
     """Set a specific user's timezone"""
-    USER_TIMEZONES[str(user_id)] = timezone
+    current_partition().user_timezones[str(user_id)] = timezone
     save_user_timezones()
+    # The user's current day may have moved with it, so rank everyone afresh
+    current_bot().leaderboards.clear()
+    current_bot().invalidate_leaderboards()
 
 def get_current_time():
     """Get current time in the configured timezone"""
-    return datetime.now(ZoneInfo(GROUP_TIMEZONE))
+    return datetime.now(ZoneInfo(current_partition().timezone))
 
 def get_current_time_for_user(user_id):
     """Get current time in user's timezone"""
     user_tz = get_user_timezone(user_id)
     return datetime.now(ZoneInfo(user_tz))
 
+def seconds_since(timestamp, now):
+    """Seconds from an ISO timestamp (naive or timezone-aware) until now"""
+    then = datetime.fromisoformat(timestamp)
+    if then.tzinfo is None:
+        return (now.replace(tzinfo=None) - then).total_seconds()
+    return (now - then).total_seconds()
+
 def get_current_date_str():
     """Get current date string in the configured timezone"""
     return get_current_time().strftime('%Y-%m-%d')
 
+def get_current_date_str_for_user(user_id):
+    """Get current date string in user's timezone"""
+    return get_current_time_for_user(user_id).strftime('%Y-%m-%d')
+
+def shard_of(user_id):
+    """Worker that handles this user's updates"""
+    return int(user_id) % WORKER_COUNT
+
+def owns_user(user_id):
+    """Check if this worker handles the user (always true unless sharded)"""
+    return shard_of(user_id) == WORKER_ID
+
+def shard_setting(name):
+    """Name of a setting each worker keeps for itself (the plain name unless sharded)"""
+    return f"{name}:{WORKER_ID}" if WORKER_COUNT > 1 else name
+
+def get_rollover_timezones():
+    """Every timezone a user or group can be in - each gets its own midnight rollover"""
+    return sorted(set(AVAILABLE_TIMEZONES.values()) | {p.timezone for p in partitions.all()})
+
 # Jokes for users who are slacking (have deficits)
 SLACKER_JOKES = [
     "Why did the procrastinator's video go to therapy? Because it had commitment issues! 😄 Submit your 2-hour video today!",
@@ -185,11 +314,1695 @@ MOTIVATIONAL_MESSAGES = [
 ]
 
 
-class VideoBot:
+class JsonStorage:
+    """Flat JSON file storage.
+
+    User data is kept as a snapshot (user_deficits.json) plus an append-only
+    journal of per-user changes, so a save is O(changed users) and a crash can
+    never truncate the snapshot. Video hashes are journaled the same way.
+    Other files are rewritten atomically.
+
+    Saves receive copies of the changed rows only, so the storage keeps its own
+    mirror of each file to write from.
+    """
+
+    PERIOD_FIELDS = ('daily_worked', 'weekly_worked', 'monthly_worked')
+
+    def __init__(self, data_file=DATA_FILE, hash_file=HASH_FILE, activity_file=ACTIVITY_FILE,
+                 timezone_file=TIMEZONE_FILE, user_timezones_file=None,
+                 rollover_file=ROLLOVER_FILE, outbox_file=OUTBOX_FILE, reminders_file=REMINDERS_FILE,
+                 job_runs_file=JOB_RUNS_FILE, compact_after=JOURNAL_COMPACT_RECORDS):
+        self.data_file = data_file
+        self.journal_file = os.path.splitext(data_file)[0] + '.journal'
+        self.compact_after = compact_after
+        self._journal_records = 0
+        self._shadow = {}  # user rows as of the last snapshot/journal write
+        self._mirrors = {'video_hashes': {}, 'user_activities': {}}
+        self.hash_file = hash_file
+        self.hash_journal_file = os.path.splitext(hash_file)[0] + '.journal'
+        self._hash_journal_records = 0
+        self.archive_file = os.path.splitext(hash_file)[0] + '_archive.jsonl'
+        self._archive_offsets = None  # file_unique_id -> byte offset of its archive line, built on first lookup
+        self.activity_file = activity_file
+        self.setting_files = {
+            'group_timezone': timezone_file,
+            'user_timezones': user_timezones_file or USER_TIMEZONES_FILE,
+            'rollover_runs': rollover_file,
+            'outbox': outbox_file,
+            'reminders': reminders_file,
+            'job_runs': job_runs_file,
+        }
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _write(self, path, data):
+        # Write a temp file and swap it in, so a crash leaves the old copy intact
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load_users(self):
+        users = self._read(self.data_file) or {}
+        self._journal_records = 0
+
+        # Replay the journal on top of the snapshot
+        torn = False
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn last line from a crash mid-append
+                        logger.warning(f"Skipping unreadable journal record in {self.journal_file}")
+                        torn = True
+                        continue
+                    self._apply_record(users, record)
+                    self._journal_records += 1
+            if self._journal_records:
+                logger.info(f"Replayed {self._journal_records} journal records from {self.journal_file}")
+
+        self._shadow = {key: self._copy_row(row) for key, row in users.items()}
+        if torn:
+            # Start a clean journal so new records are not appended to the torn line
+            self.compact()
+        return users
+
+    def _copy_row(self, row):
+        copy = dict(row)
+        for field in self.PERIOD_FIELDS:
+            if field in copy:
+                copy[field] = dict(copy[field])
+        if 'warnings_sent' in copy:
+            copy['warnings_sent'] = list(copy['warnings_sent'])
+        return copy
+
+    def _apply_record(self, users, record):
+        user_key = record['user']
+        if record.get('delete'):
+            users.pop(user_key, None)
+            return
+        row = users.setdefault(user_key, {})
+        row.update(record.get('set', {}))
+        for field, counters in record.get('periods', {}).items():
+            row.setdefault(field, {}).update(counters)
+
+    def _diff_record(self, user_key, row):
+        """Build a journal record with only the fields that changed since the last write"""
+        old = self._shadow.get(user_key, {})
+        changed = {
+            field: value for field, value in row.items()
+            if field not in self.PERIOD_FIELDS and old.get(field) != value
+        }
+        periods = {}
+        for field in self.PERIOD_FIELDS:
+            old_counters = old.get(field, {})
+            counters = {
+                period_key: seconds for period_key, seconds in row.get(field, {}).items()
+                if old_counters.get(period_key) != seconds
+            }
+            if counters:
+                periods[field] = counters
+            elif field in row and field not in old:
+                periods[field] = {}
+        if not changed and not periods:
+            return None
+        record = {'ts': datetime.now().isoformat(), 'user': user_key, 'set': changed}
+        if periods:
+            record['periods'] = periods
+        return record
+
+    def save_users(self, users, user_keys=None):
+        if user_keys is None:
+            self._shadow = {key: self._copy_row(row) for key, row in users.items()}
+            self.compact()
+            return
+
+        records = []
+        for user_key in user_keys:
+            row = users.get(user_key)
+            if row is None:
+                if user_key in self._shadow:
+                    records.append({'ts': datetime.now().isoformat(), 'user': user_key, 'delete': True})
+                    del self._shadow[user_key]
+                continue
+            record = self._diff_record(user_key, row)
+            if record:
+                records.append(record)
+                self._shadow[user_key] = self._copy_row(row)
+
+        if records:
+            self._append_journal(self.journal_file, records)
+            self._journal_records += len(records)
+
+        if self._journal_records >= self.compact_after:
+            self.compact()
+
+    def _append_journal(self, path, records):
+        with open(path, 'a') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot and start an empty journal"""
+        # Records are absolute values, so a crash between these two steps only
+        # means the old journal is replayed once more over the new snapshot
+        self._write(self.data_file, self._shadow)
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self._journal_records = 0
+
+    def _load_mirrored(self, name, path):
+        self._mirrors[name] = self._read(path) or {}
+        return copy.deepcopy(self._mirrors[name])
+
+    def _save_mirrored(self, name, path, rows, keys):
+        mirror = self._mirrors[name]
+        if keys is None:
+            mirror.clear()
+            keys = rows.keys()
+        for key in keys:
+            if key in rows:
+                mirror[key] = rows[key]
+            else:
+                mirror.pop(key, None)
+        self._write(path, mirror)
+
+    def load_video_hashes(self):
+        hashes = self._read(self.hash_file) or {}
+        self._hash_journal_records = 0
+
+        # Replay the journal on top of the snapshot
+        torn = False
+        if os.path.exists(self.hash_journal_file):
+            with open(self.hash_journal_file, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping unreadable journal record in {self.hash_journal_file}")
+                        torn = True
+                        continue
+                    if record.get('delete'):
+                        hashes.pop(record['id'], None)
+                    else:
+                        hashes[record['id']] = record['entry']
+                    self._hash_journal_records += 1
+
+        self._mirrors['video_hashes'] = hashes
+        if torn:
+            self.compact_video_hashes()
+        return copy.deepcopy(hashes)
+
+    def save_video_hashes(self, hashes, hash_keys=None):
+        mirror = self._mirrors['video_hashes']
+        if hash_keys is None:
+            mirror.clear()
+            mirror.update(hashes)
+            self.compact_video_hashes()
+            return
+
+        # Upserts and evictions go to the journal; the snapshot is only rewritten on compaction
+        records = []
+        for key in hash_keys:
+            if key in hashes:
+                mirror[key] = hashes[key]
+                records.append({'id': key, 'entry': hashes[key]})
+            elif mirror.pop(key, None) is not None:
+                records.append({'id': key, 'delete': True})
+        if records:
+            self._append_journal(self.hash_journal_file, records)
+            self._hash_journal_records += len(records)
+
+        if self._hash_journal_records >= self.compact_after:
+            self.compact_video_hashes()
+
+    def compact_video_hashes(self):
+        """Fold the video hash journal into a fresh video_hashes.json"""
+        self._write(self.hash_file, self._mirrors['video_hashes'])
+        if os.path.exists(self.hash_journal_file):
+            os.remove(self.hash_journal_file)
+        self._hash_journal_records = 0
+
+    def archive_video_hashes(self, rows):
+        lines = [(key, (json.dumps({'id': key, 'entry': row}) + '\n').encode()) for key, row in rows.items()]
+        with open(self.archive_file, 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(b''.join(line for _, line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+        if self._archive_offsets is not None:
+            for key, line in lines:
+                self._archive_offsets.setdefault(key, offset)
+                offset += len(line)
+
+    def iter_archived_videos(self):
+        if not os.path.exists(self.archive_file):
+            return
+        with open(self.archive_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                yield record['id'], record['entry']
+
+    def _load_archive_offsets(self):
+        """Scan the archive once for where each entry's line starts"""
+        offsets = {}
+        if not os.path.exists(self.archive_file):
+            return offsets
+        with open(self.archive_file, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    offsets.setdefault(json.loads(line)['id'], offset)
+                except (ValueError, KeyError):
+                    pass
+                offset += len(line)
+        return offsets
+
+    def find_archived_video(self, file_unique_id):
+        # An ID lookup in memory; the file is only read for an actual hit
+        if self._archive_offsets is None:
+            self._archive_offsets = self._load_archive_offsets()
+        offset = self._archive_offsets.get(file_unique_id)
+        if offset is None:
+            return None
+        with open(self.archive_file, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())['entry']
+
+    def load_user_activities(self):
+        return self._load_mirrored('user_activities', self.activity_file)
+
+    def save_user_activities(self, activities, user_keys=None):
+        self._save_mirrored('user_activities', self.activity_file, activities, user_keys)
+
+    def load_setting(self, name):
+        return self._read(self.setting_files[name])
+
+    def save_setting(self, name, value):
+        self._write(self.setting_files[name], value)
+
+    def close(self):
+        pass
+
+
+class SqliteStorage:
+    """SQLite storage in WAL mode - saves only the rows that were touched"""
+
+    PERIOD_FIELDS = ('daily_worked', 'weekly_worked', 'monthly_worked')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS period_worked (
+            user_id TEXT NOT NULL,
+            period TEXT NOT NULL,
+            period_key TEXT NOT NULL,
+            seconds INTEGER NOT NULL,
+            PRIMARY KEY (user_id, period, period_key)
+        );
+        CREATE TABLE IF NOT EXISTS video_hashes (
+            file_unique_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS video_hashes_archive (
+            file_unique_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS user_activities (
+            user_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS settings (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS inbound_updates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            shard INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS inbound_updates_shard ON inbound_updates (shard, id);
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            key TEXT NOT NULL,
+            changed_at REAL NOT NULL
+        );
+    """
+
+    # Sharded mode logs every write to these tables (as the user or video it belongs to)
+    # so other workers reload just those rows
+    CHANGE_TRACKED = {
+        'users': ('users', 'user_id'),
+        'period_worked': ('users', 'user_id'),
+        'video_hashes': ('video_hashes', 'file_unique_id'),
+        'user_activities': ('user_activities', 'user_id'),
+    }
+    CHANGE_RETENTION_SECONDS = 24 * 3600
+
+    def __init__(self, db_file=SQLITE_FILE, track_changes=None):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+        self._set_change_tracking(WORKER_COUNT > 1 if track_changes is None else track_changes)
+        # What is already on disk, so saves can skip unchanged rows
+        self._persisted_keys = {'users': set(), 'video_hashes': set(), 'user_activities': set()}
+        self._persisted_periods = {}
+
+    def _set_change_tracking(self, enabled):
+        """Create the triggers that fill the change log, or drop them (and the log) when not sharded"""
+        with self.conn:
+            for table, (logged_as, key_column) in self.CHANGE_TRACKED.items():
+                for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+                    trigger = f"{table}_{event.lower()}_changed"
+                    if enabled:
+                        self.conn.execute(
+                            f"CREATE TRIGGER IF NOT EXISTS {trigger} AFTER {event} ON {table} BEGIN "
+                            f"INSERT INTO changes (tbl, key, changed_at) "
+                            f"VALUES ('{logged_as}', {row}.{key_column}, strftime('%s', 'now')); END"
+                        )
+                    else:
+                        self.conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            if not enabled:
+                self.conn.execute("DELETE FROM changes")
+
+    def last_change(self):
+        """Sequence number of the latest change-log entry (0 if there never was one)"""
+        row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, seq):
+        """Keys changed after seq, per table, and the new latest seq; None if the log no longer reaches back to seq"""
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM changes WHERE changed_at < ?", (time.time() - self.CHANGE_RETENTION_SECONDS,)
+            )
+        rows = self.conn.execute("SELECT seq, tbl, key FROM changes WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+        latest = self.last_change()
+        if latest > seq and (not rows or rows[0][0] != seq + 1):
+            return None
+        changed = {table: set() for table, _ in self.CHANGE_TRACKED.values()}
+        for _, table, key in rows:
+            changed[table].add(key)
+        return latest, changed
+
+    def _load_rows(self, table, key_column):
+        rows = self.conn.execute(f"SELECT {key_column}, data FROM {table} ORDER BY rowid")
+        result = {key: json.loads(data) for key, data in rows}
+        self._persisted_keys[table] = set(result)
+        return result
+
+    def _save_rows(self, table, key_column, rows, keys=None):
+        """Upsert the given keys (all keys if None); keys missing from rows are deleted"""
+        if keys is None:
+            keys = set(rows) | self._persisted_keys[table]
+        for key in keys:
+            if key in rows:
+                # Upsert keeps the rowid, so load order stays insertion order
+                self.conn.execute(
+                    f"INSERT INTO {table} ({key_column}, data) VALUES (?, ?) "
+                    f"ON CONFLICT({key_column}) DO UPDATE SET data = excluded.data",
+                    (key, json.dumps(rows[key]))
+                )
+                self._persisted_keys[table].add(key)
+            else:
+                self.conn.execute(f"DELETE FROM {table} WHERE {key_column} = ?", (key,))
+                self._persisted_keys[table].discard(key)
+
+    def load_users(self):
+        users = self._load_rows('users', 'user_id')
+        for user_key in users:
+            for field in self.PERIOD_FIELDS:
+                users[user_key][field] = {}
+        self._persisted_periods = {}
+        rows = self.conn.execute("SELECT user_id, period, period_key, seconds FROM period_worked")
+        for user_key, field, period_key, seconds in rows:
+            if user_key in users:
+                users[user_key][field][period_key] = seconds
+                self._persisted_periods[(user_key, field, period_key)] = seconds
+        return users
+
+    def load_user(self, user_key):
+        """One user's row with its period counters; None if there is none"""
+        row = self.conn.execute("SELECT data FROM users WHERE user_id = ?", (user_key,)).fetchone()
+        if row is None:
+            self._persisted_keys['users'].discard(user_key)
+            return None
+        user = json.loads(row[0])
+        for field in self.PERIOD_FIELDS:
+            user[field] = {}
+        self._persisted_keys['users'].add(user_key)
+        rows = self.conn.execute(
+            "SELECT period, period_key, seconds FROM period_worked WHERE user_id = ?", (user_key,)
+        )
+        for field, period_key, seconds in rows:
+            user[field][period_key] = seconds
+            self._persisted_periods[(user_key, field, period_key)] = seconds
+        return user
+
+    def save_users(self, users, user_keys=None):
+        if user_keys is None:
+            user_keys = set(users) | self._persisted_keys['users']
+        with self.conn:
+            for user_key in user_keys:
+                data = users.get(user_key)
+                if data is None:
+                    self.conn.execute("DELETE FROM users WHERE user_id = ?", (user_key,))
+                    self.conn.execute("DELETE FROM period_worked WHERE user_id = ?", (user_key,))
+                    self._persisted_keys['users'].discard(user_key)
+                    self._persisted_periods = {
+                        k: v for k, v in self._persisted_periods.items() if k[0] != user_key
+                    }
+                    continue
+
+                row = {k: v for k, v in data.items() if k not in self.PERIOD_FIELDS}
+                self._save_rows('users', 'user_id', {user_key: row}, [user_key])
+
+                # Only write the period counters whose value actually changed
+                for field in self.PERIOD_FIELDS:
+                    for period_key, seconds in data.get(field, {}).items():
+                        counter = (user_key, field, period_key)
+                        if self._persisted_periods.get(counter) == seconds:
+                            continue
+                        self.conn.execute(
+                            "INSERT INTO period_worked (user_id, period, period_key, seconds) "
+                            "VALUES (?, ?, ?, ?) ON CONFLICT(user_id, period, period_key) "
+                            "DO UPDATE SET seconds = excluded.seconds",
+                            (user_key, field, period_key, seconds)
+                        )
+                        self._persisted_periods[counter] = seconds
+
+    def load_video_hashes(self):
+        return self._load_rows('video_hashes', 'file_unique_id')
+
+    def save_video_hashes(self, hashes, hash_keys=None):
+        with self.conn:
+            self._save_rows('video_hashes', 'file_unique_id', hashes, hash_keys)
+
+    def archive_video_hashes(self, rows):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO video_hashes_archive (file_unique_id, data) VALUES (?, ?)",
+                [(key, json.dumps(row)) for key, row in rows.items()]
+            )
+
+    def iter_archived_videos(self):
+        rows = self.conn.execute("SELECT file_unique_id, data FROM video_hashes_archive").fetchall()
+        for key, data in rows:
+            yield key, json.loads(data)
+
+    def find_archived_video(self, file_unique_id):
+        row = self.conn.execute(
+            "SELECT data FROM video_hashes_archive WHERE file_unique_id = ?", (file_unique_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def claim_video_hash(self, file_unique_id, row):
+        """Insert a video's row unless another worker has it; None if claimed, else their row"""
+        with self.conn:
+            inserted = self.conn.execute(
+                "INSERT INTO video_hashes (file_unique_id, data) VALUES (?, ?) ON CONFLICT DO NOTHING",
+                (file_unique_id, json.dumps(row))
+            ).rowcount
+        if inserted:
+            self._persisted_keys['video_hashes'].add(file_unique_id)
+            return None
+        return self.find_video_hash(file_unique_id)
+
+    def find_video_hash(self, file_unique_id):
+        row = self.conn.execute(
+            "SELECT data FROM video_hashes WHERE file_unique_id = ?", (file_unique_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_user_activities(self):
+        return self._load_rows('user_activities', 'user_id')
+
+    def load_user_activity(self, user_key):
+        row = self.conn.execute("SELECT data FROM user_activities WHERE user_id = ?", (user_key,)).fetchone()
+        if row is None:
+            self._persisted_keys['user_activities'].discard(user_key)
+            return None
+        self._persisted_keys['user_activities'].add(user_key)
+        return json.loads(row[0])
+
+    def save_user_activities(self, activities, user_keys=None):
+        with self.conn:
+            self._save_rows('user_activities', 'user_id', activities, user_keys)
+
+    def load_setting(self, name):
+        row = self.conn.execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_setting(self, name, value):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO settings (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (name, json.dumps(value))
+            )
+
+    def acquire_lease(self, name, holder, ttl):
+        """Take the lease if it is free or expired, or renew it; True if holder now has it"""
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+                (name, holder, now + ttl, now)
+            )
+            row = self.conn.execute("SELECT holder FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == holder
+
+    def release_lease(self, name, holder):
+        with self.conn:
+            self.conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    def push_inbound(self, shard, data):
+        with self.conn:
+            self.conn.execute("INSERT INTO inbound_updates (shard, data) VALUES (?, ?)", (shard, data))
+
+    def take_inbound(self, shard, limit=100):
+        """Remove and return the oldest updates queued for a shard"""
+        with self.conn:
+            rows = self.conn.execute(
+                "SELECT id, data FROM inbound_updates WHERE shard = ? ORDER BY id LIMIT ?", (shard, limit)
+            ).fetchall()
+            if rows:
+                self.conn.execute("DELETE FROM inbound_updates WHERE shard = ? AND id <= ?", (shard, rows[-1][0]))
+        return [data for _, data in rows]
+
+    def import_from_json(self, json_storage):
+        """One-shot import of the existing JSON data files into this database"""
+        def read(loader, label):
+            try:
+                return loader()
+            except Exception as e:
+                logger.error(f"Skipping {label} during import: {e}")
+                return None
+
+        users = read(json_storage.load_users, 'user deficits') or {}
+        hashes = read(json_storage.load_video_hashes, 'video hashes') or {}
+        activities = read(json_storage.load_user_activities, 'user activities') or {}
+        self.save_users(users)
+        self.save_video_hashes(hashes)
+        self.archive_video_hashes(dict(json_storage.iter_archived_videos()))
+        self.save_user_activities(activities)
+        for name in json_storage.setting_files:
+            value = read(lambda: json_storage.load_setting(name), name)
+            if value is not None:
+                self.save_setting(name, value)
+        self.save_setting('imported_from_json', datetime.now().isoformat())
+        logger.info(
+            f"Imported {len(users)} users, {len(hashes)} video hashes and "
+            f"{len(activities)} activity records into {self.db_file}"
+        )
+
+    def close(self):
+        self.conn.close()
+
+
+class ActivityLog:
+    """Append-only activity log, written as JSONL into one file per day.
+
+    A day's segment rotates to activities-<date>.1.jsonl, .2.jsonl, ... once it
+    grows past max_bytes, and segments older than retention_days are deleted.
+    """
+
+    def __init__(self, log_dir=ACTIVITY_LOG_DIR, retention_days=ACTIVITY_RETENTION_DAYS,
+                 max_bytes=ACTIVITY_SEGMENT_MAX_BYTES):
+        self.log_dir = log_dir
+        self.retention_days = retention_days
+        self.max_bytes = max_bytes
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_pruned = None
+        os.makedirs(log_dir, exist_ok=True)
+
+    def append(self, entry):
+        """Buffer an entry; it is written on the next flush"""
+        with self._lock:
+            self._buffer.append(entry)
+
+    def has_pending(self):
+        return bool(self._buffer)
+
+    def take(self):
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+        return entries
+
+    def _segment_path(self, day, index=0):
+        suffix = f".{index}" if index else ""
+        return os.path.join(self.log_dir, f"activities-{day}{suffix}.jsonl")
+
+    def _current_segment(self, day):
+        """Newest segment for the day, rotating to a new one if it is full"""
+        index = 0
+        while os.path.exists(self._segment_path(day, index + 1)):
+            index += 1
+        path = self._segment_path(day, index)
+        if os.path.exists(path) and os.path.getsize(path) >= self.max_bytes:
+            path = self._segment_path(day, index + 1)
+        return path
+
+    def write(self, entries):
+        """Append entries to their day's segment - runs on the storage thread"""
+        by_day = {}
+        for entry in entries:
+            by_day.setdefault(entry['timestamp'][:10], []).append(entry)
+
+        for day, day_entries in by_day.items():
+            with open(self._current_segment(day), 'a') as f:
+                f.write(''.join(json.dumps(entry) + '\n' for entry in day_entries))
+
+        today = datetime.now().strftime('%Y-%m-%d')
+        if self._last_pruned != today:
+            self.prune()
+            self._last_pruned = today
+
+    def prune(self):
+        """Delete segments older than the retention window"""
+        if self.retention_days <= 0:
+            return
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).strftime('%Y-%m-%d')
+        for name in os.listdir(self.log_dir):
+            if name.startswith('activities-') and name[11:21] < cutoff:
+                try:
+                    os.remove(os.path.join(self.log_dir, name))
+                    logger.info(f"Removed old activity segment {name}")
+                except OSError as e:
+                    logger.error(f"Could not remove activity segment {name}: {e}")
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter - no false negatives, ~false_positive_rate false positives"""
+
+    def __init__(self, capacity=DEDUP_BLOOM_CAPACITY, false_positive_rate=0.01):
+        self.size = max(64, int(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+def dhash(image_bytes, size=8):
+    """Difference hash of an image: 64 bits, one per pair of neighbouring pixels on a 9x8 grayscale copy"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        pixels = list(image.convert('L').resize((size + 1, size), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            value = (value << 1) | (left > pixels[row * (size + 1) + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over hashes: finds everything within a Hamming distance without a full scan.
+
+    Each node keeps its children by their distance to it, so a search only
+    descends into children whose distance is within max_distance of the
+    query's own distance to the node (triangle inequality).
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, value, {distance: child}]
+        self.size = 0
+
+    def add(self, key, value):
+        node = [key, value, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming_distance(key, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, key, max_distance):
+        """(distance, value) of every entry within max_distance, closest first"""
+        results = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(key, node[0])
+            if distance <= max_distance:
+                results.append((distance, node[1]))
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda result: result[0])
+        return results
+
+    def __len__(self):
+        return self.size
+
+
+class FingerprintIndex:
+    """Video metadata fingerprints (resolution, type, length, size) in buckets for lookalike lookups.
+
+    Buckets are keyed by (width, height, mime_type, duration // window), so a
+    lookup reads only its own bucket and the two next to it, however many
+    videos are indexed.
+    """
+
+    def __init__(self, duration_tolerance=METADATA_DEDUP_DURATION_SECONDS, size_percent=METADATA_DEDUP_SIZE_PERCENT):
+        self.duration_tolerance = duration_tolerance
+        self.size_percent = size_percent
+        self.window = max(1, duration_tolerance)
+        self.buckets = {}  # bucket key -> [(file_unique_id, duration, file_size)]
+
+    def _key(self, duration, fingerprint, shift=0):
+        width, height, _, mime_type = fingerprint
+        return (width, height, mime_type, duration // self.window + shift)
+
+    def add(self, file_unique_id, duration, fingerprint):
+        if duration is None or fingerprint[2] is None:
+            return
+        self.buckets.setdefault(self._key(duration, fingerprint), []).append((file_unique_id, duration, fingerprint[2]))
+
+    def find(self, duration, fingerprint):
+        """(file_unique_id, reasons) for every indexed video within the tolerances"""
+        width, height, file_size, mime_type = fingerprint
+        if duration is None or file_size is None:
+            return []
+        matches = []
+        for shift in (-1, 0, 1):
+            for file_unique_id, other_duration, other_size in self.buckets.get(self._key(duration, fingerprint, shift), ()):
+                size_gap = abs(other_size - file_size) * 100.0 / max(other_size, file_size, 1)
+                if abs(other_duration - duration) > self.duration_tolerance or size_gap > self.size_percent:
+                    continue
+                matches.append((file_unique_id, [
+                    f"same {width}x{height} {mime_type or 'video'}",
+                    "same length" if other_duration == duration else f"length {duration}s vs {other_duration}s",
+                    "same size" if other_size == file_size else f"size within {size_gap:.2f}% ({file_size} vs {other_size} bytes)"
+                ]))
+        return matches
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+
+class VideoDedupIndex:
+    """Duplicate-video index keyed by file_unique_id.
+
+    Entries are compact lists [user_id, username, duration, first_submitted_ts],
+    which is all the duplicate check and its reply need. Old entries can be
+    evicted to the storage's cold archive; the optional Bloom filter covers both
+    hot and archived IDs so most new videos are rejected as "not seen" without
+    touching either. Entries may carry two more fields: the thumbnail's
+    perceptual hash (kept in a BK-tree) and the metadata fingerprint
+    [width, height, file_size, mime_type] (kept in a FingerprintIndex). Both
+    cover hot entries only.
+    """
+
+    def __init__(self, entries, bloom=None):
+        self.entries = entries
+        self.bloom = bloom
+        if bloom is not None:
+            for file_unique_id in entries:
+                bloom.add(file_unique_id)
+        self.rebuild_side_indexes()
+
+    def rebuild_side_indexes(self):
+        """Index the perceptual hashes and metadata fingerprints of all hot entries"""
+        self.similar = BKTree()
+        self.fingerprints = FingerprintIndex()
+        for file_unique_id, row in self.entries.items():
+            self._index_extras(file_unique_id, row)
+
+    def _index_extras(self, file_unique_id, row):
+        if len(row) > 4 and row[4] is not None:
+            self.similar.add(row[4], file_unique_id)
+        if len(row) > 5 and row[5] is not None:
+            self.fingerprints.add(file_unique_id, row[2], row[5])
+
+    @staticmethod
+    def compact_entry(row):
+        """Convert an entry from the old dict format"""
+        if isinstance(row, list):
+            return row
+        try:
+            submitted = int(datetime.fromisoformat(row['first_submitted']).timestamp())
+        except (KeyError, TypeError, ValueError):
+            submitted = int(datetime.now().timestamp())
+        return [row.get('user_id'), row.get('username'), row.get('duration'), submitted]
+
+    @staticmethod
+    def expand_entry(row):
+        user_id, username, duration, submitted = row[:4]
+        return {
+            'user_id': user_id,
+            'username': username,
+            'duration': duration,
+            'first_submitted': datetime.fromtimestamp(submitted).isoformat()
+        }
+
+    def might_contain(self, file_unique_id):
+        return self.bloom is None or file_unique_id in self.bloom
+
+    def get(self, file_unique_id):
+        if not self.might_contain(file_unique_id):
+            return None
+        row = self.entries.get(file_unique_id)
+        return self.expand_entry(row) if row else None
+
+    def add(self, file_unique_id, user_id, username, duration, phash=None, fingerprint=None):
+        entry = [str(user_id), username, duration, int(datetime.now().timestamp())]
+        if phash is not None or fingerprint is not None:
+            entry.append(phash)
+        if fingerprint is not None:
+            entry.append(list(fingerprint))
+        self._index_extras(file_unique_id, entry)
+        self.entries[file_unique_id] = entry
+        if self.bloom is not None:
+            self.bloom.add(file_unique_id)
+
+    def find_similar(self, phash, duration, max_distance=PERCEPTUAL_DEDUP_DISTANCE,
+                     max_duration_gap=PERCEPTUAL_DEDUP_DURATION_SECONDS):
+        """Earlier videos whose thumbnail hash and length are both near these (closest first), with why"""
+        similar = []
+        for distance, file_unique_id in self.similar.search(phash, max_distance):
+            row = self.entries.get(file_unique_id)
+            if row and abs((row[2] or 0) - duration) <= max_duration_gap:
+                similar.append(dict(self.expand_entry(row), file_unique_id=file_unique_id, reasons=[
+                    "same thumbnail" if distance == 0 else f"thumbnail {distance}/64 bits apart",
+                    "same length" if row[2] == duration else f"length {duration}s vs {row[2]}s"
+                ]))
+        return similar
+
+    def find_lookalikes(self, duration, fingerprint):
+        """Earlier videos whose metadata nearly matches, each with the reasons it matched"""
+        lookalikes = []
+        for file_unique_id, reasons in self.fingerprints.find(duration, fingerprint):
+            row = self.entries.get(file_unique_id)
+            if row:
+                lookalikes.append(dict(self.expand_entry(row), file_unique_id=file_unique_id, reasons=reasons))
+        return lookalikes
+
+    def add_archived(self, file_unique_id):
+        if self.bloom is not None:
+            self.bloom.add(file_unique_id)
+
+    def merge(self, entries):
+        """Add entries saved by another worker; returns how many were new"""
+        added = 0
+        for file_unique_id, row in entries.items():
+            if file_unique_id not in self.entries:
+                self.entries[file_unique_id] = row = VideoDedupIndex.compact_entry(row)
+                self._index_extras(file_unique_id, row)
+                if self.bloom is not None:
+                    self.bloom.add(file_unique_id)
+                added += 1
+        return added
+
+    def pop_older_than(self, cutoff_ts):
+        """Remove and return entries first submitted before cutoff_ts"""
+        expired = {key: row for key, row in self.entries.items() if row[3] < cutoff_ts}
+        for key in expired:
+            del self.entries[key]
+        if expired and (len(self.similar) or len(self.fingerprints)):
+            self.rebuild_side_indexes()
+        return expired
+
+
+def create_storage(data_dir=None):
+    """Create the storage backend selected by STORAGE_BACKEND (in data_dir, default DATA_DIR)"""
+    if data_dir is None:
+        json_storage = JsonStorage()
+        sqlite_file = SQLITE_FILE
+    else:
+        os.makedirs(data_dir, exist_ok=True)
+        json_storage = JsonStorage(
+            data_file=os.path.join(data_dir, 'user_deficits.json'),
+            hash_file=os.path.join(data_dir, 'video_hashes.json'),
+            activity_file=os.path.join(data_dir, 'user_activities.json'),
+            timezone_file=os.path.join(data_dir, 'group_timezone.json'),
+            user_timezones_file=os.path.join(data_dir, 'user_timezones.json'),
+            rollover_file=os.path.join(data_dir, 'rollover_runs.json'),
+            outbox_file=os.path.join(data_dir, 'outbox.json'),
+            reminders_file=os.path.join(data_dir, 'reminders.json'),
+            job_runs_file=os.path.join(data_dir, 'job_runs.json')
+        )
+        sqlite_file = os.path.join(data_dir, 'bot_data.sqlite3')
+    
+    if STORAGE_BACKEND == 'sqlite':
+        sqlite_storage = SqliteStorage(sqlite_file)
+        if sqlite_storage.load_setting('imported_from_json') is None:
+            try:
+                sqlite_storage.import_from_json(json_storage)
+            except Exception as e:
+                logger.error(f"Error importing JSON data into SQLite: {e}")
+        return sqlite_storage
+    return json_storage
+
+
+class _SkiplistEnd:
+    """Sentinel that sorts after every value"""
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return False
+
+
+class _SkiplistNode:
+    __slots__ = ('value', 'next', 'width')
+
+    def __init__(self, value, next_nodes, widths):
+        self.value = value
+        self.next = next_nodes
+        self.width = widths
+
+
+class RankedIndex:
+    """Indexable skiplist of users ordered by score (highest first).
+
+    Insert, remove and rank lookups are O(log n); reading the top K is O(K).
+    Ties keep the order passed in by the caller, like a stable sort would.
+    """
+
+    MAX_LEVELS = 20
+
+    def __init__(self):
+        end = _SkiplistNode(_SkiplistEnd(), [], [])
+        self.head = _SkiplistNode(None, [end] * self.MAX_LEVELS, [1] * self.MAX_LEVELS)
+        self.size = 0
+        self.values = {}  # user_key -> (-score, order, user_key)
+
+    def __len__(self):
+        return self.size
+
+    def _find_chain(self, value):
+        chain = [None] * self.MAX_LEVELS
+        steps = [0] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].value < value:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def _insert(self, value):
+        chain, steps_at_level = self._find_chain(value)
+        levels = min(self.MAX_LEVELS, 1 - int(math.log(1.0 - random.random(), 2.0)))
+        node = _SkiplistNode(value, [None] * levels, [None] * levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            node.next[level] = prev.next[level]
+            prev.next[level] = node
+            node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def _remove(self, value):
+        chain, _ = self._find_chain(value)
+        node = chain[0].next[0]
+        for level in range(len(node.next)):
+            prev = chain[level]
+            prev.width[level] += node.width[level] - 1
+            prev.next[level] = node.next[level]
+        for level in range(len(node.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def update(self, user_key, score, order):
+        """Set a user's score; users with no score are left out"""
+        old = self.values.pop(user_key, None)
+        if old is not None:
+            self._remove(old)
+        if score > 0:
+            value = (-score, order, user_key)
+            self._insert(value)
+            self.values[user_key] = value
+
+    def remove(self, user_key):
+        self.update(user_key, 0, 0)
+
+    def rank(self, user_key):
+        """1-based position of a user, or None if they have no score - O(log n)"""
+        value = self.values.get(user_key)
+        if value is None:
+            return None
+        node = self.head
+        position = 0
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].value < value:
+                position += node.width[level]
+                node = node.next[level]
+        return position + 1
+
+    def at(self, position):
+        """(user_key, score) at a 1-based position - O(log n)"""
+        if not 1 <= position <= self.size:
+            raise IndexError(position)
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.width[level] <= position:
+                position -= node.width[level]
+                node = node.next[level]
+        neg_score, _, user_key = node.value
+        return user_key, -neg_score
+
+    def top(self, limit=None):
+        """(user_key, score) pairs from the top, at most limit of them"""
+        result = []
+        node = self.head.next[0]
+        while not isinstance(node.value, _SkiplistEnd):
+            if limit is not None and len(result) >= limit:
+                break
+            neg_score, _, user_key = node.value
+            result.append((user_key, -neg_score))
+            node = node.next[0]
+        return result
+
+
+class LeaderboardCache:
+    """Rendered leaderboard messages per (chat, period), dropped when rankings change"""
+
     def __init__(self):
+        self.entries = {}  # (chat_id, period) -> (period_key, text, parse_mode)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, chat_id, period, period_key):
+        entry = self.entries.get((chat_id, period))
+        if entry and entry[0] == period_key:
+            self.hits += 1
+            return entry[1], entry[2]
+        self.misses += 1
+        return None
+
+    def put(self, chat_id, period, period_key, text, parse_mode=None):
+        self.entries[(chat_id, period)] = (period_key, text, parse_mode)
+
+    def invalidate(self):
+        if self.entries:
+            self.entries.clear()
+        self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'entries': len(self.entries)
+        }
+
+
+class AdminCache:
+    """Admin status per (chat, user), trusted for a TTL and updated from member changes"""
+
+    ADMIN_STATUSES = ('creator', 'administrator')
+
+    def __init__(self, ttl=ADMIN_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.entries = {}  # (chat_id, user_id) -> (is_admin, expires_at)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id, user_id):
+        entry = self.entries.get((chat_id, user_id))
+        if entry and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        return None
+
+    def put_status(self, chat_id, user_id, status):
+        is_admin = status in self.ADMIN_STATUSES
+        self.entries[(chat_id, user_id)] = (is_admin, time.monotonic() + self.ttl)
+        if len(self.entries) > 10000:
+            now = time.monotonic()
+            self.entries = {key: entry for key, entry in self.entries.items() if entry[1] > now}
+        return is_admin
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries)
+        }
+
+
+class TokenBucket:
+    """`rate` tokens per second, bursting up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundQueue(BaseRateLimiter):
+    """Central queue for outgoing messages: token buckets per chat and overall, priority lanes.
+
+    Every Bot API call goes through process_request(). Sends wait in their lane
+    (rate_limit_args, default PRIORITY_NORMAL) until both the global and the chat's
+    bucket have a token; other calls go straight through. RetryAfter pauses all
+    sends for the time Telegram asks and the request is retried.
+    """
+
+    THROTTLED_PREFIXES = ('send', 'forward', 'copy')
+    LANES = (PRIORITY_URGENT, PRIORITY_NORMAL, PRIORITY_LOW)
+
+    def __init__(self, global_per_second=OUTBOUND_GLOBAL_PER_SECOND,
+                 group_per_minute=OUTBOUND_GROUP_PER_MINUTE,
+                 private_per_second=OUTBOUND_PRIVATE_PER_SECOND,
+                 max_retries=OUTBOUND_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_per_second, global_per_second)
+        self.group_rate = group_per_minute / 60
+        self.group_burst = min(group_per_minute, 3)
+        self.private_rate = private_per_second
+        self.max_retries = max_retries
+        self.chat_buckets = {}
+        self.lanes = {lane: deque() for lane in self.LANES}  # lane -> deque of (chat_id, future)
+        self.paused_until = 0
+        self.sent = 0
+        self.retries = 0
+        self._wakeup = None
+        self._worker = None
+
+    async def initialize(self):
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.create_task(self._grant_loop())
+
+    async def shutdown(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 1000:
+                # Forget idle chats; a full bucket is the same as a new one
+                now = time.monotonic()
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if not b.is_full(now)}
+            is_group = isinstance(chat_id, str) or int(chat_id) < 0
+            if is_group:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, 1)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _next_ready(self, now):
+        """Pick the first ready send by lane; otherwise return how long to wait"""
+        wait = max(self.paused_until - now, self.global_bucket.wait_time(now))
+        if wait > 0:
+            return None, wait
+        
+        wait = None
+        for lane in self.LANES:
+            for item in self.lanes[lane]:
+                chat_id, future = item
+                if future.done():
+                    continue
+                chat_wait = self._chat_bucket(chat_id).wait_time(now)
+                if chat_wait == 0:
+                    self.lanes[lane].remove(item)
+                    return item, 0
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+        return None, wait
+
+    async def _grant_loop(self):
+        while True:
+            now = time.monotonic()
+            for lane in self.lanes.values():
+                while lane and lane[0][1].done():
+                    lane.popleft()
+            item, wait = self._next_ready(now)
+            if item:
+                chat_id, future = item
+                self.global_bucket.take(now)
+                self._chat_bucket(chat_id).take(now)
+                future.set_result(None)
+                continue
+            
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _wait_turn(self, chat_id, lane, first=False):
+        future = asyncio.get_running_loop().create_future()
+        if first:
+            self.lanes[lane].appendleft((chat_id, future))
+        else:
+            self.lanes[lane].append((chat_id, future))
+        self._wakeup.set()
+        await future
+
+    def pending(self):
+        return {lane: len(items) for lane, items in self.lanes.items()}
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        throttled = chat_id is not None and endpoint.startswith(self.THROTTLED_PREFIXES) and self._worker is not None
+        lane = rate_limit_args if rate_limit_args in self.lanes else PRIORITY_NORMAL
+        
+        attempt = 0
+        while True:
+            if throttled:
+                await self._wait_turn(chat_id, lane, first=attempt > 0)
+            try:
+                result = await callback(*args, **kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                self.retries += 1
+                logger.warning(f"Flood control on {endpoint} to {chat_id}: retrying in {delay}s")
+                if not throttled:
+                    await asyncio.sleep(delay)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently, but each user's updates one at a time (in arrival order)"""
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(max(1, max_concurrent_updates))
+        self.user_locks = {}  # user id -> [lock, updates holding or waiting for it]
+
+    async def run_serialized(self, user_id, coroutine):
+        """Run a coroutine once no other update of this user is running"""
+        entry = self.user_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.user_locks[user_id]
+
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, 'effective_user', None)
+        if user is None:
+            await coroutine
+            return
+        await self.run_serialized(user.id, coroutine)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+class AnnouncementDigest:
+    """Group announcements buffered until the next digest flush"""
+
+    def __init__(self, max_items=ANNOUNCE_DIGEST_MAX):
+        self.max_items = max_items
+        self.items = []
+
+    def add(self, line):
+        """Buffer one announcement; True once the digest is full and should be sent"""
+        self.items.append(line)
+        return len(self.items) >= self.max_items
+
+    def drain(self):
+        """Take everything buffered as one combined message (None if empty)"""
+        if not self.items:
+            return None
+        items, self.items = self.items, []
+        header = f"📹 {len(items)} new video{'s' if len(items) != 1 else ''} submitted:\n\n"
+        return header + "\n".join(items)
+
+
+def split_message(parts, limit=MAX_MESSAGE_LENGTH):
+    """Join text parts into as few messages as fit the length limit, splitting a part only if it alone is too long"""
+    messages = ['']
+    for part in parts:
+        while len(part) > limit:
+            messages.append(part[:limit])
+            part = part[limit:]
+        if len(messages[-1]) + len(part) > limit:
+            messages.append('')
+        messages[-1] += part
+    return [message for message in messages if message]
+
+
+def is_permanent_send_error(error):
+    """Errors that will not go away by retrying (bot blocked, chat not found, bad markup)"""
+    return isinstance(error, (Forbidden, BadRequest))
+
+
+class Outbox:
+    """Failed outgoing messages waiting for a retry, and the ones that gave up (dead letters)"""
+
+    MAX_DELAY = 3600
+
+    def __init__(self, data=None, max_attempts=OUTBOX_MAX_ATTEMPTS, base_delay=OUTBOX_RETRY_BASE_SECONDS):
+        data = data or {}
+        self.retrying = data.get('retrying', [])
+        self.dead = data.get('dead', [])
+        self.next_id = data.get('next_id', 1)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.sending = set()  # ids of entries a retry is sending right now
+
+    def to_dict(self):
+        return {'retrying': self.retrying, 'dead': self.dead, 'next_id': self.next_id}
+
+    def _schedule(self, entry, now):
+        delay = min(self.MAX_DELAY, self.base_delay * 2 ** (entry['attempts'] - 1))
+        entry['next_attempt'] = now + delay
+
+    def add(self, chat_id, text, parse_mode, priority, error, permanent=False, now=None):
+        """Record a send that just failed for the first time"""
+        now = now or time.time()
+        entry = {
+            'id': self.next_id,
+            'chat_id': chat_id,
+            'text': text,
+            'parse_mode': parse_mode,
+            'priority': priority,
+            'attempts': 0,
+            'created': datetime.now().isoformat()
+        }
+        self.next_id += 1
+        self.retrying.append(entry)
+        self.failed(entry, error, permanent, now)
+        return entry
+
+    def take_due(self, now=None):
+        """Entries due for a retry, marked as being sent until done() so no other retry takes them"""
+        now = now or time.time()
+        due = [
+            entry for entry in self.retrying
+            if entry['next_attempt'] <= now and entry['id'] not in self.sending
+        ]
+        self.sending.update(entry['id'] for entry in due)
+        return due
+
+    def done(self, entry):
+        self.sending.discard(entry['id'])
+
+    def succeeded(self, entry):
+        if entry in self.retrying:
+            self.retrying.remove(entry)
+
+    def failed(self, entry, error, permanent=False, now=None):
+        """Back off, or move to the dead letters once out of attempts"""
+        if entry not in self.retrying:
+            return True  # already delivered or given up on elsewhere
+        entry['attempts'] += 1
+        entry['last_error'] = str(error)
+        if permanent or entry['attempts'] >= self.max_attempts:
+            self.retrying.remove(entry)
+            entry.pop('next_attempt', None)
+            self.dead.append(entry)
+            return False
+        self._schedule(entry, now or time.time())
+        return True
+
+    def replay(self, entry_id=None):
+        """Move one dead letter (or all of them) back to the retry queue, due now"""
+        replayed = [entry for entry in self.dead if entry_id is None or entry['id'] == entry_id]
+        for entry in replayed:
+            self.dead.remove(entry)
+            entry['attempts'] = 0
+            entry['next_attempt'] = 0
+            self.retrying.append(entry)
+        return len(replayed)
+
+
+async def find_mp4_box(read_range, start, end, box_type, max_boxes=1000):
+    """(payload start, payload end) of the first box of box_type in [start, end), reading only headers"""
+    offset = start
+    for _ in range(max_boxes):
+        if end is not None and offset + 8 > end:
+            return None
+        header = await read_range(offset, 16)
+        if len(header) < 8:
+            return None
+        size, kind = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                return None
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            # Box runs to the end of its parent (or of the file)
+            size = end - offset if end is not None else None
+        if kind == box_type:
+            return offset + header_size, (offset + size if size is not None else end)
+        if size is None or size < header_size:
+            return None
+        offset += size
+    return None
+
+
+async def read_mp4_duration(read_range, file_size=None):
+    """Duration in seconds from an MP4/MOV's moov/mvhd atom, or None if there is none.
+
+    read_range(offset, length) returns those bytes of the file. Only box headers
+    and the mvhd body are read, so mdat (the actual video) is never downloaded.
+    """
+    moov = await find_mp4_box(read_range, 0, file_size, b'moov')
+    if moov is None:
+        return None
+    mvhd = await find_mp4_box(read_range, moov[0], moov[1], b'mvhd')
+    if mvhd is None:
+        return None
+    body = await read_range(mvhd[0], 32)
+    if len(body) < 20:
+        return None
+    if body[0] == 1:
+        if len(body) < 32:
+            return None
+        timescale, duration = struct.unpack('>IQ', body[20:32])
+    else:
+        timescale, duration = struct.unpack('>II', body[12:20])
+    # Fragmented files leave the duration at 0
+    if not timescale or not duration:
+        return None
+    return duration / timescale
+
+
+async def read_video_duration(file, client):
+    """Container duration of a Bot API File: read from disk with a local Bot API server, else by HTTP range requests"""
+    path = file.file_path
+    if path and os.path.isfile(path):
+        def read_local(offset, length):
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return f.read(length)
+
+        async def read_range(offset, length):
+            return await asyncio.to_thread(read_local, offset, length)
+        return await read_mp4_duration(read_range, os.path.getsize(path))
+
+    async def read_range(offset, length):
+        headers = {'Range': f'bytes={offset}-{offset + length - 1}'}
+        async with client.stream('GET', path, headers=headers) as response:
+            # A server ignoring Range would send the whole file - only usable from the start
+            if response.status_code != 206 and not (response.status_code == 200 and offset == 0):
+                raise ValueError(f"range request failed (HTTP {response.status_code})")
+            data = b''
+            async for chunk in response.aiter_bytes():
+                data += chunk
+                if len(data) >= length:
+                    break
+            return data[:length]
+    return await read_mp4_duration(read_range, file.file_size)
+
+
+class DurationVerifier:
+    """Checks reported video durations against the MP4 header on a few background tasks.
+
+    submit() never waits: checks queue up (at most max_queued, extra ones are
+    dropped) and run after the user already has their reply. The queue lives in
+    memory, so checks still pending at shutdown are skipped.
+    """
+
+    def __init__(self, workers=VERIFY_DURATION_WORKERS, max_queued=VERIFY_DURATION_MAX_QUEUED):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.queue = None
+        self.bot = None
+        self.client = None
+        self._tasks = []
+
+    def start(self, bot):
+        self.bot = bot
+        self.queue = asyncio.Queue(self.max_queued)
+        self.client = httpx.AsyncClient(timeout=30)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(max(1, self.workers))]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.client is not None:
+            await self.client.aclose()
+        self.queue = None
+
+    def submit(self, partition, user_id, username, video, credit):
+        """Queue a check of one credited video (credit: see process_video_submission)"""
+        if self.queue is None:
+            return
+        try:
+            self.queue.put_nowait((partition, user_id, username, video, credit))
+        except asyncio.QueueFull:
+            logger.warning(f"Duration check queue full - skipped {video.file_unique_id}")
+
+    async def _work(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.verify(*job)
+            except Exception as e:
+                logger.error(f"Error verifying duration of {job[3].file_unique_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def verify(self, partition, user_id, username, video, credit):
+        try:
+            file = await self.bot.get_file(video.file_id)
+            actual = await read_video_duration(file, self.client)
+        except TelegramError as e:
+            # e.g. over the Bot API's 20 MB download limit
+            logger.info(f"Can't verify duration of {video.file_unique_id}: {e}")
+            return
+        if actual is None:
+            logger.info(f"Can't verify duration of {video.file_unique_id}: no MP4 duration")
+            return
+        
+        overclaimed = int(video.duration - actual)
+        if overclaimed <= VERIFY_DURATION_TOLERANCE_SECONDS:
+            return
+        
+        token = _active_partition.set(partition)
+        try:
+            taken_back = 0
+            if VERIFY_DURATION == 'reverse':
+                taken_back = current_bot().reverse_video_time(user_id, overclaimed, credit)
+            current_bot().flag_video_duration(user_id, video.file_unique_id, video.duration, int(actual), taken_back)
+            logger.warning(
+                f"Duration mismatch from {username}: reported {video.duration}s, "
+                f"file is {int(actual)}s ({taken_back}s taken back)"
+            )
+            text = (
+                f"⚠️ @{username}'s video was reported as {current_bot().format_duration(video.duration)} "
+                f"but is only {current_bot().format_duration(int(actual))} long."
+            )
+            if taken_back:
+                text += f"\n{current_bot().format_duration(taken_back)} has been taken back."
+            if partition.reminder_chat_id:
+                await send_or_retry_later(self.bot, partition.reminder_chat_id, text)
+        finally:
+            _active_partition.reset(token)
+
+
+class VideoBot:
+    def __init__(self, storage=None, activity_log=None, io_executor=None):
+        self.storage = storage or JsonStorage()
+        self.activity_log = activity_log or ActivityLog()
+        # Write-behind: save_* calls only mark stores dirty, flush() writes them
+        self.save_interval = SAVE_INTERVAL_SECONDS
+        self._dirty = {}  # store name -> set of changed keys, or None for everything
+        self._dirty_lock = threading.Lock()
+        # One storage thread, so writes hit the disk in the order they were queued
+        self.io_executor = io_executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage')
         self.user_deficits = self.load_data()
+        # Per-period rankings, kept up to date by add_video_time()
+        self.leaderboards = {}  # period -> (period_key, RankedIndex)
+        self._user_order = {user_key: i for i, user_key in enumerate(self.user_deficits)}
+        self._next_user_order = len(self._user_order)
+        self.leaderboard_cache = LeaderboardCache()
         self.video_hashes = self.load_video_hashes()
+        self.video_index = self.build_video_index()
         self.user_activities = self.load_user_activities()
+        self._change_seq = None  # sharded mode: last change-log entry refresh_from_storage() took in
+        self.rollover_runs = self.load_rollover_runs()  # timezone -> last midnight run
+        self.outbox = self.load_outbox()
         self.kick_threshold = 60 * 60 * 60  # 60 hours in seconds
         self.warning_thresholds = {
             'quarter': 15 * 60 * 60,  # 15 hours (25%)
@@ -197,59 +2010,92 @@ class VideoBot:
             'three_quarter': 45 * 60 * 60  # 45 hours (75%)
         }
     
+    def load_rollover_runs(self):
+        """Load the last midnight rollover run of each timezone"""
+        try:
+            return self.storage.load_setting(shard_setting('rollover_runs')) or {}
+        except Exception as e:
+            logger.error(f"Error loading rollover runs: {e}")
+            return {}
+    
+    def save_rollover_run(self, timezone, day, status, processed=0):
+        """Record a rollover run's progress (queued behind any pending user writes)"""
+        self.rollover_runs[timezone] = {
+            'run_id': f"{timezone}/{day}",
+            'day': day,
+            'status': status,
+            'processed': processed,
+            'updated': datetime.now().isoformat()
+        }
+        self.run_io(self.storage.save_setting, shard_setting('rollover_runs'), copy.deepcopy(self.rollover_runs))
+    
+    def load_outbox(self):
+        """Load failed sends still waiting for a retry, and the dead letters"""
+        try:
+            return Outbox(self.storage.load_setting(shard_setting('outbox')))
+        except Exception as e:
+            logger.error(f"Error loading outbox: {e}")
+            return Outbox()
+    
+    def save_outbox(self):
+        """Save the outbox (written on the storage thread)"""
+        self.run_io(self.storage.save_setting, shard_setting('outbox'), copy.deepcopy(self.outbox.to_dict()))
+    
     def load_user_activities(self):
-        """Load user activity log"""
-        activity_file = os.path.join(DATA_DIR, 'user_activities.json')
-        if os.path.exists(activity_file):
+        """Load per-user activity summaries"""
+        try:
+            summaries = self.storage.load_user_activities()
+        except Exception as e:
+            logger.error(f"Error loading user activities: {e}")
+            return {}
+        
+        # Move activity lists from the old format into the log segments
+        legacy = []
+        for user_key, data in summaries.items():
+            for entry in data.pop('activities', None) or []:
+                legacy.append(dict(entry, user_id=data.get('user_id', user_key), username=data.get('username')))
+        if legacy:
             try:
-                with open(activity_file, 'r') as f:
-                    return json.load(f)
+                self.activity_log.write(legacy)
+                self.storage.save_user_activities(summaries)
+                logger.info(f"Moved {len(legacy)} activities from user_activities into {self.activity_log.log_dir}")
             except Exception as e:
-                logger.error(f"Error loading user activities: {e}")
-                return {}
-        return {}
+                logger.error(f"Error migrating user activities: {e}")
+        return summaries
     
-    def save_user_activities(self):
-        """Save user activity log"""
-        try:
-            activity_file = os.path.join(DATA_DIR, 'user_activities.json')
-            with open(activity_file, 'w') as f:
-                json.dump(self.user_activities, f, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving user activities: {e}")
+    def save_user_activities(self, *user_ids):
+        """Mark user activities for saving (only the given users if any are passed)"""
+        self.mark_dirty('user_activities', [str(user_id) for user_id in user_ids])
     
     def log_activity(self, user_id, username, activity_type, details=None):
         """Log any user activity in the bot"""
         user_key = str(user_id)
         timestamp = datetime.now().isoformat()
         
-        # Initialize user activity record if not exists
+        # Initialize user summary if not exists
         if user_key not in self.user_activities:
             self.user_activities[user_key] = {
                 'user_id': user_id,
                 'username': username,
                 'first_seen': timestamp,
-                'started_bot': False,
-                'activities': []
+                'started_bot': False
             }
+            self.save_user_activities(user_id)
+        elif self.user_activities[user_key].get('username') != username:
+            # Update username if changed
+            self.user_activities[user_key]['username'] = username
+            self.save_user_activities(user_id)
         
-        # Update username if changed
-        self.user_activities[user_key]['username'] = username
-        
-        # Log the activity
-        activity_entry = {
+        # The activity itself only goes to the append-only log
+        self.activity_log.append({
             'timestamp': timestamp,
+            'user_id': user_id,
+            'username': username,
             'type': activity_type,
             'details': details
-        }
-        
-        self.user_activities[user_key]['activities'].append(activity_entry)
-        
-        # Keep only last 100 activities per user to avoid huge files
-        if len(self.user_activities[user_key]['activities']) > 100:
-            self.user_activities[user_key]['activities'] = self.user_activities[user_key]['activities'][-100:]
-        
-        self.save_user_activities()
+        })
+        if self.save_interval <= 0:
+            self.flush_in_background()
         logger.info(f"Activity logged: {username} - {activity_type}")
     
     def mark_bot_started(self, user_id, username):
@@ -261,13 +2107,12 @@ class VideoBot:
                 'user_id': user_id,
                 'username': username,
                 'first_seen': datetime.now().isoformat(),
-                'started_bot': False,
-                'activities': []
+                'started_bot': False
             }
         
         self.user_activities[user_key]['started_bot'] = True
         self.user_activities[user_key]['bot_started_at'] = datetime.now().isoformat()
-        self.save_user_activities()
+        self.save_user_activities(user_id)
     
     def get_bot_subscribers_count(self):
         """Get count of users who have started the bot"""
@@ -282,78 +2127,261 @@ class VideoBot:
         return len(self.user_activities)
     
     def load_data(self):
-        """Load user deficit data from file"""
-        if os.path.exists(DATA_FILE):
+        """Load user deficit data from storage"""
+        try:
+            data = self.storage.load_users()
+            # Migrate old data format if needed
+            for user_id in data:
+                if 'total_worked_seconds' not in data[user_id]:
+                    data[user_id]['total_worked_seconds'] = 0
+                if 'daily_worked' not in data[user_id]:
+                    data[user_id]['daily_worked'] = {}
+                if 'weekly_worked' not in data[user_id]:
+                    data[user_id]['weekly_worked'] = {}
+                if 'monthly_worked' not in data[user_id]:
+                    data[user_id]['monthly_worked'] = {}
+                if 'streak_days' not in data[user_id]:
+                    data[user_id]['streak_days'] = 0
+                if 'last_video_date' not in data[user_id]:
+                    data[user_id]['last_video_date'] = None
+                if 'warnings_sent' not in data[user_id]:
+                    data[user_id]['warnings_sent'] = []
+            return data
+        except Exception as e:
+            logger.error(f"Error loading data: {e}")
+            return {}
+    
+    def load_video_hashes(self):
+        """Load video hashes from storage, converting old entries to the compact form"""
+        try:
+            hashes = self.storage.load_video_hashes()
+        except Exception as e:
+            logger.error(f"Error loading video hashes: {e}")
+            return {}
+        
+        converted = [key for key, row in hashes.items() if not isinstance(row, list)]
+        for key in converted:
+            hashes[key] = VideoDedupIndex.compact_entry(hashes[key])
+        if converted:
+            self._merge_dirty('video_hashes', converted)
+        return hashes
+    
+    def build_video_index(self):
+        """Wrap the video hashes in the dedup index (with a Bloom filter if enabled)"""
+        index = VideoDedupIndex(self.video_hashes, BloomFilter() if DEDUP_BLOOM_FILTER else None)
+        if index.bloom is not None:
             try:
-                with open(DATA_FILE, 'r') as f:
-                    data = json.load(f)
-                    # Migrate old data format if needed
-                    for user_id in data:
-                        if 'total_worked_seconds' not in data[user_id]:
-                            data[user_id]['total_worked_seconds'] = 0
-                        if 'daily_worked' not in data[user_id]:
-                            data[user_id]['daily_worked'] = {}
-                        if 'weekly_worked' not in data[user_id]:
-                            data[user_id]['weekly_worked'] = {}
-                        if 'monthly_worked' not in data[user_id]:
-                            data[user_id]['monthly_worked'] = {}
-                        if 'streak_days' not in data[user_id]:
-                            data[user_id]['streak_days'] = 0
-                        if 'last_video_date' not in data[user_id]:
-                            data[user_id]['last_video_date'] = None
-                        if 'warnings_sent' not in data[user_id]:
-                            data[user_id]['warnings_sent'] = []
-                    return data
+                for file_unique_id, _ in self.storage.iter_archived_videos():
+                    index.add_archived(file_unique_id)
             except Exception as e:
-                logger.error(f"Error loading data: {e}")
-                return {}
-        return {}
+                logger.error(f"Error loading archived video IDs: {e}")
+        return index
     
-    def load_video_hashes(self):
-        """Load video hashes from file"""
-        if os.path.exists(HASH_FILE):
+    def save_data(self, *user_ids):
+        """Mark user deficit data for saving - pass user IDs to persist only those rows"""
+        self.mark_dirty('users', [str(user_id) for user_id in user_ids])
+    
+    def save_video_hashes(self, *file_unique_ids):
+        """Mark video hashes for saving - pass IDs to persist only those entries"""
+        self.mark_dirty('video_hashes', list(file_unique_ids))
+    
+    def mark_dirty(self, store, keys=None):
+        """Remember that a store changed; queue a write right away if write-behind is off"""
+        self._merge_dirty(store, keys)
+        if self.save_interval <= 0:
+            self.flush_in_background()
+    
+    def _merge_dirty(self, store, keys):
+        with self._dirty_lock:
+            if not keys:
+                self._dirty[store] = None
+            elif store not in self._dirty:
+                self._dirty[store] = set(keys)
+            elif self._dirty[store] is not None:
+                self._dirty[store].update(keys)
+    
+    def has_pending_writes(self):
+        """Check if any store has changes that are not on disk yet"""
+        return bool(self._dirty) or self.activity_log.has_pending()
+    
+    def _take_pending(self):
+        """Copy the dirty rows on this thread, so the writer never sees a half-updated dict"""
+        sources = {
+            'users': self.user_deficits,
+            'video_hashes': self.video_hashes,
+            'user_activities': self.user_activities,
+        }
+        with self._dirty_lock:
+            pending, self._dirty = self._dirty, {}
+        
+        snapshot = []
+        for store, keys in pending.items():
+            data = sources[store]
+            if keys is None:
+                rows = copy.deepcopy(data)
+            else:
+                rows = {key: copy.deepcopy(data[key]) for key in keys if key in data}
+            snapshot.append((store, keys, rows))
+        
+        entries = self.activity_log.take()
+        if entries:
+            snapshot.append(('activity_log', None, entries))
+        return snapshot
+    
+    def _write_pending(self, snapshot):
+        """Serialize and write a snapshot - runs on the storage thread"""
+        savers = {
+            'users': (self.storage.save_users, "Error saving data"),
+            'video_hashes': (self.storage.save_video_hashes, "Error saving video hashes"),
+            'user_activities': (self.storage.save_user_activities, "Error saving user activities"),
+        }
+        for store, keys, rows in snapshot:
+            if store == 'activity_log':
+                try:
+                    self.activity_log.write(rows)
+                except Exception as e:
+                    logger.error(f"Error writing activity log: {e}")
+                continue
+            save, error_message = savers[store]
             try:
-                with open(HASH_FILE, 'r') as f:
-                    return json.load(f)
+                save(rows, None if keys is None else list(keys))
             except Exception as e:
-                logger.error(f"Error loading video hashes: {e}")
-                return {}
-        return {}
+                logger.error(f"{error_message}: {e}")
+                # Keep it dirty so the next flush retries
+                self._merge_dirty(store, keys)
     
-    def save_data(self):
-        """Save user deficit data to file"""
-        try:
-            with open(DATA_FILE, 'w') as f:
-                json.dump(self.user_deficits, f, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving data: {e}")
+    def flush_in_background(self):
+        """Queue all pending changes on the storage thread without waiting"""
+        return self.io_executor.submit(self._write_pending, self._take_pending())
     
-    def save_video_hashes(self):
-        """Save video hashes to file"""
-        try:
-            with open(HASH_FILE, 'w') as f:
-                json.dump(self.video_hashes, f, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving video hashes: {e}")
+    async def flush_async(self):
+        """Write all pending changes on the storage thread and wait for them"""
+        await asyncio.wrap_future(self.flush_in_background())
+    
+    def flush(self):
+        """Write all pending changes and block until they are on disk"""
+        self.flush_in_background().result()
+    
+    def run_io(self, func, *args):
+        """Queue any other storage call behind the pending writes"""
+        def run():
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Error in storage call {func.__name__}: {e}")
+        return self.io_executor.submit(run)
     
     def is_duplicate_video(self, file_id, file_unique_id):
-        """Check if this video has been submitted before"""
-        return file_unique_id in self.video_hashes
+        """Check if this video is in the hot index (see find_duplicate_video for the archive)"""
+        return self.video_index.get(file_unique_id) is not None
     
-    def add_video_hash(self, file_id, file_unique_id, user_id, username, duration):
+    def add_video_hash(self, file_id, file_unique_id, user_id, username, duration, phash=None, fingerprint=None):
         """Record this video to prevent duplicates"""
-        self.video_hashes[file_unique_id] = {
-            'file_id': file_id,
-            'user_id': str(user_id),
-            'username': username,
-            'duration': duration,
-            'first_submitted': datetime.now().isoformat()
-        }
-        self.save_video_hashes()
+        self.video_index.add(file_unique_id, user_id, username, duration, phash, fingerprint)
+        self.save_video_hashes(file_unique_id)
     
     def get_video_info(self, file_unique_id):
-        """Get info about when this video was first submitted"""
-        return self.video_hashes.get(file_unique_id, None)
+        """Get info about when this video was first submitted (hot index only)"""
+        return self.video_index.get(file_unique_id)
+    
+    async def find_duplicate_video(self, file_unique_id):
+        """Get the original submission of this video from the hot index or the archive"""
+        info = self.video_index.get(file_unique_id)
+        if info:
+            return info
+        if WORKER_COUNT > 1:
+            # Videos other workers took since our last refresh are only in the database
+            row = await asyncio.wrap_future(
+                self.io_executor.submit(self.storage.find_video_hash, file_unique_id)
+            )
+            if row:
+                return VideoDedupIndex.expand_entry(VideoDedupIndex.compact_entry(row))
+        elif not self.video_index.might_contain(file_unique_id):
+            return None
+        
+        row = await asyncio.wrap_future(
+            self.io_executor.submit(self.storage.find_archived_video, file_unique_id)
+        )
+        return VideoDedupIndex.expand_entry(row) if row else None
+    
+    async def claim_video_hash(self, file_unique_id):
+        """Sharded mode: claim a just-recorded video in the shared database before crediting it.
+        
+        Another worker may have credited it without flushing yet; then its row
+        wins, replaces ours in the index, and its original submission is returned.
+        """
+        row = await asyncio.wrap_future(self.io_executor.submit(
+            self.storage.claim_video_hash, file_unique_id, self.video_index.entries[file_unique_id]
+        ))
+        if row is None:
+            return None
+        row = VideoDedupIndex.compact_entry(row)
+        self.video_index.entries[file_unique_id] = row
+        return VideoDedupIndex.expand_entry(row)
+    
+    async def refresh_from_storage(self):
+        """Sharded mode: take in the users, videos and subscribers other workers saved"""
+        def load():
+            changes = None if self._change_seq is None else self.storage.changes_since(self._change_seq)
+            if changes is None:
+                # First refresh, or we fell behind the change log: reload everything
+                seq = self.storage.last_change()
+                return (seq, True, self.storage.load_users(), self.storage.load_video_hashes(),
+                        self.storage.load_user_activities())
+            seq, changed = changes
+            users = {key: self.storage.load_user(key) for key in changed['users'] if not owns_user(key)}
+            hashes = {}
+            for key in changed['video_hashes']:
+                row = self.storage.find_video_hash(key)
+                if row:
+                    hashes[key] = row
+            activities = {
+                key: self.storage.load_user_activity(key) for key in changed['user_activities'] if not owns_user(key)
+            }
+            return seq, False, users, hashes, activities
+        seq, full, users, hashes, activities = await asyncio.wrap_future(self.io_executor.submit(load))
+        
+        changed = 0
+        for user_key in (set(self.user_deficits) | set(users) if full else users):
+            # Our own users are only ever written by us, so memory is the truth for them
+            if owns_user(user_key) or users.get(user_key) == self.user_deficits.get(user_key):
+                continue
+            if users.get(user_key) is not None:
+                if user_key not in self._user_order:
+                    self._register_user(user_key)
+                self.user_deficits[user_key] = users[user_key]
+                self._update_rankings(user_key)
+            else:
+                del self.user_deficits[user_key]
+                self._update_rankings(user_key)
+                del self._user_order[user_key]
+            changed += 1
+        
+        for user_key, data in activities.items():
+            if owns_user(user_key):
+                continue
+            if data is not None:
+                self.user_activities[user_key] = data
+            else:
+                self.user_activities.pop(user_key, None)
+        
+        added = self.video_index.merge(hashes)
+        self._change_seq = seq
+        if changed or added:
+            logger.info(f"Refreshed {changed} users and {added} videos from other workers")
+    
+    def evict_old_video_hashes(self, retention_days=DEDUP_RETENTION_DAYS):
+        """Move index entries older than the retention window to the cold archive"""
+        if retention_days <= 0:
+            return 0
+        cutoff = (datetime.now() - timedelta(days=retention_days)).timestamp()
+        expired = self.video_index.pop_older_than(cutoff)
+        if expired:
+            # Queued before the flush that drops them, so they are never lost
+            self.run_io(self.storage.archive_video_hashes, expired)
+            self.save_video_hashes(*expired)
+            logger.info(f"Archived {len(expired)} video hashes older than {retention_days} days")
+        return len(expired)
     
     def update_streak(self, user_id):
         """Update user's streak when they submit a video - reset if more than 24 hours gap"""
@@ -369,8 +2397,7 @@ class VideoBot:
         
         if last_video_timestamp:
             # Check time difference
-            last_dt = datetime.fromisoformat(last_video_timestamp)
-            time_diff = (now.replace(tzinfo=None) - last_dt).total_seconds()
+            time_diff = seconds_since(last_video_timestamp, now)
             
             if time_diff > 24 * 3600:  # More than 24 hours
                 # Reset streak to 1
@@ -386,40 +2413,43 @@ class VideoBot:
         
         self.user_deficits[user_key]['last_video_date'] = today
         self.user_deficits[user_key]['last_video_timestamp'] = now.isoformat()
-        self.save_data()
+        self.save_data(user_key)
     
-    def check_and_update_warnings(self, user_id, deficit_seconds):
-        """Check if user needs a warning and return the warning message if needed"""
+    def get_pending_warning(self, user_id, deficit_seconds):
+        """Return (level, message) if the user is due a new warning, without recording it"""
         user_key = str(user_id)
         warnings_sent = self.user_deficits[user_key].get('warnings_sent', [])
-        warning_message = None
         
         # Check each threshold
         if deficit_seconds >= self.warning_thresholds['three_quarter'] and 'three_quarter' not in warnings_sent:
-            warning_message = (
+            return 'three_quarter', (
                 "🚨 URGENT WARNING! 🚨\n\n"
                 "You are at 75% of the kick threshold (45 hours deficit)!\n"
                 "You need to catch up SOON or you will be automatically kicked at 60 hours deficit!"
             )
-            warnings_sent.append('three_quarter')
         elif deficit_seconds >= self.warning_thresholds['half'] and 'half' not in warnings_sent:
-            warning_message = (
+            return 'half', (
                 "⚠️ WARNING! ⚠️\n\n"
                 "You are at 50% of the kick threshold (30 hours deficit)!\n"
                 "Please catch up on your video hours to avoid being kicked."
             )
-            warnings_sent.append('half')
         elif deficit_seconds >= self.warning_thresholds['quarter'] and 'quarter' not in warnings_sent:
-            warning_message = (
+            return 'quarter', (
                 "⚡ Notice: You are at 25% of the kick threshold (15 hours deficit).\n"
                 "Keep an eye on your deficit to stay in the group!"
             )
-            warnings_sent.append('quarter')
-        
-        if warning_message:
-            self.user_deficits[user_key]['warnings_sent'] = warnings_sent
-            self.save_data()
+        return None
+    
+    def check_and_update_warnings(self, user_id, deficit_seconds):
+        """Check if user needs a warning and return the warning message if needed"""
+        user_key = str(user_id)
+        pending = self.get_pending_warning(user_id, deficit_seconds)
+        if not pending:
+            return None
         
+        level, warning_message = pending
+        self.user_deficits[user_key].setdefault('warnings_sent', []).append(level)
+        self.save_data(user_key)
         return warning_message
     
     def should_kick_user(self, user_id):
@@ -444,7 +2474,7 @@ class VideoBot:
                 new_warnings = ['quarter']
             
             self.user_deficits[user_key]['warnings_sent'] = new_warnings
-            self.save_data()
+            self.save_data(user_key)
     
     def format_duration(self, seconds):
         """Convert seconds to human-readable format"""
@@ -458,9 +2488,12 @@ class VideoBot:
         else:
             return f"{minutes} minute{'s' if minutes != 1 else ''}"
     
-    def get_period_key(self, period='day'):
-        """Get the current period key (day, week, or month)"""
-        now = get_current_time()
+    def get_period_key(self, period='day', user_id=None):
+        """Get the current period key (day, week, or month), in the user's timezone if given"""
+        now = get_current_time() if user_id is None else get_current_time_for_user(user_id)
+        return self._period_key_at(now, period)
+    
+    def _period_key_at(self, now, period):
         if period == 'day':
             return now.strftime('%Y-%m-%d')
         elif period == 'week':
@@ -474,6 +2507,7 @@ class VideoBot:
         user_key = str(user_id)
         
         if user_key not in self.user_deficits:
+            self._register_user(user_key)
             self.user_deficits[user_key] = {
                 'unique_id': len(self.user_deficits) + 1,
                 'username': username,
@@ -487,14 +2521,15 @@ class VideoBot:
                 'last_video_date': None,
                 'last_video_timestamp': None,
                 'warnings_sent': [],
+                'last_rollover_date': self.rollover_checkpoint(user_id),
                 'last_updated': None,
                 'daily_total_today': 0,
                 'today_date': None,
                 'started_bot': False
             }
         
-        # Check if it's a new day — reset daily counter
-        today = get_current_date_str()
+        # Check if it's a new day (in the user's timezone) — reset daily counter
+        today = get_current_date_str_for_user(user_id)
         if self.user_deficits[user_key].get('today_date') != today:
             self.user_deficits[user_key]['daily_total_today'] = 0
             self.user_deficits[user_key]['today_date'] = today
@@ -509,10 +2544,10 @@ class VideoBot:
             reduction = min(video_seconds, existing_deficit)
             self.user_deficits[user_key]['total_deficit_seconds'] = existing_deficit - reduction
         
-        # Add to period trackers
-        day_key = self.get_period_key('day')
-        week_key = self.get_period_key('week')
-        month_key = self.get_period_key('month')
+        # Add to period trackers (the user's own day, the one their rollover closes)
+        day_key = self.get_period_key('day', user_id)
+        week_key = self.get_period_key('week', user_id)
+        month_key = self.get_period_key('month', user_id)
         
         if day_key not in self.user_deficits[user_key]['daily_worked']:
             self.user_deficits[user_key]['daily_worked'][day_key] = 0
@@ -528,11 +2563,89 @@ class VideoBot:
         
         self.user_deficits[user_key]['username'] = username
         self.user_deficits[user_key]['last_updated'] = datetime.now().isoformat()
+        self._update_rankings(user_key)
         
         # Update streak
         self.update_streak(user_id)
         self.reset_warnings(user_id)
-        self.save_data()
+        self.save_data(user_key)
+    
+    def reverse_video_time(self, user_id, seconds, credit):
+        """Take back over-credited video time, with the deficit reduction it gave; returns seconds taken"""
+        user_key = str(user_id)
+        data = self.user_deficits.get(user_key)
+        if data is None:
+            return 0
+        
+        seconds = min(seconds, data.get('total_worked_seconds', 0))
+        data['total_worked_seconds'] -= seconds
+        for field, period_key in (('daily_worked', credit['day']), ('weekly_worked', credit['week']),
+                                  ('monthly_worked', credit['month'])):
+            if period_key in data.get(field, {}):
+                data[field][period_key] = max(0, data[field][period_key] - seconds)
+        
+        # The part of the deficit reduction the real time wouldn't have covered goes back on
+        credit['seconds'] -= seconds
+        given_back = max(0, credit['deficit_reduction'] - credit['seconds'])
+        credit['deficit_reduction'] -= given_back
+        deficit = given_back
+        if data.get('today_date') == credit['today_date']:
+            data['daily_total_today'] = max(0, data.get('daily_total_today', 0) - seconds)
+            day_total = data['daily_total_today']
+        else:
+            day_total = data.get('daily_worked', {}).get(credit['today_date'], 0)
+        if (data.get('last_rollover_date') or '') >= credit['today_date']:
+            # That day is already closed: the time taken back is a shortfall now,
+            # against the same user-day total the rollover used
+            deficit += max(0, MIN_DURATION - day_total) - max(0, MIN_DURATION - day_total - seconds)
+        data['total_deficit_seconds'] = data.get('total_deficit_seconds', 0) + deficit
+        
+        data['last_updated'] = datetime.now().isoformat()
+        self._update_rankings(user_key)
+        self.save_data(user_key)
+        return seconds
+    
+    def flag_video_duration(self, user_id, file_unique_id, reported, actual, taken_back=0):
+        """Remember a video whose reported length didn't match the file"""
+        user_key = str(user_id)
+        data = self.user_deficits.get(user_key)
+        if data is None:
+            return
+        data.setdefault('duration_flags', []).append({
+            'file_unique_id': file_unique_id,
+            'reported': reported,
+            'actual': actual,
+            'taken_back': taken_back,
+            'flagged_at': datetime.now().isoformat()
+        })
+        self.save_data(user_key)
+    
+    def flag_lookalike_video(self, user_id, file_unique_id, lookalikes):
+        """Remember a credited video whose metadata nearly matches earlier ones, and why"""
+        user_key = str(user_id)
+        data = self.user_deficits.get(user_key)
+        if data is None:
+            return
+        data.setdefault('lookalike_flags', []).append({
+            'file_unique_id': file_unique_id,
+            'matches': [
+                {'file_unique_id': match['file_unique_id'], 'username': match['username'], 'reasons': match['reasons']}
+                for match in lookalikes[:3]
+            ],
+            'flagged_at': datetime.now().isoformat()
+        })
+        self.save_data(user_key)
+    
+    def get_flagged_videos(self, limit=20):
+        """Newest duration and lookalike flags across all users"""
+        flagged = []
+        for data in self.user_deficits.values():
+            for flag in data.get('duration_flags', []):
+                flagged.append(dict(flag, kind='duration', username=data['username']))
+            for flag in data.get('lookalike_flags', []):
+                flagged.append(dict(flag, kind='lookalike', username=data['username']))
+        flagged.sort(key=lambda flag: flag['flagged_at'], reverse=True)
+        return flagged[:limit]
     
     def get_todays_total(self, user_id):
         """Get total video time submitted today"""
@@ -540,7 +2653,7 @@ class VideoBot:
         if user_key not in self.user_deficits:
             return 0
         
-        today = get_current_date_str()
+        today = get_current_date_str_for_user(user_id)
         if self.user_deficits[user_key].get('today_date') != today:
             return 0
         
@@ -557,6 +2670,7 @@ class VideoBot:
         user_key = str(user_id)
         
         if user_key not in self.user_deficits:
+            self._register_user(user_key)
             self.user_deficits[user_key] = {
                 'username': username,
                 'total_deficit_seconds': 0,
@@ -567,13 +2681,15 @@ class VideoBot:
                 'streak_days': 0,
                 'last_video_date': None,
                 'warnings_sent': [],
+                'last_rollover_date': self.rollover_checkpoint(user_id),
                 'last_updated': None
             }
         
         self.user_deficits[user_key]['total_deficit_seconds'] += deficit_seconds
         self.user_deficits[user_key]['username'] = username
         self.user_deficits[user_key]['last_updated'] = datetime.now().isoformat()
-        self.save_data()
+        self.invalidate_leaderboards()
+        self.save_data(user_key)
     
     def get_user_deficit(self, user_id):
         """Get total deficit for a user"""
@@ -582,6 +2698,10 @@ class VideoBot:
             return self.user_deficits[user_key]['total_deficit_seconds']
         return 0
     
+    def get_all_deficits(self):
+        """Get every user's data, keyed by user ID"""
+        return self.user_deficits
+    
     def get_user_total_hours(self, user_id):
         """Get total hours worked for a user"""
         user_key = str(user_id)
@@ -596,45 +2716,126 @@ class VideoBot:
             return self.user_deficits[user_key].get('streak_days', 0)
         return 0
     
-    def get_leaderboard(self, period='day'):
-        """Get leaderboard for a specific period"""
-        period_key = self.get_period_key(period)
-        leaderboard = []
+    def _register_user(self, user_key):
+        """Remember when a user was added, so ranking ties keep the old scan order"""
+        self._user_order[user_key] = self._next_user_order
+        self._next_user_order += 1
+    
+    def _period_score(self, data, period, period_key):
+        """Seconds a user worked in the given period"""
+        if period == 'day':
+            return data.get('daily_worked', {}).get(period_key, 0)
+        elif period == 'week':
+            return data.get('weekly_worked', {}).get(period_key, 0)
+        elif period == 'month':
+            return data.get('monthly_worked', {}).get(period_key, 0)
+        elif period == 'all':
+            return data.get('total_worked_seconds', 0)
+        return 0
+    
+    def _user_score(self, user_key, data, period):
+        """Seconds a user worked in their own current period (their timezone's day, week or month)"""
+        period_key = 'all' if period == 'all' else self.get_period_key(period, user_key)
+        return self._period_score(data, period, period_key)
+    
+    def get_ranking_key(self, period):
+        """Identifies the current ranking of a period: its key in every timezone members are in.
         
-        for user_id, data in self.user_deficits.items():
-            username = data['username']
-            unique_id = data.get('unique_id', 0)
-            streak = data.get('streak_days', 0)
-            
-            if period == 'day':
-                time_worked = data.get('daily_worked', {}).get(period_key, 0)
-            elif period == 'week':
-                time_worked = data.get('weekly_worked', {}).get(period_key, 0)
-            elif period == 'month':
-                time_worked = data.get('monthly_worked', {}).get(period_key, 0)
-            elif period == 'all':
-                time_worked = data.get('total_worked_seconds', 0)
+        It changes as soon as any member's day (week, month) rolls over.
+        """
+        if period == 'all':
+            return 'all'
+        now = get_current_time()
+        partition = current_partition()
+        keys = []
+        for timezone in sorted({partition.timezone, *partition.user_timezones.values()}):
+            period_key = self._period_key_at(now.astimezone(ZoneInfo(timezone)), period)
+            if period_key is None:
+                return None
+            keys.append(f"{timezone}={period_key}")
+        return ' '.join(keys)
+    
+    def _get_ranking(self, period):
+        """Ranking index for the current period, rebuilt once when a member's period rolls over"""
+        ranking_key = self.get_ranking_key(period)
+        if ranking_key is None:
+            return None
+        
+        cached = self.leaderboards.get(period)
+        if cached and cached[0] == ranking_key:
+            return cached[1]
+        
+        index = RankedIndex()
+        for user_key, data in self.user_deficits.items():
+            index.update(user_key, self._user_score(user_key, data, period), self._user_order[user_key])
+        self.leaderboards[period] = (ranking_key, index)
+        return index
+    
+    def _update_rankings(self, user_key):
+        """Re-rank one user in every live period index - O(log n) each"""
+        self.invalidate_leaderboards()
+        data = self.user_deficits.get(user_key)
+        for period, (_, index) in self.leaderboards.items():
+            if data is None:
+                index.remove(user_key)
             else:
-                time_worked = 0
-            
-            if time_worked > 0:
-                leaderboard.append({
-                    'user_id': user_id,
-                    'username': username,
-                    'unique_id': unique_id,
-                    'time_worked': time_worked,
-                    'streak': streak
-                })
+                index.update(user_key, self._user_score(user_key, data, period), self._user_order[user_key])
+    
+    def invalidate_leaderboards(self):
+        """Drop cached leaderboard messages after anything they show has changed"""
+        self.leaderboard_cache.invalidate()
+    
+    def get_leaderboard(self, period='day', limit=None):
+        """Get leaderboard for a specific period (only the top `limit` entries if given)"""
+        index = self._get_ranking(period)
+        if index is None:
+            return []
         
-        leaderboard.sort(key=lambda x: x['time_worked'], reverse=True)
+        leaderboard = []
+        for user_id, time_worked in index.top(limit):
+            data = self.user_deficits[user_id]
+            leaderboard.append({
+                'user_id': user_id,
+                'username': data['username'],
+                'unique_id': data.get('unique_id', 0),
+                'time_worked': time_worked,
+                'streak': data.get('streak_days', 0)
+            })
         return leaderboard
     
+    def get_user_rank(self, user_id, period='day'):
+        """Rank, percentile and gap to the next person up for one user - O(log n)"""
+        index = self._get_ranking(period)
+        user_key = str(user_id)
+        rank = index.rank(user_key) if index is not None else None
+        if rank is None:
+            return None
+        
+        time_worked = -index.values[user_key][0]
+        total = len(index)
+        result = {
+            'rank': rank,
+            'total': total,
+            'time_worked': time_worked,
+            # Share of ranked members this user is ahead of or level with
+            'percentile': 100.0 * (total - rank + 1) / total,
+            'next_username': None,
+            'gap_to_next': 0
+        }
+        if rank > 1:
+            next_user, next_time = index.at(rank - 1)
+            result['next_username'] = self.user_deficits[next_user]['username']
+            result['gap_to_next'] = next_time - time_worked
+        return result
+    
     def reset_user_deficit(self, user_id):
         """Reset deficit for a specific user"""
         user_key = str(user_id)
         if user_key in self.user_deficits:
             del self.user_deficits[user_key]
-            self.save_data()
+            self._update_rankings(user_key)
+            del self._user_order[user_key]
+            self.save_data(user_key)
             return True
         return False
     
@@ -646,6 +2847,7 @@ class VideoBot:
             # Count existing users to get next ID
             next_id = len(self.user_deficits) + 1
             
+            self._register_user(user_key)
             self.user_deficits[user_key] = {
                 'unique_id': next_id,
                 'username': username,
@@ -659,12 +2861,13 @@ class VideoBot:
                 'last_video_date': None,
                 'last_video_timestamp': None,
                 'warnings_sent': [],
+                'last_rollover_date': self.rollover_checkpoint(user_id),
                 'last_updated': None,
                 'daily_total_today': 0,
                 'today_date': None,
                 'started_bot': False
             }
-            self.save_data()
+            self.save_data(user_key)
             logger.info(f"Assigned unique ID {next_id} to {username}")
         
         return self.user_deficits[user_key].get('unique_id', 0)
@@ -674,7 +2877,7 @@ class VideoBot:
         user_key = str(user_id)
         if user_key in self.user_deficits:
             self.user_deficits[user_key]['started_bot'] = True
-            self.save_data()
+            self.save_data(user_key)
     
     def get_bot_subscribers_count(self):
         """Get count of users who have started the bot"""
@@ -685,13 +2888,12 @@ class VideoBot:
         return count
     
     def get_users_without_todays_video(self):
-        """Get list of users who haven't submitted a video today"""
-        today = get_current_date_str()
+        """Get list of users who haven't submitted a video today (their own day)"""
         users_need_reminder = []
         
         for user_id, data in self.user_deficits.items():
             last_video_date = data.get('last_video_date')
-            if last_video_date != today:
+            if last_video_date != get_current_date_str_for_user(user_id):
                 deficit = data.get('total_deficit_seconds', 0)
                 required_hours = (MIN_DURATION + deficit) / 3600
                 users_need_reminder.append({
@@ -703,31 +2905,374 @@ class VideoBot:
         
         return users_need_reminder
     
-    def get_todays_leaderboard_for_midnight(self):
-        """Get today's rankings for midnight announcement"""
-        today_key = self.get_period_key('day')
-        rankings = []
+    def get_timezone_bucket(self, timezone):
+        """Get this worker's users whose day ends at midnight in the given timezone"""
+        return [
+            user_key for user_key in self.user_deficits
+            if get_user_timezone(user_key) == timezone and owns_user(user_key)
+        ]
+    
+    def plan_midnight_rollover(self, user_keys, day, now):
+        """Decide each user's new deficit, streak reset, warning and kick for the day that ended"""
+        decisions = []
         
-        for user_id, data in self.user_deficits.items():
-            username = data['username']
-            today_hours = data.get('daily_worked', {}).get(today_key, 0)
-            streak = data.get('streak_days', 0)
-            deficit = data.get('total_deficit_seconds', 0)
+        for user_key in user_keys:
+            data = self.user_deficits.get(user_key)
+            if data is None:
+                continue
+            # Checkpoint: this user's rollover for the day already happened
+            if (data.get('last_rollover_date') or '') >= day:
+                continue
+            if data.get('today_date') == day:
+                todays_total = data.get('daily_total_today', 0)
+            else:
+                todays_total = 0  # submitted nothing that day
             
-            rankings.append({
-                'user_id': user_id,
-                'username': username,
-                'today_hours': today_hours,
-                'streak': streak,
-                'deficit': deficit
+            # More than 24 hours since last video resets the streak
+            last_video_timestamp = data.get('last_video_timestamp')
+            reset_streak = bool(last_video_timestamp) and seconds_since(last_video_timestamp, now) >= 24 * 3600
+            
+            # Shortfall against today's 2h goes onto the deficit
+            shortfall = max(0, MIN_DURATION - todays_total)
+            new_deficit = data.get('total_deficit_seconds', 0) + shortfall
+            
+            decisions.append({
+                'user_id': user_key,
+                'day': day,
+                'username': data['username'],
+                'todays_total': todays_total,
+                'today_hours': todays_total,
+                'shortfall': shortfall,
+                'reset_streak': reset_streak,
+                'streak': 0 if reset_streak else data.get('streak_days', 0),
+                'deficit': new_deficit,
+                'warning': self.get_pending_warning(user_key, new_deficit),
+                'kick': new_deficit >= self.kick_threshold
             })
         
-        rankings.sort(key=lambda x: x['today_hours'], reverse=True)
-        return rankings
+        return decisions
+    
+    def apply_midnight_rollover(self, decisions):
+        """Apply planned midnight decisions in memory and queue them as one write"""
+        for decision in decisions:
+            data = self.user_deficits.get(decision['user_id'])
+            if data is None:
+                continue
+            if decision['reset_streak']:
+                data['streak_days'] = 0
+            data['total_deficit_seconds'] = decision['deficit']
+            if decision['warning']:
+                data.setdefault('warnings_sent', []).append(decision['warning'][0])
+            data['last_rollover_date'] = decision['day']
+        
+        # Streaks and deficits changed for everyone
+        self.invalidate_leaderboards()
+        if decisions:
+            self.save_data(*[decision['user_id'] for decision in decisions])
+    
+    def rollover_day(self, timezone, day, now):
+        """Run (or resume) the rollover of one timezone bucket for one day"""
+        decisions = self.plan_midnight_rollover(self.get_timezone_bucket(timezone), day, now)
+        if decisions:
+            self.save_rollover_run(timezone, day, 'running')
+            self.apply_midnight_rollover(decisions)
+        return decisions
+    
+    def finish_rollover(self, timezone, day, processed):
+        """Mark a rollover run done once its user rows have been flushed"""
+        self.save_rollover_run(timezone, day, 'done', processed)
+    
+    def rollover_checkpoint(self, user_id):
+        """Last closed day of a new user: yesterday in their timezone, so only today is still open"""
+        return (get_current_time_for_user(user_id) - timedelta(days=1)).strftime('%Y-%m-%d')
+    
+    def catch_up_rollovers(self):
+        """Apply every midnight rollover missed while the bot was down, oldest first"""
+        decisions = {}
+        for timezone in get_rollover_timezones():
+            now = datetime.now(ZoneInfo(timezone))
+            yesterday = (now - timedelta(days=1)).strftime('%Y-%m-%d')
+            
+            first_day = None
+            for user_key in self.get_timezone_bucket(timezone):
+                data = self.user_deficits[user_key]
+                last_day = data.get('last_rollover_date')
+                if last_day is None:
+                    # From before rollovers were tracked per user - start tracking from today
+                    data['last_rollover_date'] = yesterday
+                    self.save_data(user_key)
+                    continue
+                next_day = (datetime.strptime(last_day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+                if first_day is None or next_day < first_day:
+                    first_day = next_day
+            
+            if first_day is None or first_day > yesterday:
+                continue
+            
+            day = first_day
+            while day <= yesterday:
+                processed = self.rollover_day(timezone, day, now)
+                for decision in processed:
+                    # Keep the latest day per user, but don't drop a warning from an earlier day
+                    previous = decisions.get(decision['user_id'])
+                    if previous and previous['warning'] and not decision['warning']:
+                        decision = dict(decision, warning=previous['warning'])
+                    decisions[decision['user_id']] = decision
+                if processed:
+                    logger.info(f"Catch-up: rolled over {len(processed)} users in {timezone} for {day}")
+                    self.finish_rollover(timezone, day, len(processed))
+                day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        
+        return list(decisions.values())
+
+
+class ChatPartition:
+    """Everything kept for one group: its users and videos, timezone and reminder settings"""
+
+    def __init__(self, chat_id, storage, io_executor, activity_log=None):
+        self.chat_id = chat_id  # None for the default partition
+        self.storage = storage
+        self.bot = VideoBot(storage, activity_log, io_executor)
+        self.digest = AnnouncementDigest()
+        self.timezone = DEFAULT_TIMEZONE
+        self.timezone_set = False  # True once an admin has set it
+        self.user_timezones = {}
+        self.reminder_chat_id = None
+        self.load_settings()
+
+    def load_settings(self):
+        """Load the group timezone, user timezones and reminder chat"""
+        try:
+            data = self.storage.load_setting('group_timezone')
+            if data:
+                self.timezone = data.get('timezone', DEFAULT_TIMEZONE)
+            self.timezone_set = data is not None
+        except Exception as e:
+            logger.error(f"Error loading timezone: {e}")
+        try:
+            self.user_timezones = self.storage.load_setting('user_timezones') or {}
+        except Exception as e:
+            logger.error(f"Error loading user timezones: {e}")
+        try:
+            data = self.storage.load_setting('reminders')
+            if data:
+                self.reminder_chat_id = data.get('chat_id')
+        except Exception as e:
+            logger.error(f"Error loading reminder settings: {e}")
+
+    def enable_reminders(self, chat_id):
+        """Send this group's reminders and summaries to chat_id (saved on the storage thread)"""
+        self.reminder_chat_id = chat_id
+        self.bot.run_io(self.storage.save_setting, 'reminders', {'chat_id': chat_id})
+
+    def flush(self):
+        self.bot.flush()
+
+
+class PartitionRegistry:
+    """Chat partitions of one process: the default (DATA_DIR) plus, with MULTI_GROUP, one per group.
+
+    A group chat gets its own partition (created on first use); private chats
+    go to the partition of the group the user was last seen in. The default
+    partition keeps the pre-multi-group data and serves the group whose
+    reminders it already sends.
+    """
+
+    def __init__(self, multi_group=MULTI_GROUP, partitions_dir=PARTITIONS_DIR):
+        self.multi_group = multi_group
+        self.partitions_dir = partitions_dir
+        # One storage thread shared by every partition keeps the thread count flat
+        self.io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage')
+        self.default = ChatPartition(None, create_storage(), self.io_executor)
+        self.by_chat = {}  # chat id -> partition
+        self._opening = {}  # chat id -> load in progress on the storage thread
+        self.user_homes = {}  # user id -> chat id of the group the user was last seen in
+        if self.default.reminder_chat_id:
+            self.by_chat[self.default.reminder_chat_id] = self.default
+        self.discover()
+        for chat_id, partition in self.by_chat.items():
+            for user_key in partition.bot.user_deficits:
+                self.user_homes.setdefault(int(user_key), chat_id)
+
+    def _unopened(self):
+        """Chat ids of the partitions on disk that are not open yet (e.g. created by another worker)"""
+        if not self.multi_group or not os.path.isdir(self.partitions_dir):
+            return []
+        chat_ids = []
+        for name in sorted(os.listdir(self.partitions_dir)):
+            try:
+                chat_id = int(name)
+            except ValueError:
+                continue
+            if chat_id not in self.by_chat:
+                chat_ids.append(chat_id)
+        return chat_ids
+
+    def discover(self):
+        """Open the partitions on disk that are not open yet - at startup, before the event loop runs"""
+        for chat_id in self._unopened():
+            self.by_chat[chat_id] = self._load(chat_id)
+
+    async def discover_async(self):
+        """Open the partitions other workers created, scanning and loading on the storage thread"""
+        for chat_id in await asyncio.wrap_future(self.io_executor.submit(self._unopened)):
+            await self.open(chat_id)
+
+    def _load(self, chat_id):
+        data_dir = os.path.join(self.partitions_dir, str(chat_id))
+        activity_log = ActivityLog(os.path.join(data_dir, 'activity_logs'))
+        partition = ChatPartition(chat_id, create_storage(data_dir), self.io_executor, activity_log)
+        logger.info(f"Opened partition for chat {chat_id}")
+        return partition
+
+    async def open(self, chat_id):
+        """Get a group's partition, loading it on the storage thread the first time"""
+        partition = self.by_chat.get(chat_id)
+        if partition is not None:
+            return partition
+        # Updates from the same group arriving while it loads wait for the same load
+        future = self._opening.get(chat_id)
+        if future is None:
+            future = self._opening[chat_id] = asyncio.wrap_future(self.io_executor.submit(self._load, chat_id))
+        try:
+            partition = await future
+        finally:
+            self._opening.pop(chat_id, None)
+        return self.by_chat.setdefault(chat_id, partition)
+
+    async def for_chat(self, chat_id, chat_type, user_id=None):
+        """Get the partition an update from this chat belongs to"""
+        if not self.multi_group or chat_id is None:
+            return self.default
+        if chat_type == 'private':
+            home = self.user_homes.get(user_id)
+            return self.by_chat.get(home, self.default)
+        partition = await self.open(chat_id)
+        if user_id is not None:
+            self.user_homes[user_id] = chat_id
+        return partition
+
+    def all(self):
+        """Every partition, the default first"""
+        return [self.default] + [p for p in self.by_chat.values() if p is not self.default]
+
+    def close(self):
+        """Write out every partition and close their storage"""
+        for partition in self.all():
+            partition.flush()
+        self.io_executor.shutdown(wait=True)
+        for partition in self.all():
+            partition.storage.close()
+
+
+class JobRunLog:
+    """Last scheduled run of each critical job, saved so a restart can tell which runs it missed.
+
+    The scheduler's own job store lives in memory (its jobs hold the
+    Application, which can't be persisted), so only the run times are kept.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.tracked = {}  # job id -> Job
+        try:
+            self.runs = self.storage.load_setting(shard_setting('job_runs')) or {}
+        except Exception as e:
+            logger.error(f"Error loading job runs: {e}")
+            self.runs = {}
+
+    def track(self, job):
+        """Remember runs of this job (call with what scheduler.add_job returns)"""
+        self.tracked[job.id] = job
+        return job
+
+    def record(self, job_id, run_time):
+        if job_id not in self.tracked:
+            return
+        self.runs[job_id] = run_time.isoformat()
+        partitions.default.bot.run_io(self.storage.save_setting, shard_setting('job_runs'), dict(self.runs))
+
+    def on_job_event(self, event):
+        """Scheduler listener: a job ran (or failed - it still had its turn)"""
+        self.record(event.job_id, event.scheduled_run_time)
+
+    def missed_run(self, job, now):
+        """Latest run of the job since its last recorded one that is still within its grace time"""
+        last = self.runs.get(job.id)
+        if last is None:
+            return None
+        since = max(datetime.fromisoformat(last), now - timedelta(seconds=job.misfire_grace_time))
+        missed = None
+        fire_time = job.trigger.get_next_fire_time(None, since + timedelta(seconds=1))
+        while fire_time is not None and fire_time <= now:
+            missed = fire_time
+            fire_time = job.trigger.get_next_fire_time(fire_time, fire_time + timedelta(seconds=1))
+        return missed
+
+    async def run_missed(self):
+        """On startup: run each critical job once if it missed a run while the bot was down"""
+        now = datetime.now(ZoneInfo('UTC'))
+        for job in self.tracked.values():
+            missed = self.missed_run(job, now)
+            if missed is not None:
+                logger.info(f"Running missed job {job.id} (was due {missed.isoformat()})")
+                try:
+                    await job.func(*job.args, **job.kwargs)
+                except Exception as e:
+                    logger.error(f"Error running missed job {job.id}: {e}")
+            # Either way the next restart only looks at runs after this one
+            self.record(job.id, missed or now)
+
+
+class LeaderLease:
+    """Leader election for sharded workers: a lease in the shared database, renewed by its holder.
+
+    Only the holder runs the group-wide jobs. If it stops renewing (crash,
+    redeploy), another worker takes the lease once it expires. Without
+    sharding this process is always the leader.
+    """
+
+    def __init__(self, storage, name='scheduler', ttl=LEADER_LEASE_SECONDS):
+        self.storage = storage
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{WORKER_ID}"
+        self.is_leader = WORKER_COUNT <= 1
+
+    async def renew(self):
+        """Take or keep the lease; runs every third of its lifetime"""
+        if WORKER_COUNT <= 1:
+            return
+        try:
+            is_leader = await asyncio.wrap_future(
+                partitions.io_executor.submit(self.storage.acquire_lease, self.name, self.holder, self.ttl)
+            )
+        except Exception as e:
+            # Can't tell if we still hold it - stop acting as leader until we can
+            logger.error(f"Error renewing leader lease: {e}")
+            is_leader = False
+        if is_leader != self.is_leader:
+            logger.info(f"Worker {WORKER_ID} {'is now' if is_leader else 'is no longer'} the leader")
+        self.is_leader = is_leader
+
+    def release(self):
+        """Give the lease up on shutdown so another worker takes over right away"""
+        if WORKER_COUNT > 1 and self.is_leader:
+            try:
+                # On the storage thread, so it doesn't share the connection with a write in progress
+                partitions.io_executor.submit(self.storage.release_lease, self.name, self.holder).result()
+            except Exception as e:
+                logger.error(f"Error releasing leader lease: {e}")
+        self.is_leader = False
 
 
-# Create bot instance
-bot_instance = VideoBot()
+# Chat partitions (just the default one unless MULTI_GROUP is on)
+partitions = PartitionRegistry()
+leader = LeaderLease(partitions.default.storage)
+job_runs = JobRunLog(partitions.default.storage)
+admin_cache = AdminCache()
+pending_media_groups = {}  # (chat_id, user_id, media_group_id) -> messages collected so far
+duration_verifier = DurationVerifier()
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -738,12 +3283,12 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = user.username or user.first_name or f"User_{user.id}"
     
     # Log activity
-    bot_instance.log_activity(user.id, username, 'start_command', {'chat_type': chat.type})
+    current_bot().log_activity(user.id, username, 'start_command', {'chat_type': chat.type})
     
     # Assign unique ID and mark bot started if in private
     if is_private:
-        unique_id = bot_instance.assign_user_id(user.id, username)
-        bot_instance.mark_bot_started(user.id, username)
+        unique_id = current_bot().assign_user_id(user.id, username)
+        current_bot().mark_bot_started(user.id, username)
     
     if is_private:
         # Private message - modern, clean interface
@@ -772,7 +3317,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "📅 /today - Today's rankings\n"
             "📆 /week - Weekly rankings\n"
             "🗓️ /month - Monthly rankings\n"
-            "🏆 /alltime - All-time champions\n\n"
+            "🏆 /alltime - All-time champions\n"
+            "🏅 /myrank - Your rank (day/week/month/all)\n\n"
             "💡 **Ready?** Send me a video to start! 🎬",
             parse_mode='Markdown'
         )
@@ -807,7 +3353,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "📅 /today - Today's leaderboard\n"
             "📆 /week - Weekly rankings\n"
             "🗓️ /month - Monthly rankings\n"
-            "🏆 /alltime - All-time leaders\n\n"
+            "🏆 /alltime - All-time leaders\n"
+            "🏅 /myrank - Your rank (day/week/month/all)\n\n"
             "━━━━━━━━━━━━━━━━━━━━\n"
             "👑 **ADMIN COMMANDS**\n"
             "━━━━━━━━━━━━━━━━━━━━\n"
@@ -815,8 +3362,12 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "📋 /alldeficits - View all deficits\n"
             "➕ /addtime <id> <min> - Add deficit\n"
             "➖ /removetime <id> <min> - Remove deficit\n"
+            "♻️ /resetuser <id> - Reset a user\n"
             "🌍 /settimezone - Set group timezone\n"
-            "⏰ /enablereminders - Enable alerts\n\n"
+            "⏰ /enablereminders - Enable alerts\n"
+            "📮 /deadletters - Failed messages\n"
+            "🔁 /replay <id|all> - Resend failed messages\n"
+            "🚩 /flagged - Suspicious videos\n\n"
             "━━━━━━━━━━━━━━━━━━━━\n"
             "💬 **HELP & PRIVACY**\n"
             "━━━━━━━━━━━━━━━━━━━━\n"
@@ -827,87 +3378,230 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle video messages"""
+    """Handle video messages - albums are collected and processed as one batch"""
+    message = update.message
+    if not message.video:
+        return
+    
+    if message.media_group_id:
+        key = (message.chat_id, message.from_user.id, message.media_group_id)
+        pending = pending_media_groups.get(key)
+        if pending is None:
+            pending = pending_media_groups[key] = []
+            context.application.create_task(process_media_group_later(key, context))
+        pending.append(message)
+        return
+    
+    await process_video_submission(context, [message])
+
+
+async def process_media_group_later(key, context):
+    """Wait for the rest of an album to arrive, then process it as one submission"""
+    await asyncio.sleep(MEDIA_GROUP_WINDOW_SECONDS)
+    messages = pending_media_groups.pop(key, [])
+    if not messages:
+        return
+    
+    # Same per-user ordering as regular updates
+    processor = context.application.update_processor
+    if isinstance(processor, PerUserUpdateProcessor):
+        await processor.run_serialized(key[1], process_video_submission(context, messages))
+    else:
+        await process_video_submission(context, messages)
+
+
+async def get_thumbnail_hash(bot, video):
+    """Perceptual hash of a video's thumbnail (None if the check is off or there is no thumbnail)"""
+    if not PERCEPTUAL_DEDUP or Image is None or video.thumbnail is None:
+        return None
+    try:
+        thumbnail = await bot.get_file(video.thumbnail.file_id)
+        return dhash(bytes(await thumbnail.download_as_bytearray()))
+    except Exception as e:
+        logger.error(f"Could not hash thumbnail of {video.file_unique_id}: {e}")
+        return None
+
+
+async def process_video_submission(context, messages):
+    """Credit one or more videos sent together by the same user in the same chat"""
     try:
-        message = update.message
+        message = messages[0]
         user = message.from_user
-        video = message.video
-        chat = update.effective_chat
-        
-        if not video:
-            return
+        chat = message.chat
         
         # Determine if this is a private message or group message
         is_private = chat.type == 'private'
         
-        # Get video identifiers
-        file_id = video.file_id
-        file_unique_id = video.file_unique_id
-        duration = video.duration
         user_id = user.id
         username = user.username or user.first_name or f"User_{user_id}"
         
         # Log video submission activity
-        bot_instance.log_activity(
-            user_id, 
-            username, 
-            'video_submitted', 
-            {
-                'duration': duration,
-                'chat_type': 'private' if is_private else 'group',
-                'file_unique_id': file_unique_id
-            }
-        )
+        for msg in messages:
+            current_bot().log_activity(
+                user_id, 
+                username, 
+                'video_submitted', 
+                {
+                    'duration': msg.video.duration,
+                    'chat_type': 'private' if is_private else 'group',
+                    'file_unique_id': msg.video.file_unique_id
+                }
+            )
+        
+        # Thumbnail hashes for the near-duplicate check (fetched before the
+        # exact check, so nothing is awaited between checking and recording)
+        phashes = {}
+        for msg in messages:
+            phashes[msg.video.file_unique_id] = await get_thumbnail_hash(context.bot, msg.video)
         
-        # CHECK FOR DUPLICATE VIDEO FIRST
-        if bot_instance.is_duplicate_video(file_id, file_unique_id):
-            original_info = bot_instance.get_video_info(file_unique_id)
-            original_username = original_info.get('username', 'someone')
+        # Look the batch up in the archive first; everything after this is
+        # synchronous, so no other update can claim a video between its
+        # check and its recording
+        archived = {}
+        for msg in messages:
+            file_unique_id = msg.video.file_unique_id
+            archived[file_unique_id] = await current_bot().find_duplicate_video(file_unique_id)
+        
+        # CHECK FOR DUPLICATE VIDEOS (one pass over the whole batch) and record the new ones
+        fresh = []
+        duplicates = []
+        lookalikes = {}
+        seen = set()
+        for msg in messages:
+            video = msg.video
+            file_unique_id = video.file_unique_id
+            # Another user's update may have claimed this video while we waited on the archive
+            original_info = archived[file_unique_id] or current_bot().video_index.get(file_unique_id)
+            if not original_info and file_unique_id in seen:
+                original_info = {'username': username}
+            # Same recording re-encoded or trimmed: near-identical thumbnail and length
+            # (earlier videos of the same batch are already recorded, so they count too)
+            similar = []
+            phash = phashes[file_unique_id]
+            if not original_info and phash is not None:
+                similar = current_bot().video_index.find_similar(phash, video.duration)
+                if similar and PERCEPTUAL_DEDUP_ACTION != 'flag':
+                    original_info = similar[0]
+                    logger.info(f"Near-duplicate video from {username} (thumbnail matches one by {original_info['username']})")
+            if original_info:
+                duplicates.append((msg, original_info.get('username', 'someone')))
+                continue
             
-            # Send duplicate message only to where the video was sent
-            await message.reply_text(
-                f"⚠️ This video has already been submitted!\n\n"
-                f"Originally submitted by @{original_username}.\n"
-                f"Duplicate videos are not counted."
+            # NOT A DUPLICATE - record it right away
+            seen.add(file_unique_id)
+            fresh.append(msg)
+            # Lookalikes are credited but flagged for the admins
+            matches = list(similar)
+            fingerprint = None  # only kept with the lookalike check on, entries stay compact otherwise
+            if METADATA_DEDUP:
+                fingerprint = (video.width, video.height, video.file_size, video.mime_type)
+                matches += current_bot().video_index.find_lookalikes(video.duration, fingerprint)
+            if matches:
+                merged = {}
+                for match in matches:
+                    merged.setdefault(match['file_unique_id'], dict(match, reasons=[]))['reasons'] += match['reasons']
+                lookalikes[file_unique_id] = list(merged.values())
+            current_bot().add_video_hash(
+                video.file_id, file_unique_id, user_id, username, video.duration, phash, fingerprint
             )
+        
+        if WORKER_COUNT > 1:
+            # Another worker may have taken one of these without flushing yet; the
+            # shared database decides atomically who gets the credit
+            claimed = []
+            for msg in fresh:
+                original_info = await current_bot().claim_video_hash(msg.video.file_unique_id)
+                if original_info:
+                    lookalikes.pop(msg.video.file_unique_id, None)
+                    duplicates.append((msg, original_info.get('username', 'someone')))
+                else:
+                    claimed.append(msg)
+            fresh = claimed
+        
+        if duplicates:
+            if len(duplicates) == 1 and not fresh:
+                original_username = duplicates[0][1]
+                duplicate_text = (
+                    f"⚠️ This video has already been submitted!\n\n"
+                    f"Originally submitted by @{original_username}.\n"
+                    f"Duplicate videos are not counted."
+                )
+            else:
+                originals = ", ".join(sorted({f"@{name}" for _, name in duplicates}))
+                duplicate_text = (
+                    f"⚠️ {len(duplicates)} of these videos were already submitted!\n\n"
+                    f"Originally submitted by {originals}.\n"
+                    f"Duplicate videos are not counted."
+                )
             
-            # Delete the duplicate video for privacy
-            try:
-                await message.delete()
-                logger.info(f"Deleted duplicate video from {username}")
-            except Exception as e:
-                logger.error(f"Could not delete duplicate video: {e}")
+            # Send duplicate message only to where the video was sent
+            await message.reply_text(duplicate_text)
             
-            logger.info(f"Duplicate video detected from {username} (originally by {original_username})")
+            # Delete the duplicate videos for privacy
+            for msg, original_username in duplicates:
+                try:
+                    await msg.delete()
+                    logger.info(f"Deleted duplicate video from {username}")
+                except Exception as e:
+                    logger.error(f"Could not delete duplicate video: {e}")
+                logger.info(f"Duplicate video detected from {username} (originally by {original_username})")
+        
+        if not fresh:
             return
         
-        # NOT A DUPLICATE - Process normally
-        bot_instance.add_video_hash(file_id, file_unique_id, user_id, username, duration)
+        # Add the videos' duration to total worked hours in one go
+        duration = sum(msg.video.duration for msg in fresh)
+        deficit_before = current_bot().get_user_deficit(user_id)
+        current_bot().add_video_time(user_id, username, duration)
+        
+        # Lookalikes are credited, but flagged for the admins (/flagged)
+        for file_unique_id, matches in lookalikes.items():
+            current_bot().flag_lookalike_video(user_id, file_unique_id, matches)
+            logger.warning(
+                f"Lookalike video from {username}: " + "; ".join(
+                    f"like @{match['username']}'s {match['file_unique_id']} ({', '.join(match['reasons'])})"
+                    for match in matches[:3]
+                )
+            )
         
-        # Add the video duration to total worked hours
-        bot_instance.add_video_time(user_id, username, duration)
+        # Check the reported durations against the files in the background
+        if VERIFY_DURATION in ('flag', 'reverse'):
+            # What this credit touched, so a reversal can undo exactly that (shared by the batch)
+            credit = {
+                'today_date': current_bot().user_deficits[str(user_id)]['today_date'],
+                'day': current_bot().get_period_key('day', user_id),
+                'week': current_bot().get_period_key('week', user_id),
+                'month': current_bot().get_period_key('month', user_id),
+                'seconds': duration,
+                'deficit_reduction': deficit_before - current_bot().get_user_deficit(user_id)
+            }
+            for msg in fresh:
+                duration_verifier.submit(current_partition(), user_id, username, msg.video, credit)
         
         # Get today's total and remaining
-        todays_total = bot_instance.get_todays_total(user_id)
-        remaining_today = bot_instance.get_remaining_for_today(user_id)
-        total_video_hours = bot_instance.get_user_total_hours(user_id)
-        current_deficit = bot_instance.get_user_deficit(user_id)  # already reduced live
-        streak = bot_instance.get_user_streak(user_id)
+        todays_total = current_bot().get_todays_total(user_id)
+        remaining_today = current_bot().get_remaining_for_today(user_id)
+        total_video_hours = current_bot().get_user_total_hours(user_id)
+        current_deficit = current_bot().get_user_deficit(user_id)  # already reduced live
+        streak = current_bot().get_user_streak(user_id)
         
         # Format durations
-        video_duration_formatted = bot_instance.format_duration(duration)
-        todays_total_formatted = bot_instance.format_duration(todays_total)
-        total_hours_formatted = bot_instance.format_duration(total_video_hours)
+        video_duration_formatted = current_bot().format_duration(duration)
+        todays_total_formatted = current_bot().format_duration(todays_total)
+        total_hours_formatted = current_bot().format_duration(total_video_hours)
         streak_emoji = "🔥" if streak > 0 else ""
+        videos_label = "This video" if len(fresh) == 1 else f"These {len(fresh)} videos"
+        submitted_label = "a video" if len(fresh) == 1 else f"{len(fresh)} videos"
+        deleted_label = "Video deleted" if len(fresh) == 1 else "Videos deleted"
         
         if remaining_today > 0:
-            remaining_formatted = bot_instance.format_duration(remaining_today)
-            current_deficit_formatted = bot_instance.format_duration(current_deficit)
+            remaining_formatted = current_bot().format_duration(remaining_today)
+            current_deficit_formatted = current_bot().format_duration(current_deficit)
             
             user_response = (
-                f"📹 Video received!\n\n"
+                f"📹 {'Video' if len(fresh) == 1 else 'Videos'} received!\n\n"
                 f"━━━━━━━━━━━━━━━━━━━━\n"
-                f"🎬 This video: {video_duration_formatted}\n"
+                f"🎬 {videos_label}: {video_duration_formatted}\n"
                 f"📊 Today's total: {todays_total_formatted}\n"
                 f"⏳ Still needed today: {remaining_formatted}\n"
             )
@@ -919,25 +3613,29 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"🔥 Streak: {streak} day{'s' if streak != 1 else ''} {streak_emoji}\n"
                 f"━━━━━━━━━━━━━━━━━━━━\n"
                 f"💡 Keep sending videos before midnight!\n"
-                f"🗑️ Video deleted for privacy."
+                f"🗑️ {deleted_label} for privacy."
             )
             
             group_response = (
-                f"📹 @{username} submitted a video!\n\n"
-                f"🎬 This video: {video_duration_formatted}\n"
+                f"📹 @{username} submitted {submitted_label}!\n\n"
+                f"🎬 {videos_label}: {video_duration_formatted}\n"
                 f"📊 Today's total: {todays_total_formatted}\n"
                 f"⏳ Still needed today: {remaining_formatted}\n"
                 f"🔥 Streak: {streak} day{'s' if streak != 1 else ''} {streak_emoji}"
             )
+            digest_line = (
+                f"• @{username}: +{video_duration_formatted} "
+                f"(today {todays_total_formatted}, {remaining_formatted} to go) {streak_emoji}"
+            )
         else:
             user_response = (
                 f"✅ All done for today!\n\n"
                 f"━━━━━━━━━━━━━━━━━━━━\n"
-                f"🎬 This video: {video_duration_formatted}\n"
+                f"🎬 {videos_label}: {video_duration_formatted}\n"
                 f"📊 Today's total: {todays_total_formatted}\n"
             )
             if current_deficit > 0:
-                current_deficit_formatted = bot_instance.format_duration(current_deficit)
+                current_deficit_formatted = current_bot().format_duration(current_deficit)
                 user_response += f"⚠️ Still owed: {current_deficit_formatted}\n"
             else:
                 user_response += f"✅ Nothing owed!\n"
@@ -947,7 +3645,7 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"🔥 Streak: {streak} day{'s' if streak != 1 else ''} {streak_emoji}\n"
                 f"━━━━━━━━━━━━━━━━━━━━\n"
                 f"🎉 Great work! Today's 2h done!\n"
-                f"🗑️ Video deleted for privacy."
+                f"🗑️ {deleted_label} for privacy."
             )
             
             group_response = (
@@ -959,24 +3657,35 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Send responses based on where video was sent
         if is_private:
-            await message.reply_text(user_response)
-            if REMINDER_CHAT_ID:
-                await context.bot.send_message(chat_id=REMINDER_CHAT_ID, text=group_response)
+            await fresh[0].reply_text(user_response)
+            partition = current_partition()
+            if partition.reminder_chat_id:
+                if ANNOUNCE_DIGEST_SECONDS > 0 and remaining_today > 0:
+                    if partition.digest.add(digest_line):
+                        await send_announcement_digest(context.application)
+                else:
+                    # Completions go out right away, after anything still buffered
+                    await send_announcement_digest(context.application)
+                    await send_or_retry_later(context.bot, partition.reminder_chat_id, group_response)
         else:
-            await message.reply_text(user_response)
+            await fresh[0].reply_text(user_response)
         
-        # DELETE THE VIDEO FOR PRIVACY
-        try:
-            await message.delete()
-            logger.info(f"Deleted video from {username} for privacy")
-        except Exception as e:
-            logger.error(f"Could not delete video: {e}")
+        # DELETE THE VIDEOS FOR PRIVACY
+        for msg in fresh:
+            try:
+                await msg.delete()
+                logger.info(f"Deleted video from {username} for privacy")
+            except Exception as e:
+                logger.error(f"Could not delete video: {e}")
         
-        logger.info(f"Video from {username}: {duration}s, Today's total: {todays_total}s, Remaining: {remaining_today}s")
+        logger.info(
+            f"{submitted_label.capitalize()} from {username}: {duration}s, "
+            f"Today's total: {todays_total}s, Remaining: {remaining_today}s"
+        )
             
     except Exception as e:
         logger.error(f"Error handling video: {e}")
-        await update.message.reply_text("❌ An error occurred while processing your video.")
+        await messages[0].reply_text("❌ An error occurred while processing your video.")
 
 
 async def my_deficit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -987,7 +3696,7 @@ async def my_deficit_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     chat = update.effective_chat
     
     # Log activity
-    bot_instance.log_activity(user_id, username, 'my_deficit_command', {'chat_type': chat.type})
+    current_bot().log_activity(user_id, username, 'my_deficit_command', {'chat_type': chat.type})
     
     # If in group, redirect to private message
     if chat.type != 'private':
@@ -998,10 +3707,10 @@ async def my_deficit_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return
     
-    deficit = bot_instance.get_user_deficit(user_id)
+    deficit = current_bot().get_user_deficit(user_id)
     
     if deficit > 0:
-        formatted = bot_instance.format_duration(deficit)
+        formatted = current_bot().format_duration(deficit)
         await update.message.reply_text(
             f"📊 Your current deficit: {formatted}\n"
             f"You need to make up this time in tomorrow's videos."
@@ -1024,17 +3733,17 @@ async def my_hours_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    total_hours = bot_instance.get_user_total_hours(user_id)
-    deficit = bot_instance.get_user_deficit(user_id)
+    total_hours = current_bot().get_user_total_hours(user_id)
+    deficit = current_bot().get_user_deficit(user_id)
     
     if total_hours > 0 or deficit > 0:
-        hours_formatted = bot_instance.format_duration(total_hours)
+        hours_formatted = current_bot().format_duration(total_hours)
         
         message = f"📊 **Your Video Hours**\n\n"
         message += f"✅ Total completed: {hours_formatted}\n"
         
         if deficit > 0:
-            deficit_formatted = bot_instance.format_duration(deficit)
+            deficit_formatted = current_bot().format_duration(deficit)
             message += f"⚠️ Time still owed: {deficit_formatted}\n"
             message += f"\n💡 Complete this deficit to stay on track!"
         else:
@@ -1060,7 +3769,7 @@ async def my_streak_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    streak = bot_instance.get_user_streak(user_id)
+    streak = current_bot().get_user_streak(user_id)
     
     if streak > 0:
         streak_emoji = "🔥" * min(streak, 10)
@@ -1089,7 +3798,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         tz_name = user_tz
     else:
         current_time = get_current_time()
-        tz_name = GROUP_TIMEZONE
+        tz_name = current_partition().timezone
     
     # Calculate time until midnight
     midnight = current_time.replace(hour=23, minute=59, second=59, microsecond=999999)
@@ -1097,10 +3806,10 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     hours_left = time_until_midnight.total_seconds() / 3600
     
     # Get user's submission status
-    todays_total = bot_instance.get_todays_total(user_id)
-    remaining_today = bot_instance.get_remaining_for_today(user_id)
-    current_deficit = bot_instance.get_user_deficit(user_id)
-    streak = bot_instance.get_user_streak(user_id)
+    todays_total = current_bot().get_todays_total(user_id)
+    remaining_today = current_bot().get_remaining_for_today(user_id)
+    current_deficit = current_bot().get_user_deficit(user_id)
+    streak = current_bot().get_user_streak(user_id)
     
     # Format times
     current_time_str = current_time.strftime('%I:%M:%S %p')
@@ -1116,7 +3825,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message += f"━━━━━━━━━━━━━━━━━━━━\n\n"
     
     if todays_total > 0:
-        todays_formatted = bot_instance.format_duration(todays_total)
+        todays_formatted = current_bot().format_duration(todays_total)
         message += f"📊 **Today's Progress:**\n"
         message += f"✅ Submitted: {todays_formatted}\n"
     else:
@@ -1124,13 +3833,13 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         message += f"❌ Not submitted yet\n"
     
     if remaining_today > 0:
-        remaining_formatted = bot_instance.format_duration(remaining_today)
+        remaining_formatted = current_bot().format_duration(remaining_today)
         message += f"⏰ Still needed: {remaining_formatted}\n"
     else:
         message += f"✅ Today's 2h requirement met!\n"
     
     if current_deficit > 0:
-        deficit_formatted = bot_instance.format_duration(current_deficit)
+        deficit_formatted = current_bot().format_duration(current_deficit)
         message += f"⚠️ Owed time: {deficit_formatted}\n"
     
     message += f"🔥 Current streak: {streak} day{'s' if streak != 1 else ''}\n"
@@ -1140,9 +3849,9 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(message, parse_mode='Markdown')
 
 
-async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE, period='day'):
-    """Show leaderboard for a specific period with unique IDs"""
-    leaderboard = bot_instance.get_leaderboard(period)
+def render_leaderboard(period):
+    """Build the leaderboard message for a period - returns (text, parse_mode)"""
+    leaderboard = current_bot().get_leaderboard(period, limit=20)
     
     if not leaderboard:
         period_name = {
@@ -1151,8 +3860,7 @@ async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             'month': 'this month',
             'all': 'all-time'
         }.get(period, period)
-        await update.message.reply_text(f"📊 No videos submitted {period_name} yet!")
-        return
+        return f"📊 No videos submitted {period_name} yet!", None
     
     # Build leaderboard message
     period_emoji = {
@@ -1173,12 +3881,12 @@ async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     # Add top users with medals for top 3
     medals = ['🥇', '🥈', '🥉']
-    for i, entry in enumerate(leaderboard[:20], 1):  # Show top 20
+    for i, entry in enumerate(leaderboard, 1):  # Show top 20
         username = entry['username']
         unique_id = entry.get('unique_id', 'N/A')
         time_worked = entry['time_worked']
         streak = entry.get('streak', 0)
-        formatted = bot_instance.format_duration(time_worked)
+        formatted = current_bot().format_duration(time_worked)
         
         if i <= 3:
             message += f"{medals[i-1]} #{unique_id} @{username}\n"
@@ -1192,7 +3900,70 @@ async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         message += "\n\n"
     
-    await update.message.reply_text(message, parse_mode='Markdown')
+    return message, 'Markdown'
+
+
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE, period='day'):
+    """Show leaderboard for a specific period with unique IDs"""
+    chat_id = update.effective_chat.id
+    ranking_key = current_bot().get_ranking_key(period)
+    
+    # Reuse the rendered message until a submission or admin change invalidates it
+    cached = current_bot().leaderboard_cache.get(chat_id, period, ranking_key)
+    if cached:
+        message, parse_mode = cached
+    else:
+        message, parse_mode = render_leaderboard(period)
+        current_bot().leaderboard_cache.put(chat_id, period, ranking_key, message, parse_mode)
+    
+    await update.message.reply_text(message, parse_mode=parse_mode)
+
+
+async def my_rank_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the user's rank for a period: /myrank [day|week|month|all]"""
+    user = update.message.from_user
+    user_id = user.id
+    username = user.username or user.first_name or f"User_{user_id}"
+    chat = update.effective_chat
+    
+    # Log activity
+    current_bot().log_activity(user_id, username, 'my_rank_command', {'chat_type': chat.type})
+    
+    period = context.args[0].lower() if context.args else 'day'
+    period = {'today': 'day', 'alltime': 'all'}.get(period, period)
+    if period not in ('day', 'week', 'month', 'all'):
+        await update.message.reply_text("❌ Usage: /myrank [day|week|month|all]")
+        return
+    
+    period_name = {
+        'day': 'today',
+        'week': 'this week',
+        'month': 'this month',
+        'all': 'all-time'
+    }[period]
+    
+    rank_info = current_bot().get_user_rank(user_id, period)
+    if not rank_info:
+        await update.message.reply_text(
+            f"📊 You're not ranked {period_name} yet!\n"
+            "Submit a video to get on the board."
+        )
+        return
+    
+    rank = rank_info['rank']
+    message = f"🏅 Your rank {period_name}: #{rank} of {rank_info['total']}\n"
+    message += f"⏱️ Time: {current_bot().format_duration(rank_info['time_worked'])}\n"
+    message += f"📈 Percentile: {rank_info['percentile']:.0f}\n"
+    
+    if rank == 1:
+        message += "\n👑 You're in first place!"
+    elif rank_info['gap_to_next'] > 0:
+        gap = current_bot().format_duration(rank_info['gap_to_next'])
+        message += f"\n⬆️ {gap} more to pass @{rank_info['next_username']} (#{rank - 1})"
+    else:
+        message += f"\n🤝 Tied with @{rank_info['next_username']} (#{rank - 1}) - one more video to pass them!"
+    
+    await update.message.reply_text(message)
 
 
 async def today_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1215,30 +3986,138 @@ async def alltime_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE
     await leaderboard_command(update, context, 'all')
 
 
-async def all_deficits_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show all users with deficits (admin command) - only in group"""
-    user = update.message.from_user
-    chat = update.effective_chat
-    
-    # Must be used in group, not private
-    if chat.type == 'private':
-        await update.message.reply_text(
-            "⚠️ This command only works in the group!\n"
-            "Admins can use it in the group to see all deficits."
-        )
-        return
+async def is_chat_admin(chat, user_id):
+    """Check whether the user is an admin of the chat, asking Telegram only on a cache miss"""
+    is_admin = admin_cache.get(chat.id, user_id)
+    if is_admin is None:
+        member = await chat.get_member(user_id)
+        is_admin = admin_cache.put_status(chat.id, user_id, member.status)
+    return is_admin
+
+
+def admin_only(private_message=None, allow_private=False,
+               denied_message="❌ This command is only available to group administrators."):
+    """Decorator for admin commands: run the handler only for group admins.
     
-    try:
-        member = await chat.get_member(user.id)
-        if member.status not in ['creator', 'administrator']:
-            await update.message.reply_text("❌ This command is only available to group administrators.")
-            return
-    except Exception as e:
-        logger.error(f"Error checking admin status: {e}")
-        await update.message.reply_text("❌ Could not verify admin status.")
+    In private chats the handler runs unchecked if allow_private, otherwise
+    private_message (if given) is sent instead.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            chat = update.effective_chat
+            if chat.type == 'private':
+                if allow_private:
+                    return await handler(update, context)
+                if private_message:
+                    await update.message.reply_text(private_message)
+                    return
+            
+            try:
+                is_admin = await is_chat_admin(chat, update.message.from_user.id)
+            except Exception as e:
+                logger.error(f"Error checking admin status: {e}")
+                await update.message.reply_text("❌ Could not verify admin status.")
+                return
+            
+            if not is_admin:
+                await update.message.reply_text(denied_message)
+                return
+            return await handler(update, context)
+        return wrapper
+    return decorator
+
+
+async def select_partition(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before every handler: point the update at its group's partition"""
+    chat = update.effective_chat
+    user = update.effective_user
+    partition = await partitions.for_chat(chat.id if chat else None, chat.type if chat else None, user.id if user else None)
+    _active_partition.set(partition)
+
+
+async def route_to_shard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sharded mode: pass updates of users another worker owns over to it through the database"""
+    user = update.effective_user
+    if user is None or owns_user(user.id):
         return
-    
-    deficits = bot_instance.get_all_deficits()
+    partitions.default.bot.run_io(partitions.default.storage.push_inbound, shard_of(user.id), update.to_json())
+    raise ApplicationHandlerStop
+
+
+async def pull_shard_updates(application, stop_event):
+    """Workers other than 0: feed the updates routed to this shard into the application"""
+    storage = partitions.default.storage
+    while not stop_event.is_set():
+        try:
+            rows = await asyncio.wrap_future(partitions.io_executor.submit(storage.take_inbound, WORKER_ID))
+        except Exception as e:
+            logger.error(f"Error reading routed updates: {e}")
+            rows = []
+        for data in rows:
+            await application.update_queue.put(Update.de_json(json.loads(data), application.bot))
+        if not rows:
+            try:
+                await asyncio.wait_for(stop_event.wait(), SHARD_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+def run_shard_worker(application):
+    """Run a worker other than 0 until SIGINT/SIGTERM - it gets its updates from worker 0"""
+    loop = asyncio.get_event_loop()
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    async def run():
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        try:
+            await pull_shard_updates(application, stop_event)
+        finally:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.shutdown()
+
+    loop.run_until_complete(run())
+
+
+async def if_leader(job, *args, **kwargs):
+    """Run a group-wide job only on the worker holding the leader lease"""
+    if leader.is_leader:
+        await job(*args, **kwargs)
+
+
+async def for_each_partition(job, *args, timezone=None):
+    """Run a scheduled job once per partition (only those whose group is in `timezone`, if given)"""
+    for partition in partitions.all():
+        if timezone and partition.timezone != timezone:
+            continue
+        token = _active_partition.set(partition)
+        try:
+            await job(*args)
+        finally:
+            _active_partition.reset(token)
+
+
+async def track_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Keep the admin cache in step with promotions, demotions, joins and leaves"""
+    change = update.chat_member or update.my_chat_member
+    member = change.new_chat_member
+    admin_cache.put_status(change.chat.id, member.user.id, member.status)
+
+
+@admin_only(private_message=(
+    "⚠️ This command only works in the group!\n"
+    "Admins can use it in the group to see all deficits."
+))
+async def all_deficits_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show all users with deficits (admin command) - only in group"""
+    deficits = current_bot().get_all_deficits()
     
     if not deficits:
         await update.message.reply_text("✅ No users have deficits!")
@@ -1257,39 +4136,27 @@ async def all_deficits_command(update: Update, context: ContextTypes.DEFAULT_TYP
         username = data['username']
         deficit_seconds = data['total_deficit_seconds']
         if deficit_seconds > 0:  # Only show users with actual deficits
-            formatted = bot_instance.format_duration(deficit_seconds)
+            formatted = current_bot().format_duration(deficit_seconds)
             message += f"• @{username}: {formatted}\n"
     
     await update.message.reply_text(message, parse_mode='Markdown')
 
 
+@admin_only(allow_private=True)
 async def subscribers_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show bot subscribers count and list"""
     user = update.message.from_user
     username = user.username or user.first_name or f"User_{user.id}"
     chat = update.effective_chat
-    is_private = chat.type == 'private'
     
     # Log activity
-    bot_instance.log_activity(user.id, username, 'subscribers_command', {'chat_type': chat.type})
-    
-    # In group - check admin status
-    if not is_private:
-        try:
-            member = await chat.get_member(user.id)
-            if member.status not in ['creator', 'administrator']:
-                await update.message.reply_text("❌ This command is only available to group administrators.")
-                return
-        except Exception as e:
-            logger.error(f"Error checking admin status: {e}")
-            await update.message.reply_text("❌ Could not verify admin status.")
-            return
+    current_bot().log_activity(user.id, username, 'subscribers_command', {'chat_type': chat.type})
     
     # Get bot subscribers count (users who clicked /start in bot)
-    bot_subscriber_count = bot_instance.get_bot_subscribers_count()
-    total_users_count = bot_instance.get_all_users_count()
+    bot_subscriber_count = current_bot().get_bot_subscribers_count()
+    total_users_count = current_bot().get_all_users_count()
     
-    if not bot_instance.user_activities:
+    if not current_bot().user_activities:
         await update.message.reply_text("📋 No users yet!")
         return
     
@@ -1302,7 +4169,7 @@ async def subscribers_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     # Show users who started the bot
     bot_users = [
-        (uid, data) for uid, data in bot_instance.user_activities.items() 
+        (uid, data) for uid, data in current_bot().user_activities.items() 
         if data.get('started_bot', False)
     ]
     
@@ -1322,27 +4189,9 @@ async def subscribers_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     await update.message.reply_text(message, parse_mode='Markdown')
 
 
+@admin_only(private_message="⚠️ This command only works in the group!")
 async def add_time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Add time to a user's deficit (admin only) - this increases their deficit"""
-    user = update.message.from_user
-    chat = update.effective_chat
-    
-    # Must be used in group
-    if chat.type == 'private':
-        await update.message.reply_text(
-            "⚠️ This command only works in the group!"
-        )
-        return
-    
-    try:
-        member = await chat.get_member(user.id)
-        if member.status not in ['creator', 'administrator']:
-            await update.message.reply_text("❌ This command is only available to group administrators.")
-            return
-    except Exception as e:
-        logger.error(f"Error checking admin status: {e}")
-        return
-    
     # Check arguments
     if not context.args or len(context.args) < 2:
         await update.message.reply_text(
@@ -1361,17 +4210,17 @@ async def add_time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         user_key = str(target_user_id)
-        if user_key not in bot_instance.user_deficits:
+        if user_key not in current_bot().user_deficits:
             await update.message.reply_text(f"❌ User ID {target_user_id} not found in system.")
             return
         
         # Add time to deficit
         deficit_seconds = minutes * 60
-        username = bot_instance.user_deficits[user_key]['username']
-        bot_instance.add_deficit(target_user_id, username, deficit_seconds)
+        username = current_bot().user_deficits[user_key]['username']
+        current_bot().add_deficit(target_user_id, username, deficit_seconds)
         
-        new_deficit = bot_instance.get_user_deficit(target_user_id)
-        deficit_formatted = bot_instance.format_duration(new_deficit)
+        new_deficit = current_bot().get_user_deficit(target_user_id)
+        deficit_formatted = current_bot().format_duration(new_deficit)
         
         await update.message.reply_text(
             f"✅ Added {minutes} minutes to @{username}'s deficit.\n"
@@ -1382,27 +4231,9 @@ async def add_time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Invalid input. Use numbers only.\nUsage: /addtime <user_id> <minutes>")
 
 
+@admin_only(private_message="⚠️ This command only works in the group!")
 async def remove_time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Remove time from a user's deficit (admin only) - this decreases their deficit"""
-    user = update.message.from_user
-    chat = update.effective_chat
-    
-    # Must be used in group
-    if chat.type == 'private':
-        await update.message.reply_text(
-            "⚠️ This command only works in the group!"
-        )
-        return
-    
-    try:
-        member = await chat.get_member(user.id)
-        if member.status not in ['creator', 'administrator']:
-            await update.message.reply_text("❌ This command is only available to group administrators.")
-            return
-    except Exception as e:
-        logger.error(f"Error checking admin status: {e}")
-        return
-    
     # Check arguments
     if not context.args or len(context.args) < 2:
         await update.message.reply_text(
@@ -1421,14 +4252,14 @@ async def remove_time_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
         
         user_key = str(target_user_id)
-        if user_key not in bot_instance.user_deficits:
+        if user_key not in current_bot().user_deficits:
             await update.message.reply_text(f"❌ User ID {target_user_id} not found in system.")
             return
         
         # Remove time from deficit
         seconds_to_remove = minutes * 60
-        current_deficit = bot_instance.user_deficits[user_key].get('total_deficit_seconds', 0)
-        username = bot_instance.user_deficits[user_key]['username']
+        current_deficit = current_bot().user_deficits[user_key].get('total_deficit_seconds', 0)
+        username = current_bot().user_deficits[user_key]['username']
         
         # Can't remove more than current deficit
         if seconds_to_remove > current_deficit:
@@ -1436,13 +4267,14 @@ async def remove_time_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             minutes = seconds_to_remove // 60
         
         new_deficit = max(0, current_deficit - seconds_to_remove)
-        bot_instance.user_deficits[user_key]['total_deficit_seconds'] = new_deficit
-        bot_instance.save_data()
+        current_bot().user_deficits[user_key]['total_deficit_seconds'] = new_deficit
+        current_bot().invalidate_leaderboards()
+        current_bot().save_data(user_key)
         
         # Reset warnings based on new deficit
-        bot_instance.reset_warnings(target_user_id)
+        current_bot().reset_warnings(target_user_id)
         
-        deficit_formatted = bot_instance.format_duration(new_deficit)
+        deficit_formatted = current_bot().format_duration(new_deficit)
         
         await update.message.reply_text(
             f"✅ Removed {minutes} minutes from @{username}'s deficit.\n"
@@ -1458,34 +4290,22 @@ async def reset_me_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
     user_id = user.id
     
-    if bot_instance.reset_user_deficit(user_id):
+    if current_bot().reset_user_deficit(user_id):
         await update.message.reply_text("✅ Your deficit has been reset!")
     else:
         await update.message.reply_text("ℹ️ You don't have any deficit to reset.")
 
 
+@admin_only()
 async def reset_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Reset a specific user's deficit (admin only)"""
-    user = update.message.from_user
-    chat = update.effective_chat
-    
-    try:
-        member = await chat.get_member(user.id)
-        if member.status not in ['creator', 'administrator']:
-            await update.message.reply_text("❌ This command is only available to group administrators.")
-            return
-    except Exception as e:
-        logger.error(f"Error checking admin status: {e}")
-        await update.message.reply_text("❌ Could not verify admin status.")
-        return
-    
     if not context.args or len(context.args) < 1:
         await update.message.reply_text("❌ Please provide a user ID.\nUsage: /resetuser <user_id>")
         return
     
     try:
         target_user_id = int(context.args[0])
-        if bot_instance.reset_user_deficit(target_user_id):
+        if current_bot().reset_user_deficit(target_user_id):
             await update.message.reply_text(f"✅ Deficit reset for user ID {target_user_id}")
         else:
             await update.message.reply_text(f"ℹ️ User ID {target_user_id} has no deficit.")
@@ -1493,31 +4313,19 @@ async def reset_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ Invalid user ID. Please provide a numeric user ID.")
 
 
+@admin_only()
 async def enable_reminders_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Enable daily reminders for this chat (admin only)"""
-    global REMINDER_CHAT_ID
-    
-    user = update.message.from_user
     chat = update.effective_chat
     
-    try:
-        member = await chat.get_member(user.id)
-        if member.status not in ['creator', 'administrator']:
-            await update.message.reply_text("❌ This command is only available to group administrators.")
-            return
-    except Exception as e:
-        logger.error(f"Error checking admin status: {e}")
-        await update.message.reply_text("❌ Could not verify admin status.")
-        return
-    
-    REMINDER_CHAT_ID = chat.id
+    current_partition().enable_reminders(chat.id)
     
     current_time = get_current_time()
     
     await update.message.reply_text(
         "✅ Daily reminders enabled for this chat!\n\n"
         f"🕐 Current time in your timezone: {current_time.strftime('%I:%M %p')}\n"
-        f"🌍 Timezone: {GROUP_TIMEZONE}\n\n"
+        f"🌍 Timezone: {current_partition().timezone}\n\n"
         "📅 Full Daily Schedule:\n\n"
         "**Morning:**\n"
         "• 8:00 AM - Motivation 💪\n"
@@ -1538,28 +4346,92 @@ async def enable_reminders_command(update: Update, context: ContextTypes.DEFAULT
     logger.info(f"Reminders enabled for chat ID: {chat.id}")
 
 
+@admin_only(private_message="⚠️ This command only works in the group!")
+async def dead_letters_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show failed messages that gave up retrying, plus the retry queue size (admin only)"""
+    outbox = current_bot().outbox
+    message = f"📮 Outbox: {len(outbox.retrying)} waiting for retry, {len(outbox.dead)} dead letters\n\n"
+    if not outbox.dead:
+        message += "No dead letters. 🎉"
+    for entry in outbox.dead[-20:]:
+        preview = entry['text'].replace('\n', ' ')[:60]
+        message += (
+            f"#{entry['id']} → {entry['chat_id']} ({entry['attempts']} attempts)\n"
+            f"   {preview}\n"
+            f"   Error: {entry.get('last_error', 'unknown')}\n"
+        )
+    if outbox.dead:
+        message += "\nUse /replay <id> or /replay all to resend."
+    
+    await update.message.reply_text(message)
+
+
+@admin_only(private_message="⚠️ This command only works in the group!")
+async def flagged_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the newest videos flagged by the duration and lookalike checks, with why (admin only)"""
+    flagged = current_bot().get_flagged_videos()
+    if not flagged:
+        await update.message.reply_text("🚩 No flagged videos. 🎉")
+        return
+    
+    parts = [f"🚩 Flagged videos (newest {len(flagged)}):\n\n"]
+    for flag in flagged:
+        when = flag['flagged_at'][:16].replace('T', ' ')
+        if flag['kind'] == 'duration':
+            taken_back = f", {flag['taken_back']}s taken back" if flag.get('taken_back') else ""
+            part = (
+                f"⏱️ @{flag['username']} - {flag['file_unique_id']} ({when})\n"
+                f"   Reported {flag['reported']}s, file is {flag['actual']}s{taken_back}\n"
+            )
+        else:
+            part = f"👯 @{flag['username']} - {flag['file_unique_id']} ({when})\n"
+            for match in flag['matches']:
+                part += f"   Like @{match['username']}'s {match['file_unique_id']}: {', '.join(match['reasons'])}\n"
+        parts.append(part)
+    
+    # Three match lines per flag add up fast; keep each reply under Telegram's limit
+    for message in split_message(parts):
+        await update.message.reply_text(message)
+
+
+@admin_only(private_message="⚠️ This command only works in the group!")
+async def replay_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Put dead letters back in the retry queue and retry them now (admin only)"""
+    if not context.args:
+        await update.message.reply_text("❌ Usage: /replay <id> or /replay all")
+        return
+    
+    try:
+        entry_id = None if context.args[0].lower() == 'all' else int(context.args[0].lstrip('#'))
+    except ValueError:
+        await update.message.reply_text("❌ Usage: /replay <id> or /replay all")
+        return
+    
+    replayed = current_bot().outbox.replay(entry_id)
+    if not replayed:
+        await update.message.reply_text("❌ No matching dead letters.")
+        return
+    
+    current_bot().save_outbox()
+    await retry_failed_messages(context.application)
+    still_dead = len(current_bot().outbox.dead)
+    await update.message.reply_text(
+        f"🔁 Replayed {replayed} message{'s' if replayed != 1 else ''}.\n"
+        f"📮 Dead letters left: {still_dead}"
+    )
+
+
+@admin_only(allow_private=True, denied_message="❌ Only admins can set the group timezone.")
 async def set_timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Set timezone - for users in private (personal), for group by admin in group"""
-    global GROUP_TIMEZONE
-    
     user = update.message.from_user
     chat = update.effective_chat
     is_private = chat.type == 'private'
-    
-    # In group - require admin for group timezone
-    if not is_private:
-        try:
-            member = await chat.get_member(user.id)
-            if member.status not in ['creator', 'administrator']:
-                await update.message.reply_text("❌ Only admins can set the group timezone.")
-                return
-        except Exception as e:
-            logger.error(f"Error checking admin status: {e}")
-            return
+    partition = current_partition()
     
     # Check if timezone argument provided
     if not context.args or len(context.args) < 1:
-        current_tz = GROUP_TIMEZONE if not is_private else get_user_timezone(user.id)
+        current_tz = partition.timezone if not is_private else get_user_timezone(user.id)
         
         await update.message.reply_text(
             "🌍 **Available Timezones:**\n\n"
@@ -1605,7 +4477,7 @@ async def set_timezone_command(update: Update, context: ContextTypes.DEFAULT_TYP
         
         # If user already has a timezone set (not the default group timezone)
         user_key = str(user.id)
-        if user_key in USER_TIMEZONES:
+        if user_key in partition.user_timezones:
             current_time = datetime.now(ZoneInfo(current_user_tz))
             await update.message.reply_text(
                 f"🔒 **Your timezone is already set and cannot be changed!**\n\n"
@@ -1630,19 +4502,18 @@ async def set_timezone_command(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.info(f"User {user.id} set permanent timezone to {new_timezone}")
     else:
         # Group timezone - check if already set
-        if GROUP_TIMEZONE != 'Asia/Seoul' or os.path.exists(TIMEZONE_FILE):
+        if partition.timezone != DEFAULT_TIMEZONE or partition.timezone_set:
             # Group timezone was already set
             current_time = get_current_time()
             await update.message.reply_text(
                 f"🔒 **The group timezone is already set and cannot be changed!**\n\n"
-                f"🌍 Group timezone: {GROUP_TIMEZONE}\n"
+                f"🌍 Group timezone: {partition.timezone}\n"
                 f"🕐 Current time: {current_time.strftime('%I:%M %p')}\n\n"
                 f"Timezone can only be set once for consistency."
             )
             return
         
         # First time setting - set group timezone (admin only)
-        GROUP_TIMEZONE = new_timezone
         save_group_timezone(new_timezone)
         current_time = get_current_time()
         
@@ -1663,14 +4534,61 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Update {update} caused error {context.error}")
 
 
+async def send_or_retry_later(bot, chat_id, text, parse_mode=None, priority=PRIORITY_NORMAL):
+    """Send a message; if it fails, keep it in the outbox for a retry instead of dropping it"""
+    try:
+        return await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode, rate_limit_args=priority)
+    except TelegramError as e:
+        entry = current_bot().outbox.add(chat_id, text, parse_mode, priority, e, is_permanent_send_error(e))
+        current_bot().save_outbox()
+        logger.warning(f"Send to {chat_id} failed ({e}), kept as outbox #{entry['id']}")
+        return None
+
+
+async def retry_failed_messages(application):
+    """Retry failed sends that are due; give up on them after OUTBOX_MAX_ATTEMPTS"""
+    outbox = current_bot().outbox
+    # /replay and the retry job can run at once; each entry goes to only one of them
+    due = outbox.take_due()
+    if not due:
+        return
+    
+    for entry in due:
+        try:
+            await application.bot.send_message(
+                chat_id=entry['chat_id'],
+                text=entry['text'],
+                parse_mode=entry['parse_mode'],
+                rate_limit_args=entry['priority']
+            )
+            outbox.succeeded(entry)
+            logger.info(f"Outbox #{entry['id']} delivered on attempt {entry['attempts'] + 1}")
+        except TelegramError as e:
+            if not outbox.failed(entry, e, is_permanent_send_error(e)):
+                logger.error(f"Outbox #{entry['id']} moved to dead letters: {e}")
+        finally:
+            outbox.done(entry)
+    
+    current_bot().save_outbox()
+
+
+async def send_announcement_digest(application):
+    """Post buffered submission announcements to the group as one message"""
+    partition = current_partition()
+    text = partition.digest.drain()
+    if text and partition.reminder_chat_id:
+        await send_or_retry_later(application.bot, partition.reminder_chat_id, text)
+
+
 async def send_afternoon_reminder(application):
     """Send reminder at 4-5 PM to users who haven't submitted today"""
-    if not REMINDER_CHAT_ID:
+    reminder_chat_id = current_partition().reminder_chat_id
+    if not reminder_chat_id:
         logger.warning("No chat ID set for reminders")
         return
     
     try:
-        users_need_reminder = bot_instance.get_users_without_todays_video()
+        users_need_reminder = current_bot().get_users_without_todays_video()
         
         if not users_need_reminder:
             logger.info("All users have submitted videos today - no reminder needed")
@@ -1687,79 +4605,69 @@ async def send_afternoon_reminder(application):
         
         message += "\n📹 Don't forget to submit your video before midnight!"
         
-        await application.bot.send_message(
-            chat_id=REMINDER_CHAT_ID,
-            text=message,
-            parse_mode='Markdown'
-        )
+        await send_or_retry_later(application.bot, reminder_chat_id, message, parse_mode='Markdown')
         logger.info(f"Afternoon reminder sent to {len(users_need_reminder)} users")
         
     except Exception as e:
         logger.error(f"Error sending afternoon reminder: {e}")
 
 
-async def send_midnight_summary(application):
-    """Send midnight summary with rankings and reset reminders"""
-    if not REMINDER_CHAT_ID:
-        logger.warning("No chat ID set for midnight summary")
-        return
+async def deliver_rollover_notices(application, decisions):
+    """Send rollover kicks (only with a reminder chat to kick from) and warnings, a few at a time"""
+    reminder_chat_id = current_partition().reminder_chat_id
+    semaphore = asyncio.Semaphore(max(1, MIDNIGHT_SEND_CONCURRENCY))
+    
+    async def kick(decision):
+        async with semaphore:
+            try:
+                await application.bot.ban_chat_member(reminder_chat_id, int(decision['user_id']))
+                logger.info(f"Kicked {decision['username']} at midnight")
+            except Exception as e:
+                logger.error(f"Failed to kick {decision['username']}: {e}")
+                return
+            await send_or_retry_later(
+                application.bot,
+                reminder_chat_id,
+                f"🚫 @{decision['username']} has been KICKED!\nReason: Deficit reached 60 hours.",
+                priority=PRIORITY_URGENT
+            )
+    
+    async def warn(decision):
+        async with semaphore:
+            await send_or_retry_later(
+                application.bot,
+                int(decision['user_id']),
+                decision['warning'][1],
+                priority=PRIORITY_URGENT
+            )
     
+    await asyncio.gather(
+        *[kick(d) for d in decisions if d['kick'] and reminder_chat_id],
+        *[warn(d) for d in decisions if d['warning']]
+    )
+
+
+async def send_midnight_summary(application, timezone=None):
+    """Roll over the day for one timezone's users and send their midnight summary"""
+    # The day is closed even without a reminder chat; only the summary needs one
+    reminder_chat_id = current_partition().reminder_chat_id
+    timezone = timezone or current_partition().timezone
     try:
-        today = get_current_date_str()
-        now = get_current_time()
+        now = datetime.now(ZoneInfo(timezone))
+        # Fired at local midnight, so the day being closed is the one that just ended
+        today = (now - timedelta(days=1)).strftime('%Y-%m-%d')
+        decisions = await roll_over_bucket(application, timezone, today, now)
+        if WORKER_COUNT > 1:
+            # Each worker rolls over its own users; the leader sends one summary for all
+            decisions = await gather_shard_rollovers(timezone, today, decisions)
+            if decisions is None:
+                return
         
-        # MIDNIGHT: Process each user
-        for user_id, data in list(bot_instance.user_deficits.items()):
-            if data.get('today_date') == today:
-                todays_total = data.get('daily_total_today', 0)
-            else:
-                todays_total = 0  # submitted nothing today
-            
-            # Check if more than 24 hours since last video (reset streak)
-            last_video_timestamp = data.get('last_video_timestamp')
-            if last_video_timestamp:
-                last_dt = datetime.fromisoformat(last_video_timestamp)
-                hours_since_last = (now.replace(tzinfo=None) - last_dt).total_seconds() / 3600
-                
-                if hours_since_last >= 24:
-                    # More than 24 hours - reset streak to 0
-                    bot_instance.user_deficits[user_id]['streak_days'] = 0
-                    logger.info(f"Midnight: Reset streak for {data['username']} (24+ hours since last video)")
-            
-            # Add shortfall to deficit if didn't meet today's 2h
-            if todays_total < MIN_DURATION:
-                shortfall = MIN_DURATION - todays_total
-                bot_instance.user_deficits[user_id]['total_deficit_seconds'] = (
-                    data.get('total_deficit_seconds', 0) + shortfall
-                )
-                logger.info(f"Midnight: +{shortfall}s deficit for {data['username']} (sent {todays_total}s today)")
-            else:
-                logger.info(f"Midnight: {data['username']} met today's requirement ({todays_total}s)")
-            
-            bot_instance.save_data()
-            
-            # Kick if over 60h deficit
-            new_deficit = bot_instance.user_deficits[user_id].get('total_deficit_seconds', 0)
-            if new_deficit >= 60 * 3600 and REMINDER_CHAT_ID:
-                try:
-                    await application.bot.ban_chat_member(REMINDER_CHAT_ID, int(user_id))
-                    await application.bot.send_message(
-                        chat_id=REMINDER_CHAT_ID,
-                        text=f"🚫 @{data['username']} has been KICKED!\nReason: Deficit reached 60 hours."
-                    )
-                    logger.info(f"Kicked {data['username']} at midnight")
-                except Exception as e:
-                    logger.error(f"Failed to kick {data['username']}: {e}")
-            
-            # Send private warnings
-            warning = bot_instance.check_and_update_warnings(int(user_id), new_deficit)
-            if warning:
-                try:
-                    await application.bot.send_message(chat_id=int(user_id), text=warning)
-                except Exception:
-                    pass
+        if not reminder_chat_id:
+            logger.warning("No chat ID set for midnight summary")
+            return
         
-        rankings = bot_instance.get_todays_leaderboard_for_midnight()
+        rankings = sorted(decisions, key=lambda x: x['today_hours'], reverse=True)
         
         if not rankings:
             logger.info("No data for midnight summary")
@@ -1768,14 +4676,14 @@ async def send_midnight_summary(application):
         # Build midnight summary message
         message = "🌙 **Midnight Summary** 🌙\n"
         message += f"📅 Date: {today}\n"
-        message += f"🌍 Timezone: {GROUP_TIMEZONE}\n\n"
+        message += f"🌍 Timezone: {timezone}\n\n"
         
         # Top performers today
         message += "🏆 **Today's Best Performers:**\n"
         medals = ['🥇', '🥈', '🥉']
         for i, user in enumerate(rankings[:5], 1):
             username = user['username']
-            today_hours = bot_instance.format_duration(user['today_hours'])
+            today_hours = current_bot().format_duration(user['today_hours'])
             streak = user['streak']
             prefix = medals[i-1] if i <= 3 else f"{i}."
             streak_str = f" | 🔥 {streak} days" if streak > 0 else ""
@@ -1784,38 +4692,139 @@ async def send_midnight_summary(application):
         message += "\n📊 **New Day Requirements:**\n"
         for user in rankings:
             username = user['username']
-            new_deficit = bot_instance.get_user_deficit(int(user['user_id']))
+            new_deficit = user['deficit']
             required_seconds = MIN_DURATION + new_deficit
-            required_formatted = bot_instance.format_duration(required_seconds)
+            required_formatted = current_bot().format_duration(required_seconds)
             message += f"• @{username}: {required_formatted} needed"
             if new_deficit > 0:
-                deficit_fmt = bot_instance.format_duration(new_deficit)
+                deficit_fmt = current_bot().format_duration(new_deficit)
                 message += f" (includes {deficit_fmt} deficit)"
             message += "\n"
         
         message += "\n🔄 **Clock has reset! New day begins now!**"
         
-        await application.bot.send_message(
-            chat_id=REMINDER_CHAT_ID,
-            text=message,
-            parse_mode='Markdown'
-        )
-        logger.info("Midnight summary sent successfully")
+        await send_or_retry_later(application.bot, reminder_chat_id, message, parse_mode='Markdown')
+        logger.info(f"Midnight summary sent for {len(rankings)} users in {timezone}")
         
     except Exception as e:
         logger.error(f"Error sending midnight summary: {e}")
 
 
+async def roll_over_bucket(application, timezone, today, now):
+    """Close the day for this worker's users in one timezone; returns the decisions applied"""
+    user_keys = current_bot().get_timezone_bucket(timezone)
+    if not user_keys:
+        return []
+    
+    # Compute: one pass over this bucket's users, no I/O
+    started = time.perf_counter()
+    decisions = current_bot().plan_midnight_rollover(user_keys, today, now)
+    if not decisions:
+        logger.info(f"Midnight rollover {timezone}/{today} already done")
+        return []
+    for decision in decisions:
+        if decision['reset_streak']:
+            logger.info(f"Midnight: Reset streak for {decision['username']} (24+ hours since last video)")
+        if decision['shortfall']:
+            logger.info(f"Midnight: +{decision['shortfall']}s deficit for {decision['username']} (sent {decision['todays_total']}s today)")
+        else:
+            logger.info(f"Midnight: {decision['username']} met today's requirement ({decision['todays_total']}s)")
+    computed = time.perf_counter()
+    
+    # Commit: apply everything, then a single flush (users are checkpointed in it)
+    current_bot().save_rollover_run(timezone, today, 'running')
+    current_bot().apply_midnight_rollover(decisions)
+    await current_bot().flush_async()
+    current_bot().finish_rollover(timezone, today, len(decisions))
+    committed = time.perf_counter()
+    logger.info(f"Leaderboard cache stats: {current_bot().leaderboard_cache.stats()}")
+    
+    # Deliver: kicks and warnings with bounded concurrency
+    await deliver_rollover_notices(application, decisions)
+    delivered = time.perf_counter()
+    logger.info(
+        f"Midnight rollover of {len(decisions)} users in {timezone} "
+        f"(compute {computed - started:.3f}s, commit {committed - computed:.3f}s, "
+        f"delivery {delivered - committed:.3f}s)"
+    )
+    return decisions
+
+
+async def gather_shard_rollovers(timezone, day, decisions):
+    """Report this worker's rollover; the leader waits for every shard's and gets them all back"""
+    partition = current_partition()
+    
+    def run_io(func, *args):
+        return asyncio.wrap_future(partition.bot.io_executor.submit(func, *args))
+    
+    def load_reports():
+        return [
+            partition.storage.load_setting(f'rollover_decisions:{timezone}:{shard}')
+            for shard in range(WORKER_COUNT)
+        ]
+    
+    await run_io(partition.storage.save_setting, f'rollover_decisions:{timezone}:{WORKER_ID}', {'day': day, 'decisions': decisions})
+    if not leader.is_leader:
+        return None
+    
+    deadline = time.monotonic() + SHARD_GATHER_SECONDS
+    while True:
+        reports = await run_io(load_reports)
+        missing = [shard for shard, report in enumerate(reports) if not report or report['day'] != day]
+        if not missing or time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(1)
+    if missing:
+        logger.warning(f"Midnight summary {timezone}/{day} sent without shards {missing}")
+    return [decision for report in reports if report and report['day'] == day for decision in report['decisions']]
+
+
+async def catch_up_midnight_rollovers(application):
+    """Apply midnight rollovers missed while the bot was down (e.g. a redeploy across midnight)"""
+    try:
+        decisions = current_bot().catch_up_rollovers()
+        await current_bot().flush_async()
+        if decisions:
+            logger.info(f"Caught up missed midnight rollovers for {len(decisions)} users")
+            await deliver_rollover_notices(application, decisions)
+    except Exception as e:
+        logger.error(f"Error catching up midnight rollovers: {e}")
+
+
+async def flush_pending_writes():
+    """Write out everything changed since the last flush (write-behind)"""
+    if current_bot().has_pending_writes():
+        await current_bot().flush_async()
+
+
+async def refresh_shared_state():
+    """Sharded mode: pick up what other workers saved - groups, users, videos and settings"""
+    await partitions.discover_async()
+    for partition in partitions.all():
+        try:
+            await partition.bot.refresh_from_storage()
+            await asyncio.wrap_future(partitions.io_executor.submit(partition.load_settings))
+        except Exception as e:
+            logger.error(f"Error refreshing shared state: {e}")
+
+
+async def evict_old_video_hashes():
+    """Daily job: move old duplicate-index entries to the archive"""
+    try:
+        current_bot().evict_old_video_hashes()
+    except Exception as e:
+        logger.error(f"Error evicting video hashes: {e}")
+
+
 async def send_random_joke(application):
     """Send a random joke to users with deficits"""
-    if not REMINDER_CHAT_ID:
+    reminder_chat_id = current_partition().reminder_chat_id
+    if not reminder_chat_id:
         return
     
     try:
-        import random
-        
         # Check if there are users with deficits
-        deficits = bot_instance.get_all_deficits()
+        deficits = current_bot().get_all_deficits()
         users_with_deficits = [
             data for data in deficits.values() 
             if data.get('total_deficit_seconds', 0) > 0
@@ -1829,8 +4838,9 @@ async def send_random_joke(application):
         joke = random.choice(SLACKER_JOKES)
         
         await application.bot.send_message(
-            chat_id=REMINDER_CHAT_ID,
-            text=f"😄 **Daily Humor Break** 😄\n\n{joke}"
+            chat_id=reminder_chat_id,
+            text=f"😄 **Daily Humor Break** 😄\n\n{joke}",
+            rate_limit_args=PRIORITY_LOW
         )
         logger.info("Random joke sent successfully")
         
@@ -1840,18 +4850,18 @@ async def send_random_joke(application):
 
 async def send_random_motivation(application):
     """Send a random motivational message"""
-    if not REMINDER_CHAT_ID:
+    reminder_chat_id = current_partition().reminder_chat_id
+    if not reminder_chat_id:
         return
     
     try:
-        import random
-        
         # Pick a random motivational message
         motivation = random.choice(MOTIVATIONAL_MESSAGES)
         
         await application.bot.send_message(
-            chat_id=REMINDER_CHAT_ID,
-            text=motivation
+            chat_id=reminder_chat_id,
+            text=motivation,
+            rate_limit_args=PRIORITY_LOW
         )
         logger.info("Random motivation sent successfully")
         
@@ -1861,12 +4871,12 @@ async def send_random_motivation(application):
 
 def main():
     """Start the bot"""
-    # Load group timezone and user timezones
-    load_group_timezone()
-    load_user_timezones()
-    
     BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     
+    if not 0 <= WORKER_ID < WORKER_COUNT or (WORKER_COUNT > 1 and STORAGE_BACKEND != 'sqlite'):
+        print("❌ Error: sharded workers need STORAGE_BACKEND=sqlite and 0 <= WORKER_ID < WORKER_COUNT")
+        return
+    
     if not BOT_TOKEN:
         print("❌ Error: TELEGRAM_BOT_TOKEN environment variable not set!")
         print("\nPlease set it using one of these methods:")
@@ -1877,85 +4887,133 @@ def main():
         return
     
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    # All outgoing requests go through the rate-limited outbound queue
+    # Updates run concurrently, serialized per user
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .rate_limiter(OutboundQueue())
+        .concurrent_updates(PerUserUpdateProcessor())
+        .build()
+    )
     
     # Initialize scheduler
-    scheduler = AsyncIOScheduler(timezone=GROUP_TIMEZONE)
+    # Jobs are cosmetic unless added with CRITICAL_JOB; critical runs missed
+    # while the bot was down are made up on startup (see JobRunLog)
+    scheduler = AsyncIOScheduler(timezone=partitions.default.timezone, job_defaults=COSMETIC_JOB)
+    scheduler.add_listener(job_runs.on_job_event, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
     
-    # Schedule afternoon reminders (4 PM and 5 PM)
-    scheduler.add_job(
-        send_afternoon_reminder,
-        CronTrigger(hour=16, minute=0),
-        args=[application],
-        id='afternoon_reminder_4pm'
-    )
-    scheduler.add_job(
-        send_afternoon_reminder,
-        CronTrigger(hour=17, minute=0),
-        args=[application],
-        id='afternoon_reminder_5pm'
-    )
+    # Group jobs run at each group's local time: one set of jobs per timezone,
+    # each run for the partitions whose group is in that timezone. Reminders
+    # and humor only run on the leader; every worker rolls over its own users.
+    for timezone in get_rollover_timezones():
+        # Schedule afternoon reminders (4 PM and 5 PM)
+        job_runs.track(scheduler.add_job(
+            if_leader,
+            CronTrigger(hour=16, minute=0, timezone=timezone),
+            args=[for_each_partition, send_afternoon_reminder, application],
+            kwargs={'timezone': timezone},
+            id=f'afternoon_reminder_4pm_{timezone}',
+            **CRITICAL_JOB
+        ))
+        job_runs.track(scheduler.add_job(
+            if_leader,
+            CronTrigger(hour=17, minute=0, timezone=timezone),
+            args=[for_each_partition, send_afternoon_reminder, application],
+            kwargs={'timezone': timezone},
+            id=f'afternoon_reminder_5pm_{timezone}',
+            **CRITICAL_JOB
+        ))
+        
+        # Schedule midnight rollover + summary (12:00 AM) - users in this
+        # timezone are rolled over in every partition
+        job_runs.track(scheduler.add_job(
+            for_each_partition,
+            CronTrigger(hour=0, minute=0, timezone=timezone),
+            args=[send_midnight_summary, application, timezone],
+            id=f'midnight_summary_{timezone}',
+            **CRITICAL_JOB
+        ))
+        
+        # Schedule random jokes (3 times a day at random-ish times)
+        # 10:30 AM, 2:45 PM, 7:20 PM
+        for name, hour, minute in [('morning', 10, 30), ('afternoon', 14, 45), ('evening', 19, 20)]:
+            scheduler.add_job(
+                if_leader,
+                CronTrigger(hour=hour, minute=minute, timezone=timezone),
+                args=[for_each_partition, send_random_joke, application],
+                kwargs={'timezone': timezone},
+                id=f'random_joke_{name}_{timezone}'
+            )
+        
+        # Schedule random motivations (4 times a day)
+        # 8:00 AM, 12:00 PM, 3:30 PM, 9:00 PM
+        for name, hour, minute in [('morning', 8, 0), ('noon', 12, 0), ('afternoon', 15, 30), ('night', 21, 0)]:
+            scheduler.add_job(
+                if_leader,
+                CronTrigger(hour=hour, minute=minute, timezone=timezone),
+                args=[for_each_partition, send_random_motivation, application],
+                kwargs={'timezone': timezone},
+                id=f'motivation_{name}_{timezone}'
+            )
     
-    # Schedule midnight summary (12:00 AM)
-    scheduler.add_job(
-        send_midnight_summary,
-        CronTrigger(hour=0, minute=0),
-        args=[application],
-        id='midnight_summary'
-    )
+    # Move old duplicate-index entries to the cold archive (4:00 AM)
+    if DEDUP_RETENTION_DAYS > 0:
+        scheduler.add_job(
+            for_each_partition,
+            CronTrigger(hour=4, minute=0),
+            args=[evict_old_video_hashes],
+            id='evict_video_hashes'
+        )
     
-    # Schedule random jokes (3 times a day at random-ish times)
-    # 10:30 AM, 2:45 PM, 7:20 PM
-    scheduler.add_job(
-        send_random_joke,
-        CronTrigger(hour=10, minute=30),
-        args=[application],
-        id='random_joke_morning'
-    )
-    scheduler.add_job(
-        send_random_joke,
-        CronTrigger(hour=14, minute=45),
-        args=[application],
-        id='random_joke_afternoon'
-    )
-    scheduler.add_job(
-        send_random_joke,
-        CronTrigger(hour=19, minute=20),
-        args=[application],
-        id='random_joke_evening'
-    )
+    # Post the announcement digest
+    if ANNOUNCE_DIGEST_SECONDS > 0:
+        scheduler.add_job(
+            for_each_partition,
+            IntervalTrigger(seconds=ANNOUNCE_DIGEST_SECONDS),
+            args=[send_announcement_digest, application],
+            id='announcement_digest'
+        )
     
-    # Schedule random motivations (4 times a day)
-    # 8:00 AM, 12:00 PM, 3:30 PM, 9:00 PM
-    scheduler.add_job(
-        send_random_motivation,
-        CronTrigger(hour=8, minute=0),
-        args=[application],
-        id='motivation_morning'
-    )
+    # Retry failed outgoing messages
     scheduler.add_job(
-        send_random_motivation,
-        CronTrigger(hour=12, minute=0),
-        args=[application],
-        id='motivation_noon'
-    )
-    scheduler.add_job(
-        send_random_motivation,
-        CronTrigger(hour=15, minute=30),
-        args=[application],
-        id='motivation_afternoon'
-    )
-    scheduler.add_job(
-        send_random_motivation,
-        CronTrigger(hour=21, minute=0),
-        args=[application],
-        id='motivation_night'
+        for_each_partition,
+        IntervalTrigger(seconds=30),
+        args=[retry_failed_messages, application],
+        id='retry_failed_messages'
     )
     
+    # Flush write-behind changes to disk
+    if SAVE_INTERVAL_SECONDS > 0:
+        scheduler.add_job(
+            for_each_partition,
+            IntervalTrigger(seconds=SAVE_INTERVAL_SECONDS),
+            args=[flush_pending_writes],
+            id='flush_pending_writes'
+        )
+    
+    # Sharded workers: keep the leader lease and pick up the other workers' changes
+    if WORKER_COUNT > 1:
+        scheduler.add_job(
+            leader.renew,
+            IntervalTrigger(seconds=max(1, LEADER_LEASE_SECONDS / 3)),
+            id='leader_lease'
+        )
+        scheduler.add_job(
+            refresh_shared_state,
+            IntervalTrigger(seconds=SHARD_REFRESH_SECONDS),
+            id='refresh_shared_state'
+        )
+    
     # Start scheduler
     scheduler.start()
     
     # Add handlers
+    # Other workers' users are handed over to them before anything else runs
+    if WORKER_COUNT > 1:
+        application.add_handler(TypeHandler(Update, route_to_shard), group=-2)
+    # Every update first picks the partition of the group it belongs to
+    application.add_handler(TypeHandler(Update, select_partition), group=-1)
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("mydeficit", my_deficit_command))
     application.add_handler(CommandHandler("myhours", my_hours_command))
@@ -1965,10 +5023,20 @@ def main():
     application.add_handler(CommandHandler("week", week_leaderboard))
     application.add_handler(CommandHandler("month", month_leaderboard))
     application.add_handler(CommandHandler("alltime", alltime_leaderboard))
+    application.add_handler(CommandHandler("myrank", my_rank_command))
     application.add_handler(CommandHandler("subscribers", subscribers_command))
+    application.add_handler(CommandHandler("alldeficits", all_deficits_command))
+    application.add_handler(CommandHandler("addtime", add_time_command))
+    application.add_handler(CommandHandler("removetime", remove_time_command))
+    application.add_handler(CommandHandler("resetuser", reset_user_command))
+    application.add_handler(CommandHandler("resetme", reset_me_command))
     application.add_handler(CommandHandler("settimezone", set_timezone_command))
     application.add_handler(CommandHandler("enablereminders", enable_reminders_command))
+    application.add_handler(CommandHandler("deadletters", dead_letters_command))
+    application.add_handler(CommandHandler("replay", replay_command))
+    application.add_handler(CommandHandler("flagged", flagged_command))
     application.add_handler(MessageHandler(filters.VIDEO, handle_video))
+    application.add_handler(ChatMemberHandler(track_chat_members, ChatMemberHandler.ANY_CHAT_MEMBER))
     
     # Add error handler
     application.add_error_handler(error_handler)
@@ -1988,31 +5056,75 @@ def main():
             BotCommand("week", "📆 This week's rankings"),
             BotCommand("month", "🗓️ Monthly rankings"),
             BotCommand("alltime", "🏆 All-time champions"),
+            BotCommand("myrank", "🏅 See where you stand"),
             BotCommand("enablereminders", "⏰ Enable auto reminders"),
         ]
         await application.bot.set_my_commands(commands)
+        
+        if VERIFY_DURATION in ('flag', 'reverse'):
+            duration_verifier.start(application.bot)
+        
+        # Take (or wait for) the leader lease before the first scheduled job
+        await leader.renew()
+        
+        # Make up critical jobs missed while the bot was down (a late midnight
+        # summary first, so the rollover catch-up doesn't leave it nothing to report)
+        await job_runs.run_missed()
+        
+        # Apply any midnight rollovers missed while the bot was down
+        await for_each_partition(catch_up_midnight_rollovers, application)
+    
+    # Don't lose buffered announcements on shutdown
+    async def post_stop(application):
+        await for_each_partition(send_announcement_digest, application)
+        await duration_verifier.stop()
     
     application.post_init = post_init
+    application.post_stop = post_stop
     
     # Start bot
     current_time = get_current_time()
     print("🤖 Bot is starting...")
-    print(f"📊 Data will be saved to: {DATA_FILE}")
+    print(f"📊 Data will be saved to: {SQLITE_FILE if STORAGE_BACKEND == 'sqlite' else DATA_FILE}")
     print(f"⏰ Minimum video duration: {MIN_DURATION // 3600} hours")
-    print(f"🌍 Timezone: {GROUP_TIMEZONE}")
+    print(f"🌍 Timezone: {partitions.default.timezone}")
+    if PERCEPTUAL_DEDUP and Image is None:
+        print("⚠️ PERCEPTUAL_DEDUP is on but Pillow is not installed - near-duplicate check disabled")
+    if WORKER_COUNT > 1:
+        print(f"🧩 Worker {WORKER_ID} of {WORKER_COUNT} (users with user_id % {WORKER_COUNT} == {WORKER_ID})")
+    if MULTI_GROUP:
+        print(f"🏘️ Multi-group mode: {len(partitions.all())} partitions under {PARTITIONS_DIR}")
     print(f"🕐 Current time: {current_time.strftime('%Y-%m-%d %I:%M %p')}")
     print("✅ Bot commands have been set and will appear in the Telegram menu")
     print("⏰ Scheduler started:")
     print("   - Reminders at 4 PM, 5 PM")
-    print("   - Midnight summary at 12 AM")
+    print("   - Midnight summary at 12 AM in each user's timezone")
     print("   - Random jokes: 10:30 AM, 2:45 PM, 7:20 PM")
     print("   - Motivations: 8 AM, 12 PM, 3:30 PM, 9 PM")
     print("Press Ctrl+C to stop")
     
     try:
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if WORKER_ID > 0:
+            # Only worker 0 talks to Telegram for updates; the rest get theirs from it
+            run_shard_worker(application)
+        elif WEBHOOK_URL:
+            # Telegram sends this secret in every request; anything without it is rejected
+            secret = WEBHOOK_SECRET or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()[:32]
+            print(f"🌐 Webhook mode: listening on port {WEBHOOK_PORT} at /{WEBHOOK_PATH}")
+            application.run_webhook(
+                listen='0.0.0.0',
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=secret,
+                allowed_updates=ALLOWED_UPDATES
+            )
+        else:
+            application.run_polling(allowed_updates=ALLOWED_UPDATES)
     finally:
         scheduler.shutdown()
+        leader.release()
+        partitions.close()
 
 
 if __name__ == '__main__':
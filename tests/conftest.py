@@ -0,0 +1,60 @@
+import os
+import sys
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telegram_video_bot as t  # noqa: E402
+
+
+class Clock:
+    """Settable stand-in for the bot's time helpers"""
+
+    def __init__(self, start):
+        self.now = start
+
+    def advance(self, **kwargs):
+        self.now += timedelta(**kwargs)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(datetime(2026, 3, 2, 12, 0, tzinfo=ZoneInfo('UTC')))
+    monkeypatch.setattr(t, 'get_current_time', lambda: clock.now.astimezone(ZoneInfo(t.current_partition().timezone)))
+    monkeypatch.setattr(
+        t, 'get_current_time_for_user',
+        lambda user_id: clock.now.astimezone(ZoneInfo(t.get_user_timezone(user_id)))
+    )
+    return clock
+
+
+@pytest.fixture
+def make_bot(tmp_path, monkeypatch):
+    """Build VideoBots with their data in fresh temporary directories"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(t.partitions.default, 'user_timezones', {})
+    bots = []
+
+    def make():
+        data_dir = tmp_path / f"bot{len(bots)}"
+        video_bot = t.VideoBot(
+            storage=t.create_storage(str(data_dir)),
+            activity_log=t.ActivityLog(log_dir=str(data_dir / 'activity_logs'))
+        )
+        bots.append(video_bot)
+        return video_bot
+
+    yield make
+    for video_bot in bots:
+        video_bot.io_executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def bot(make_bot, monkeypatch):
+    """A VideoBot installed as the default group's bot"""
+    video_bot = make_bot()
+    monkeypatch.setattr(t.partitions.default, 'bot', video_bot)
+    return video_bot
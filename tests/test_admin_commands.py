@@ -0,0 +1,35 @@
+"""Admin deficit commands and the joke job read every user's deficit"""
+import asyncio
+from types import SimpleNamespace
+
+import telegram_video_bot as t
+
+
+class Recorder:
+    def __init__(self):
+        self.sent = []
+
+    async def reply_text(self, text, **kwargs):
+        self.sent.append(text)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+
+def test_all_deficits_lists_users_with_a_deficit(bot):
+    bot.add_deficit(1, 'owes', 3600)
+    bot.add_video_time(2, 'clear', 600)
+    message = Recorder()
+    asyncio.run(t.all_deficits_command.__wrapped__(SimpleNamespace(message=message), SimpleNamespace(args=[])))
+    assert '@owes: 1 hour' in message.sent[0] and '@clear' not in message.sent[0]
+
+
+def test_joke_goes_out_when_someone_owes_time(bot, monkeypatch):
+    monkeypatch.setattr(t.partitions.default, 'reminder_chat_id', -100)
+    application = SimpleNamespace(bot=Recorder())
+    asyncio.run(t.send_random_joke(application))
+    assert application.bot.sent == []
+
+    bot.add_deficit(1, 'owes', 3600)
+    asyncio.run(t.send_random_joke(application))
+    assert len(application.bot.sent) == 1
@@ -0,0 +1,35 @@
+"""/flagged replies stay within Telegram's message length limit"""
+import asyncio
+from types import SimpleNamespace
+
+import telegram_video_bot as t
+
+
+class Message:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def test_flagged_splits_long_output(bot):
+    for user_id in range(1, 21):
+        bot.add_video_time(user_id, f"user_with_a_long_name_{user_id}", 600)
+        bot.flag_lookalike_video(user_id, f"video{user_id}" * 3, [{
+            'file_unique_id': f"original{n}" * 3,
+            'username': f"someone_else_{n}",
+            'reasons': ['same 1920x1080 video/mp4', 'length 7199s vs 7200s',
+                        'size within 0.31% (1234567890 vs 1238400000 bytes)']
+        } for n in range(3)])
+
+    message = Message()
+    asyncio.run(t.flagged_command.__wrapped__(SimpleNamespace(message=message), SimpleNamespace(args=[])))
+    assert len(message.replies) > 1
+    assert all(len(reply) <= t.MAX_MESSAGE_LENGTH for reply in message.replies)
+    assert ''.join(message.replies).count('👯') == 20
+
+
+def test_split_message():
+    assert t.split_message(['ab', 'cd', 'ef'], limit=4) == ['abcd', 'ef']
+    assert t.split_message(['abcdefghij'], limit=4) == ['abcd', 'efgh', 'ij']
@@ -0,0 +1,49 @@
+"""Metadata lookalikes are credited but flagged; entries only carry a fingerprint with the check on"""
+import asyncio
+from types import SimpleNamespace
+
+import telegram_video_bot as t
+
+
+class Message:
+    def __init__(self, user_id, video):
+        self.from_user = SimpleNamespace(id=user_id, username=f"user{user_id}", first_name='User')
+        self.chat = SimpleNamespace(id=user_id, type='private')
+        self.video = video
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+    async def delete(self):
+        pass
+
+
+def video(number, duration=3600, file_size=500_000_000):
+    return SimpleNamespace(
+        file_id=f"file{number}", file_unique_id=f"unique{number}", duration=duration,
+        width=1280, height=720, file_size=file_size, mime_type='video/mp4', thumbnail=None
+    )
+
+
+def submit(user_id, submitted):
+    asyncio.run(t.process_video_submission(SimpleNamespace(bot=None), [Message(user_id, submitted)]))
+
+
+def test_lookalikes_are_credited_and_flagged(bot, clock, monkeypatch):
+    monkeypatch.setattr(t, 'METADATA_DEDUP', True)
+    submit(1, video(1))
+    # Re-uploaded: new file ID, one second shorter, a few KB smaller
+    submit(2, video(2, duration=3599, file_size=499_990_000))
+    submit(3, video(3, duration=1800, file_size=250_000_000))
+
+    assert bot.get_user_total_hours(2) == 3599
+    flagged = bot.get_flagged_videos()
+    assert [(flag['username'], flag['file_unique_id']) for flag in flagged] == [('user2', 'unique2')]
+    assert flagged[0]['matches'][0]['username'] == 'user1'
+
+
+def test_entries_stay_compact_without_the_lookalike_check(bot, clock, monkeypatch):
+    monkeypatch.setattr(t, 'METADATA_DEDUP', False)
+    submit(1, video(1))
+    assert list(bot.video_index.entries.values())[0][4:] == []
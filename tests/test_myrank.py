@@ -0,0 +1,22 @@
+"""/myrank reports the rank, percentile and gap get_user_rank computes"""
+import asyncio
+from types import SimpleNamespace
+
+import telegram_video_bot as t
+
+
+def test_myrank_shows_the_percentile(bot, clock):
+    for user_id, seconds in ((1, 3600), (2, 1800), (3, 600), (4, 300)):
+        bot.add_video_time(user_id, f"user{user_id}", seconds)
+    replies = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    update = SimpleNamespace(
+        message=SimpleNamespace(from_user=SimpleNamespace(id=2, username='user2', first_name='U'), reply_text=reply_text),
+        effective_chat=SimpleNamespace(type='private')
+    )
+    asyncio.run(t.my_rank_command(update, SimpleNamespace(args=[])))
+    assert bot.get_user_rank(2)['percentile'] == 75.0
+    assert '#2 of 4' in replies[0] and 'Percentile: 75' in replies[0]
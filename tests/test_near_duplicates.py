@@ -0,0 +1,102 @@
+"""Thumbnail near-duplicates: rejected like duplicates, or credited and flagged for the admins"""
+import asyncio
+import io
+import random
+from types import SimpleNamespace
+
+import pytest
+
+import telegram_video_bot as t
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def thumbnail_bytes(seed, noise=0, quality=90):
+    """A JPEG thumbnail stand-in: a random blocky picture, optionally re-encoded with noise"""
+    rng = random.Random(seed)
+    image = Image.new('L', (8, 8))
+    image.putdata([rng.randrange(256) for _ in range(64)])
+    image = image.resize((320, 180), Image.NEAREST)
+    if noise:
+        jitter = random.Random(noise)
+        image = Image.eval(image, lambda value: max(0, min(255, value + jitter.randrange(-8, 9))))
+    out = io.BytesIO()
+    image.convert('RGB').save(out, 'JPEG', quality=quality)
+    return out.getvalue()
+
+
+class FileBot:
+    """get_file() serving thumbnails from memory instead of the Bot API"""
+
+    def __init__(self):
+        self.files = {}
+
+    async def get_file(self, file_id):
+        data = self.files[file_id]
+
+        async def download_as_bytearray():
+            return bytearray(data)
+        return SimpleNamespace(download_as_bytearray=download_as_bytearray)
+
+
+class Message:
+    def __init__(self, user_id, video):
+        self.from_user = SimpleNamespace(id=user_id, username=f"user{user_id}", first_name='User')
+        self.chat = SimpleNamespace(id=user_id, type='private')
+        self.video = video
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+    async def delete(self):
+        pass
+
+
+def submit(context, user_id, number, thumbnail, duration=7200):
+    context.bot.files[f"thumb{number}"] = thumbnail
+    video = SimpleNamespace(
+        file_id=f"file{number}", file_unique_id=f"unique{number}", duration=duration,
+        width=1280, height=720, file_size=500_000_000 + number, mime_type='video/mp4',
+        thumbnail=SimpleNamespace(file_id=f"thumb{number}")
+    )
+    message = Message(user_id, video)
+    asyncio.run(t.process_video_submission(context, [message]))
+    return message
+
+
+def test_dhash_distances():
+    original = t.dhash(thumbnail_bytes(1))
+    assert t.hamming_distance(original, t.dhash(thumbnail_bytes(1, noise=5, quality=40))) <= t.PERCEPTUAL_DEDUP_DISTANCE
+    assert t.hamming_distance(original, t.dhash(thumbnail_bytes(2))) > 20
+
+
+def test_near_duplicates_are_rejected(bot, clock, monkeypatch):
+    monkeypatch.setattr(t, 'PERCEPTUAL_DEDUP', True)
+    context = SimpleNamespace(bot=FileBot())
+
+    submit(context, 1, 1, thumbnail_bytes(1))
+    reencoded = submit(context, 2, 2, thumbnail_bytes(1, noise=5, quality=40), duration=7195)
+    other = submit(context, 3, 3, thumbnail_bytes(2))
+
+    assert 'already been submitted' in reencoded.replies[0] and '@user1' in reencoded.replies[0]
+    assert 'already been submitted' not in other.replies[0]
+    assert [bot.get_user_total_hours(user_id) for user_id in (1, 2, 3)] == [7200, 0, 7200]
+
+
+def test_near_duplicates_are_credited_and_flagged(bot, clock, monkeypatch):
+    monkeypatch.setattr(t, 'PERCEPTUAL_DEDUP', True)
+    monkeypatch.setattr(t, 'PERCEPTUAL_DEDUP_ACTION', 'flag')
+    context = SimpleNamespace(bot=FileBot())
+
+    submit(context, 1, 1, thumbnail_bytes(1))
+    reencoded = submit(context, 2, 2, thumbnail_bytes(1, noise=5, quality=40), duration=7195)
+    other = submit(context, 3, 3, thumbnail_bytes(2))
+
+    assert 'already been submitted' not in reencoded.replies[0]
+    assert [bot.get_user_total_hours(user_id) for user_id in (1, 2, 3)] == [7200, 7195, 7200]
+    flagged = bot.get_flagged_videos()
+    assert [(flag['username'], flag['file_unique_id']) for flag in flagged] == [('user2', 'unique2')]
+    reasons = flagged[0]['matches'][0]['reasons']
+    assert 'thumbnail' in reasons[0] and reasons[1] == 'length 7195s vs 7200s'
+    assert other.replies and 'unique3' not in str(flagged)
@@ -0,0 +1,38 @@
+"""Outbox retries: an entry is sent once even when /replay and the retry job overlap"""
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import NetworkError
+
+import telegram_video_bot as t
+
+
+class SlowBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0.01)
+        self.sent.append((chat_id, text))
+
+
+def test_overlapping_retries_send_each_entry_once(bot):
+    for n in range(3):
+        bot.outbox.add(100 + n, f"message {n}", None, t.PRIORITY_URGENT, NetworkError('timed out'), now=1)
+    application = SimpleNamespace(bot=SlowBot())
+
+    async def main():
+        await asyncio.gather(t.retry_failed_messages(application), t.retry_failed_messages(application))
+
+    asyncio.run(main())
+    assert sorted(application.bot.sent) == [(100, 'message 0'), (101, 'message 1'), (102, 'message 2')]
+    assert bot.outbox.retrying == [] and bot.outbox.sending == set()
+
+
+def test_outbox_tolerates_entries_already_gone():
+    outbox = t.Outbox(max_attempts=2)
+    entry = outbox.add(1, 'hello', None, t.PRIORITY_URGENT, NetworkError('timed out'), now=1)
+    outbox.succeeded(entry)
+    outbox.succeeded(entry)
+    assert outbox.failed(entry, NetworkError('timed out'))
+    assert outbox.retrying == [] and outbox.dead == []
@@ -0,0 +1,33 @@
+"""Group partitions are opened on the storage thread, not the event loop"""
+import asyncio
+import threading
+
+import telegram_video_bot as t
+
+
+def test_partitions_load_on_the_storage_thread(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    registry = t.PartitionRegistry(multi_group=True, partitions_dir=str(tmp_path / 'partitions'))
+    loaded_on = []
+    load = registry._load
+
+    def record_load(chat_id):
+        loaded_on.append(threading.current_thread().name)
+        return load(chat_id)
+    monkeypatch.setattr(registry, '_load', record_load)
+
+    async def updates_from_new_group():
+        # Two updates from the same group arrive before its partition is loaded
+        return await asyncio.gather(
+            registry.for_chat(-100, 'group', 1), registry.for_chat(-100, 'supergroup', 2)
+        )
+    first, second = asyncio.run(updates_from_new_group())
+    assert first is second is registry.by_chat[-100]
+    assert len(loaded_on) == 1 and loaded_on[0].startswith('storage')
+    assert asyncio.run(registry.for_chat(2, 'private', 2)) is first
+
+    # Another worker's group shows up on disk
+    (tmp_path / 'partitions' / '-200').mkdir()
+    asyncio.run(registry.discover_async())
+    assert -200 in registry.by_chat and loaded_on[-1].startswith('storage')
+    registry.close()
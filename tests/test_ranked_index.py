@@ -0,0 +1,104 @@
+"""RankedIndex-backed leaderboards must match the old scan-and-sort over user_deficits"""
+import random
+
+import pytest
+
+import telegram_video_bot as t
+
+PERIODS = ('day', 'week', 'month', 'all')
+
+
+def scan_leaderboard(bot, period):
+    """The scan-and-sort get_leaderboard() used before the ranked index"""
+    period_key = bot.get_period_key(period)
+    leaderboard = []
+    for user_id, data in bot.user_deficits.items():
+        if period == 'day':
+            time_worked = data.get('daily_worked', {}).get(period_key, 0)
+        elif period == 'week':
+            time_worked = data.get('weekly_worked', {}).get(period_key, 0)
+        elif period == 'month':
+            time_worked = data.get('monthly_worked', {}).get(period_key, 0)
+        else:
+            time_worked = data.get('total_worked_seconds', 0)
+        if time_worked > 0:
+            leaderboard.append({
+                'user_id': user_id,
+                'username': data['username'],
+                'unique_id': data.get('unique_id', 0),
+                'time_worked': time_worked,
+                'streak': data.get('streak_days', 0)
+            })
+    leaderboard.sort(key=lambda x: x['time_worked'], reverse=True)
+    return leaderboard
+
+
+def scan_rank(bot, user_id, period):
+    leaderboard = scan_leaderboard(bot, period)
+    for position, entry in enumerate(leaderboard, 1):
+        if entry['user_id'] == str(user_id):
+            ahead = leaderboard[position - 2] if position > 1 else None
+            return {
+                'rank': position,
+                'total': len(leaderboard),
+                'time_worked': entry['time_worked'],
+                'percentile': 100.0 * (len(leaderboard) - position + 1) / len(leaderboard),
+                'next_username': ahead['username'] if ahead else None,
+                'gap_to_next': ahead['time_worked'] - entry['time_worked'] if ahead else 0
+            }
+    return None
+
+
+def assert_matches_scan(bot, user_ids):
+    for period in PERIODS:
+        expected = scan_leaderboard(bot, period)
+        assert bot.get_leaderboard(period) == expected
+        assert bot.get_leaderboard(period, limit=3) == expected[:3]
+        for user_id in user_ids:
+            assert bot.get_user_rank(user_id, period) == scan_rank(bot, user_id, period)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_leaderboards_match_scan_and_sort(bot, clock, seed):
+    rng = random.Random(seed)
+    user_ids = list(range(1001, 1013))
+    for _ in range(300):
+        action = rng.random()
+        user_id = rng.choice(user_ids)
+        if action < 0.75:
+            # Few distinct lengths, so ties are common
+            bot.add_video_time(user_id, f"user{user_id}", rng.choice((600, 1800, 3600, 7200)))
+        elif action < 0.85:
+            bot.reset_user_deficit(user_id)
+        else:
+            clock.advance(hours=rng.choice((6, 24, 24 * 7, 24 * 31)))
+        assert_matches_scan(bot, user_ids)
+
+
+def test_ties_keep_insertion_order(bot, clock):
+    for user_id in (3, 1, 2):
+        bot.add_video_time(user_id, f"user{user_id}", 3600)
+    assert [entry['user_id'] for entry in bot.get_leaderboard('day')] == ['3', '1', '2']
+
+    # A reset user who comes back joins the tie at the end, as in the dict scan
+    bot.reset_user_deficit(3)
+    bot.add_video_time(3, 'user3', 3600)
+    assert [entry['user_id'] for entry in bot.get_leaderboard('day')] == ['1', '2', '3']
+    assert_matches_scan(bot, [1, 2, 3])
+
+
+def test_ranked_index_positions():
+    index = t.RankedIndex()
+    scores = {f"u{i}": (i * 37) % 11 for i in range(50)}
+    for order, (user_key, score) in enumerate(scores.items()):
+        index.update(user_key, score, order)
+    expected = sorted(
+        ((user_key, score) for user_key, score in scores.items() if score > 0),
+        key=lambda item: item[1], reverse=True
+    )
+    assert index.top() == expected
+    assert len(index) == len(expected)
+    for position, (user_key, score) in enumerate(expected, 1):
+        assert index.rank(user_key) == position
+        assert index.at(position) == (user_key, score)
+    assert index.rank('u0') is None
@@ -0,0 +1,100 @@
+"""Midnight rollovers close the day whether or not reminders are enabled"""
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+
+import telegram_video_bot as t
+
+
+def test_rollover_runs_without_reminder_chat(bot, monkeypatch):
+    monkeypatch.setattr(t.partitions.default, 'reminder_chat_id', None)
+    timezone = t.partitions.default.timezone
+    yesterday = (datetime.now(ZoneInfo(timezone)) - timedelta(days=1)).strftime('%Y-%m-%d')
+    bot.add_video_time(1, 'user1', 1800)
+    data = bot.user_deficits['1']
+    data['today_date'] = yesterday
+    data['last_rollover_date'] = (datetime.now(ZoneInfo(timezone)) - timedelta(days=2)).strftime('%Y-%m-%d')
+
+    application = SimpleNamespace(bot=None)
+    asyncio.run(t.send_midnight_summary(application, timezone))
+    assert data['last_rollover_date'] == yesterday
+    assert data['total_deficit_seconds'] == t.MIN_DURATION - 1800
+
+    # A restart afterwards has nothing left to catch up
+    assert bot.catch_up_rollovers() == []
+    assert data['total_deficit_seconds'] == t.MIN_DURATION - 1800
+
+
+def test_period_counters_use_the_users_day(bot, clock, monkeypatch):
+    monkeypatch.setattr(t.partitions.default, 'timezone', 'UTC')
+    t.partitions.default.user_timezones['2'] = 'Asia/Tokyo'
+    clock.now = datetime(2026, 3, 2, 23, 30, tzinfo=ZoneInfo('UTC'))  # already Mar 3 in Tokyo
+
+    bot.add_video_time(1, 'user1', 600)
+    bot.add_video_time(2, 'user2', 600)
+    assert bot.user_deficits['1']['daily_worked'] == {'2026-03-02': 600}
+    assert bot.user_deficits['2']['daily_worked'] == {'2026-03-03': 600}
+    assert bot.user_deficits['2']['today_date'] == '2026-03-03'
+    assert bot.get_users_without_todays_video() == []
+
+    # A new day in UTC, still the same day in Tokyo
+    clock.advance(hours=1)
+    assert [user['user_id'] for user in bot.get_users_without_todays_video()] == ['1']
+
+
+def test_reversal_after_rollover_charges_the_users_day(bot, clock, monkeypatch):
+    monkeypatch.setattr(t.partitions.default, 'timezone', 'UTC')
+    t.partitions.default.user_timezones['2'] = 'Asia/Tokyo'
+    clock.now = datetime(2026, 3, 2, 23, 30, tzinfo=ZoneInfo('UTC'))
+    bot.add_video_time(2, 'user2', t.MIN_DURATION)
+    credit = {
+        'today_date': '2026-03-03', 'day': bot.get_period_key('day', 2),
+        'week': bot.get_period_key('week', 2), 'month': bot.get_period_key('month', 2),
+        'seconds': t.MIN_DURATION, 'deficit_reduction': 0
+    }
+
+    # Tokyo's Mar 3 closes with the goal met, then part of the video turns out to be missing
+    clock.advance(hours=15, minutes=30)
+    now = clock.now.astimezone(ZoneInfo('Asia/Tokyo'))
+    bot.apply_midnight_rollover(bot.plan_midnight_rollover(['2'], '2026-03-03', now))
+    assert bot.get_user_deficit(2) == 0
+    assert bot.reverse_video_time(2, 1800, credit) == 1800
+    assert bot.get_user_deficit(2) == 1800
+
+
+def test_day_ranking_uses_each_users_day(bot, clock, monkeypatch):
+    monkeypatch.setattr(t.partitions.default, 'timezone', 'UTC')
+    t.partitions.default.user_timezones['2'] = 'Asia/Tokyo'
+    clock.now = datetime(2026, 3, 2, 14, 0, tzinfo=ZoneInfo('UTC'))  # 23:00 in Tokyo
+
+    bot.add_video_time(1, 'user1', 600)
+    bot.add_video_time(2, 'user2', 1200)
+    assert [entry['user_id'] for entry in bot.get_leaderboard('day')] == ['2', '1']
+    assert bot.get_user_rank(2, 'day')['rank'] == 1
+
+    # Tokyo's Mar 2 is over: user2 starts the new day unranked, user1's day goes on
+    clock.advance(hours=2)
+    assert [(entry['user_id'], entry['time_worked']) for entry in bot.get_leaderboard('day')] == [('1', 600)]
+    assert bot.get_user_rank(2, 'day') is None
+    bot.add_video_time(2, 'user2', 300)
+    assert bot.get_user_rank(2, 'day')['time_worked'] == 300
+
+
+def test_catch_up_skips_days_before_a_user_joined(bot, monkeypatch):
+    timezone = t.partitions.default.timezone
+    now = datetime.now(ZoneInfo(timezone))
+    # The bot was down for three days
+    bot.rollover_runs[timezone] = {'day': (now - timedelta(days=4)).strftime('%Y-%m-%d')}
+
+    bot.add_video_time(1, 'user1', 1800)
+    bot.assign_user_id(2, 'user2')
+    bot.user_deficits['3'] = dict(bot.user_deficits['2'], username='user3')
+    del bot.user_deficits['3']['last_rollover_date']  # saved before rollovers were tracked per user
+    bot._register_user('3')
+
+    assert bot.catch_up_rollovers() == []
+    for user_key in ('1', '2', '3'):
+        data = bot.user_deficits[user_key]
+        assert data['total_deficit_seconds'] == 0
+        assert data['last_rollover_date'] == (now - timedelta(days=1)).strftime('%Y-%m-%d')
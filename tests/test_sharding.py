@@ -0,0 +1,121 @@
+"""Sharded workers share one database; a video is credited by only one of them"""
+import asyncio
+from types import SimpleNamespace
+
+import telegram_video_bot as t
+
+
+class Message:
+    def __init__(self, user_id, video):
+        self.from_user = SimpleNamespace(id=user_id, username=f"user{user_id}", first_name='User')
+        self.chat = SimpleNamespace(id=user_id, type='private')
+        self.video = video
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+    async def delete(self):
+        pass
+
+
+def test_unflushed_video_is_not_credited_twice(tmp_path, clock, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(t, 'WORKER_COUNT', 2)
+    db_file = str(tmp_path / 'bot_data.sqlite3')
+    workers = [
+        t.VideoBot(storage=t.SqliteStorage(db_file), activity_log=t.ActivityLog(log_dir=str(tmp_path / f"logs{n}")))
+        for n in range(2)
+    ]
+    video = SimpleNamespace(
+        file_id='file1', file_unique_id='unique1', duration=3600, width=1280, height=720,
+        file_size=1000, mime_type='video/mp4', thumbnail=None
+    )
+    replies = []
+    for worker, user_id in zip(workers, (2, 3)):
+        monkeypatch.setattr(t.partitions.default, 'bot', worker)
+        message = Message(user_id, video)
+        asyncio.run(t.process_video_submission(SimpleNamespace(bot=None), [message]))
+        replies.append(message.replies[0])
+
+    assert workers[0].get_user_total_hours(2) == 3600
+    assert workers[1].get_user_total_hours(3) == 0
+    assert 'already been submitted' in replies[1] and '@user2' in replies[1]
+    for worker in workers:
+        worker.io_executor.shutdown(wait=True)
+
+
+def test_losing_claim_takes_the_winners_row(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db_file = str(tmp_path / 'bot_data.sqlite3')
+    workers = [
+        t.VideoBot(storage=t.SqliteStorage(db_file), activity_log=t.ActivityLog(log_dir=str(tmp_path / f"logs{n}")))
+        for n in range(2)
+    ]
+    # Both checked the database before either claimed, so both recorded the video
+    workers[0].add_video_hash('file1', 'unique1', 2, 'user2', 3600)
+    workers[1].add_video_hash('file1', 'unique1', 3, 'user3', 3600)
+
+    assert asyncio.run(workers[0].claim_video_hash('unique1')) is None
+    original = asyncio.run(workers[1].claim_video_hash('unique1'))
+    assert original['username'] == 'user2'
+    assert workers[1].video_index.get('unique1')['username'] == 'user2'
+
+    # Flushing the losing worker must not overwrite the winner's row
+    workers[1].flush()
+    assert workers[0].storage.find_video_hash('unique1')[1] == 'user2'
+    for worker in workers:
+        worker.io_executor.shutdown(wait=True)
+
+
+def test_refresh_reloads_only_changed_rows(tmp_path, clock, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(t, 'WORKER_COUNT', 2)
+    db_file = str(tmp_path / 'bot_data.sqlite3')
+    workers = [
+        t.VideoBot(storage=t.SqliteStorage(db_file), activity_log=t.ActivityLog(log_dir=str(tmp_path / f"logs{n}")))
+        for n in range(2)
+    ]
+    workers[0].add_video_time(2, 'user2', 3600)
+    workers[0].add_video_hash('file1', 'unique1', 2, 'user2', 3600)
+    workers[0].flush()
+
+    monkeypatch.setattr(t, 'WORKER_ID', 1)
+    asyncio.run(workers[1].refresh_from_storage())  # the first refresh loads everything
+    assert workers[1].get_user_total_hours(2) == 3600
+
+    workers[0].add_video_time(2, 'user2', 1800)
+    workers[0].add_video_hash('file2', 'unique2', 2, 'user2', 1800)
+    workers[0].flush()
+
+    def full_reload():
+        raise AssertionError("refresh reloaded the whole table")
+    monkeypatch.setattr(workers[1].storage, 'load_users', full_reload)
+    monkeypatch.setattr(workers[1].storage, 'load_video_hashes', full_reload)
+    asyncio.run(workers[1].refresh_from_storage())
+    assert workers[1].get_user_total_hours(2) == 5400
+    assert workers[1].video_index.get('unique2')['username'] == 'user2'
+    for worker in workers:
+        worker.io_executor.shutdown(wait=True)
+
+
+def test_refresh_reloads_everything_after_falling_behind_the_change_log(tmp_path, clock, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(t, 'WORKER_COUNT', 2)
+    db_file = str(tmp_path / 'bot_data.sqlite3')
+    workers = [
+        t.VideoBot(storage=t.SqliteStorage(db_file), activity_log=t.ActivityLog(log_dir=str(tmp_path / f"logs{n}")))
+        for n in range(2)
+    ]
+    monkeypatch.setattr(t, 'WORKER_ID', 1)
+    asyncio.run(workers[1].refresh_from_storage())
+
+    workers[0].add_video_time(2, 'user2', 3600)
+    workers[0].flush()
+    # The entries were pruned before worker 1 read them
+    with workers[0].storage.conn:
+        workers[0].storage.conn.execute("DELETE FROM changes")
+    asyncio.run(workers[1].refresh_from_storage())
+    assert workers[1].get_user_total_hours(2) == 3600
+    for worker in workers:
+        worker.io_executor.shutdown(wait=True)
@@ -0,0 +1,18 @@
+"""The JSON backend's cold archive of old duplicate-check entries"""
+import telegram_video_bot as t
+
+
+def test_archive_lookups(tmp_path):
+    storage = t.create_storage(str(tmp_path))
+    assert storage.find_archived_video('a') is None
+
+    storage.archive_video_hashes({'a': ['1', 'user1', 600, 1], 'b': ['2', 'user2', 700, 2]})
+    assert storage.find_archived_video('b') == ['2', 'user2', 700, 2]
+    storage.archive_video_hashes({'c': ['3', 'usér3', 800, 3]})
+    assert storage.find_archived_video('c') == ['3', 'usér3', 800, 3]
+    assert storage.find_archived_video('d') is None
+
+    # A fresh process builds the ID index from the file
+    reopened = t.create_storage(str(tmp_path))
+    assert [reopened.find_archived_video(key)[2] for key in 'abc'] == [600, 700, 800]
+    assert dict(reopened.iter_archived_videos())['a'] == ['1', 'user1', 600, 1]
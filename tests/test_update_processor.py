@@ -0,0 +1,134 @@
+"""Concurrent per-user update processing credits exactly what one-at-a-time processing does, faster"""
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+import telegram_video_bot as t
+
+REPLY_LATENCY = 0.005  # stand-in for a Bot API round trip
+
+
+class FakeMessage:
+    def __init__(self, user, video=None, text=None):
+        self.from_user = user
+        self.chat = SimpleNamespace(id=user.id, type='private')
+        self.chat_id = user.id
+        self.video = video
+        self.text = text
+        self.media_group_id = None
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        await asyncio.sleep(REPLY_LATENCY)
+        self.replies.append(text)
+
+    async def delete(self):
+        await asyncio.sleep(REPLY_LATENCY)
+
+
+def fake_video(number):
+    return SimpleNamespace(
+        file_id=f"file{number}", file_unique_id=f"unique{number}",
+        duration=300 + number * 60, width=1280, height=720,
+        file_size=10_000_000 + number, mime_type='video/mp4', thumbnail=None
+    )
+
+
+def make_updates(seed=7, users=8, count=200):
+    """Videos, albums and /myhours commands from overlapping users, with shared and repeated videos"""
+    rng = random.Random(seed)
+    updates = []
+    for _ in range(count):
+        user_id = rng.randrange(1, users + 1)
+        user = SimpleNamespace(id=user_id, username=f"user{user_id}", first_name='User')
+        kind = rng.random()
+        # A small pool of videos, so both cross-user and same-user duplicates happen
+        if kind < 0.2:
+            messages = [FakeMessage(user, text='/myhours')]
+        elif kind < 0.5:
+            messages = [FakeMessage(user, video=fake_video(rng.randrange(25))) for _ in range(rng.randrange(2, 5))]
+        else:
+            messages = [FakeMessage(user, video=fake_video(rng.randrange(25)))]
+        updates.append(SimpleNamespace(
+            effective_user=user, effective_chat=messages[0].chat, message=messages[0], messages=messages
+        ))
+    return updates
+
+
+def handle(update, context):
+    """The coroutine the bot runs for an update (an album is credited as one batch)"""
+    if len(update.messages) > 1:
+        return t.process_video_submission(context, update.messages)
+    if update.message.video:
+        return t.handle_video(update, context)
+    return t.my_hours_command(update, context)
+
+
+def outcome(video_bot, updates):
+    replies = [reply for update in updates for message in update.messages for reply in message.replies]
+    owned = {}
+    for entry in video_bot.video_index.entries.values():
+        owned[entry[0]] = owned.get(entry[0], 0) + entry[2]
+    return {
+        'credited': sum(data['total_worked_seconds'] for data in video_bot.user_deficits.values()),
+        'videos': sorted(video_bot.video_index.entries),
+        # Each user is credited exactly for the videos the index says they submitted first
+        'double_credited': {
+            user_key: data['total_worked_seconds'] - owned.get(user_key, 0)
+            for user_key, data in video_bot.user_deficits.items()
+            if data['total_worked_seconds'] != owned.get(user_key, 0)
+        },
+        'errors': sum('error occurred' in reply for reply in replies)
+    }
+
+
+async def run_updates(updates, context, max_concurrent_updates):
+    processor = t.PerUserUpdateProcessor(max_concurrent_updates=max_concurrent_updates)
+    await asyncio.gather(*(
+        processor.process_update(update, handle(update, context)) for update in updates
+    ))
+    assert processor.user_locks == {}
+
+
+def timed_run(make_bot, monkeypatch, max_concurrent_updates):
+    """Process the same updates on a fresh bot; returns the bot, the updates and the seconds taken"""
+    video_bot = make_bot()
+    monkeypatch.setattr(t.partitions.default, 'bot', video_bot)
+    updates = make_updates()
+    started = time.perf_counter()
+    asyncio.run(run_updates(updates, SimpleNamespace(bot=None, args=[]), max_concurrent_updates))
+    return video_bot, updates, time.perf_counter() - started
+
+
+def test_concurrent_processing_matches_serial(make_bot, clock, monkeypatch):
+    # One update at a time is what the bot did before concurrent processing
+    serial_bot, serial_updates, serial_time = timed_run(make_bot, monkeypatch, 1)
+    concurrent_bot, concurrent_updates, concurrent_time = timed_run(make_bot, monkeypatch, 16)
+
+    expected = outcome(serial_bot, serial_updates)
+    assert expected['errors'] == 0 and expected['double_credited'] == {}
+    submitted = sum(len(update.messages) for update in serial_updates if update.message.video)
+    assert len(expected['videos']) < submitted  # some were duplicates
+    assert outcome(concurrent_bot, concurrent_updates) == expected
+    # Replies to different users overlap, so the same updates go through several times faster
+    assert concurrent_time < serial_time / 2, f"{serial_time:.2f}s one at a time vs {concurrent_time:.2f}s concurrently"
+
+
+def test_each_users_updates_run_in_order():
+    processor = t.PerUserUpdateProcessor(max_concurrent_updates=8)
+    seen = []
+
+    async def step(user_id, n):
+        await asyncio.sleep(random.random() / 1000)
+        seen.append((user_id, n))
+
+    async def main():
+        await asyncio.gather(*(
+            processor.process_update(SimpleNamespace(effective_user=SimpleNamespace(id=user_id)), step(user_id, n))
+            for n in range(20) for user_id in range(4)
+        ))
+
+    asyncio.run(main())
+    for user_id in range(4):
+        assert [n for uid, n in seen if uid == user_id] == list(range(20))
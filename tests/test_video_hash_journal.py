@@ -0,0 +1,28 @@
+"""The JSON backend journals video hash upserts and evictions instead of rewriting the file"""
+import os
+
+import telegram_video_bot as t
+
+
+def test_hash_saves_append_to_the_journal(tmp_path):
+    storage = t.JsonStorage(hash_file=str(tmp_path / 'video_hashes.json'), compact_after=3)
+    storage.load_video_hashes()
+    hashes = {'a': ['1', 'user1', 600, 1], 'b': ['2', 'user2', 700, 2]}
+    storage.save_video_hashes(hashes, ['a', 'b'])
+    assert not os.path.exists(storage.hash_file)
+
+    # Evicting 'a' is the third record, which folds the journal into the snapshot
+    del hashes['a']
+    storage.save_video_hashes(hashes, ['a'])
+    assert not os.path.exists(storage.hash_journal_file)
+    assert storage._read(storage.hash_file) == {'b': ['2', 'user2', 700, 2]}
+
+    hashes['c'] = ['3', 'user3', 800, 3]
+    storage.save_video_hashes(hashes, ['c'])
+    # A torn last line from a crash mid-append is skipped
+    with open(storage.hash_journal_file, 'a') as f:
+        f.write('{"id": "d", "ent')
+
+    reopened = t.JsonStorage(hash_file=str(tmp_path / 'video_hashes.json'), compact_after=3)
+    assert reopened.load_video_hashes() == {'b': ['2', 'user2', 700, 2], 'c': ['3', 'user3', 800, 3]}
+    assert not os.path.exists(reopened.hash_journal_file)
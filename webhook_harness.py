@@ -0,0 +1,104 @@
+"""Post synthetic Telegram updates to a locally running bot in webhook mode.
+
+Start the bot with WEBHOOK_URL set (use a test bot token - the bot registers
+the webhook with Telegram on startup), then run e.g.:
+
+    python webhook_harness.py --count 50 --secret <WEBHOOK_SECRET>
+
+Replies to the fake chats will fail at the Bot API, which is expected; this
+checks that the listener accepts signed updates, rejects unsigned ones, and
+how long the endpoint takes to answer.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+
+def make_message(update_id, user_id, chat_id, kind):
+    """Build a Telegram-shaped update: a /status command or a video"""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private' if chat_id == user_id else 'group'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test', 'username': f'test_{user_id}'},
+    }
+    if kind == 'video':
+        message['video'] = {
+            'file_id': f'synthetic-{update_id}',
+            'file_unique_id': f'synthetic-unique-{update_id}',
+            'width': 1280,
+            'height': 720,
+            'duration': 600,
+        }
+    else:
+        message['text'] = '/status'
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': 7}]
+    return {'update_id': update_id, 'message': message}
+
+
+def post(url, update, secret):
+    """POST one update; returns (HTTP status, seconds taken)"""
+    request = urllib.request.Request(url, data=json.dumps(update).encode(), method='POST')
+    request.add_header('Content-Type', 'application/json')
+    if secret:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - started
+
+
+def main():
+    token = os.getenv('TELEGRAM_BOT_TOKEN', '')
+    default_secret = os.getenv('WEBHOOK_SECRET') or (hashlib.sha256(token.encode()).hexdigest()[:32] if token else None)
+    default_url = f"http://127.0.0.1:{os.getenv('PORT', '8080')}/{os.getenv('WEBHOOK_PATH', 'telegram')}"
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default=default_url)
+    parser.add_argument('--secret', default=default_secret)
+    parser.add_argument('--count', type=int, default=20, help='number of updates to send')
+    parser.add_argument('--kind', choices=['command', 'video'], default='command')
+    parser.add_argument('--users', type=int, default=5, help='spread updates over this many fake users')
+    parser.add_argument('--chat-id', type=int, default=None, help='group chat id (default: private chats)')
+    args = parser.parse_args()
+
+    # An update without the secret must be rejected
+    status, _ = post(args.url, make_message(1, 1, 1, 'command'), None)
+    print(f"{'✅' if status == 403 else '❌'} Unsigned update -> HTTP {status} (expected 403)")
+
+    timings = []
+    failures = 0
+    first_id = int(time.time())
+    for i in range(args.count):
+        user_id = 900000000 + i % args.users
+        chat_id = args.chat_id or user_id
+        status, took = post(args.url, make_message(first_id + i, user_id, chat_id, args.kind), args.secret)
+        timings.append(took)
+        if status != 200:
+            failures += 1
+            print(f"❌ Update {i + 1} -> HTTP {status}")
+
+    timings.sort()
+    print(f"📨 Sent {args.count} {args.kind} updates, {failures} rejected")
+    if timings:
+        print(
+            f"⏱️ Latency: median {timings[len(timings) // 2] * 1000:.1f} ms, "
+            f"max {timings[-1] * 1000:.1f} ms"
+        )
+
+
+if __name__ == '__main__':
+    main()